@@ -1,174 +1,159 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from datetime import date, timedelta
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, send_file, stream_with_context
+import click
+import os
 import sqlite3
-from datetime import datetime
+import sys
+
+import backup
+import bindu
+import change_feed
+import consolidation
+import dashboard_stats
+import db
+import employee_export
+import employee_import
+import employee_list
+import employee_records
+import employee_search
+import federation
+import http_cache
+import jobs
+import lookups
+import metrics
+import migrations
+import query_audit
+import report_db
+import retirement_forecast
+import seniority
+import vacancy_projection
+from db import get_db
+from report_db import get_report_db
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
+app.config['DATABASE'] = os.environ.get('EMPLOYEE_DB', db.DEFAULT_DATABASE)
+app.config['METRICS_ENABLED'] = os.environ.get('EMPLOYEE_METRICS', '1') != '0'
+# Hours between scheduled snapshots (see backup.py); 0 turns them off
+app.config['BACKUP_INTERVAL_HOURS'] = float(os.environ.get('EMPLOYEE_BACKUP_HOURS', '0'))
+# Office databases for the district views, separated by os.pathsep
+app.config['FEDERATION_DATABASES'] = [path for path in os.environ.get('EMPLOYEE_FEDERATION', '').split(os.pathsep)
+                                      if path]
+# Seconds a report may lag behind the live database (see report_db.py); 0
+# reads the live database directly
+app.config['REPORT_MAX_STALENESS'] = float(os.environ.get('EMPLOYEE_REPORT_STALENESS', '0'))
+db.init_app(app)
+federation.init_app(app)
+jobs.init_app(app)
+metrics.init_app(app)
+migrations.init_app(app)
+report_db.init_app(app)
+# After migrations, whose before_request hook creates the jobs table
+backup.init_app(app)
 
-# Database initialization
+# Database initialization: apply any pending schema migrations
 def init_db():
-    conn = sqlite3.connect('employee.db')
-    c = conn.cursor()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    applied = migrations.migrate(conn)
+    conn.close()
+    return applied
+
+@app.cli.command('migrate')
+def migrate_command():
+    applied = init_db()
+    print('Applied %d migration(s); schema is at version %d' % (applied, migrations.LATEST_VERSION))
+
+@app.cli.command('audit-queries')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query, not only flagged ones.')
+def audit_queries_command(verbose):
+    init_db()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    results = query_audit.audit(conn)
+    conn.close()
     
-    # Create tables
-    c.execute('''CREATE TABLE IF NOT EXISTS offices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        office_name TEXT UNIQUE NOT NULL
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS designations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        designation_name TEXT UNIQUE NOT NULL
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS classes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        class_name TEXT UNIQUE NOT NULL
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS salary_categories (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category_name TEXT UNIQUE NOT NULL
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS castes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        caste_name TEXT UNIQUE NOT NULL
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS sub_castes (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        caste_id INTEGER,
-        sub_caste_name TEXT NOT NULL,
-        FOREIGN KEY (caste_id) REFERENCES castes(id)
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS employees (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        full_name TEXT NOT NULL,
-        gender TEXT NOT NULL,
-        birth_date DATE NOT NULL,
-        office_id INTEGER,
-        designation_id INTEGER,
-        class_id INTEGER,
-        salary_category_id INTEGER,
-        joining_date DATE,
-        joining_designation_id INTEGER,
-        caste_id INTEGER,
-        sub_caste_id INTEGER,
-        caste_verified BOOLEAN DEFAULT FALSE,
-        caste_verification_date DATE,
-        bindu_number TEXT,
-        department_exam_passed BOOLEAN DEFAULT FALSE,
-        department_exam_year INTEGER,
-        pranidhi_id TEXT,
-        bank_name TEXT,
-        ifsc_code TEXT,
-        account_number TEXT,
-        aadhar_number TEXT,
-        gpf_number TEXT,
-        retirement_date DATE,
-        /* Transfer history fields */
-        previous_office_release_date DATE,
-        previous_district TEXT,
-        previous_designation TEXT,
-        current_joining_date DATE,
-        FOREIGN KEY (office_id) REFERENCES offices(id),
-        FOREIGN KEY (designation_id) REFERENCES designations(id),
-        FOREIGN KEY (class_id) REFERENCES classes(id),
-        FOREIGN KEY (salary_category_id) REFERENCES salary_categories(id),
-        FOREIGN KEY (joining_designation_id) REFERENCES designations(id),
-        FOREIGN KEY (caste_id) REFERENCES castes(id),
-        FOREIGN KEY (sub_caste_id) REFERENCES sub_castes(id)
-    )''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS office_positions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        office_id INTEGER,
-        designation_id INTEGER,
-        approved_count INTEGER DEFAULT 0,
-        filled_count INTEGER DEFAULT 0,
-        vacant_count INTEGER DEFAULT 0,
-        FOREIGN KEY (office_id) REFERENCES offices(id),
-        FOREIGN KEY (designation_id) REFERENCES designations(id)
-    )''')
-    
-    # Create office profile table
-    c.execute('''CREATE TABLE IF NOT EXISTS office_profile (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        office_name TEXT,
-        office_address TEXT,
-        email TEXT,
-        phone TEXT,
-        officer_name TEXT,
-        designation TEXT,
-        district_name TEXT,
-        senior_clerk_names TEXT,
-        junior_clerk_names TEXT
-    )''')
-    
-    # Create transfer history table
-    c.execute('''CREATE TABLE IF NOT EXISTS transfer_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        employee_id INTEGER,
-        previous_office_release_date DATE,
-        previous_district TEXT,
-        previous_designation TEXT,
-        current_joining_date DATE,
-        FOREIGN KEY (employee_id) REFERENCES employees(id)
-    )''')
-    
-    # Create promotion history table
-    c.execute('''CREATE TABLE IF NOT EXISTS promotion_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        employee_id INTEGER,
-        designation TEXT,
-        joining_date DATE,
-        promotion_date DATE,
-        designation_name TEXT,
-        FOREIGN KEY (employee_id) REFERENCES employees(id)
-    )''')
-    
-    # Insert default data
+    print(query_audit.format_report(results, verbose))
+    if any(problems for name, plan, problems in results):
+        sys.exit(1)
+
+@app.cli.command('import-employees')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=employee_import.BATCH_SIZE, show_default=True,
+              help='Rows inserted per transaction.')
+def import_employees_command(path, batch_size):
+    init_db()
+    with open(path, 'rb') as f:
+        try:
+            records = employee_import.read_file(f, path)
+            report = employee_import.import_employees(get_db(), records, batch_size)
+        except employee_import.ImportFormatError as e:
+            raise click.ClickException(str(e))
+    
+    print('%d row(s) read, %d inserted, %d rejected' % (report['rows'], report['inserted'], len(report['errors'])))
+    for error in report['errors']:
+        print('  row %d: %s' % (error['row'], error['error']))
+
+@app.cli.command('backup')
+def backup_command():
+    init_db()
+    conn = db.connect(app.config['DATABASE'], app.config)
     try:
-        c.execute("INSERT INTO offices (office_name) VALUES ('मुख्यालय')")
-        c.execute("INSERT INTO offices (office_name) VALUES ('उपकार्यालय 1')")
-        c.execute("INSERT INTO offices (office_name) VALUES ('उपकार्यालय 2')")
-        
-        c.execute("INSERT INTO designations (designation_name) VALUES ('जेसी')")
-        c.execute("INSERT INTO designations (designation_name) VALUES ('एनक्लेव')")
-        c.execute("INSERT INTO designations (designation_name) VALUES ('लेक्टर')")
-        
-        c.execute("INSERT INTO classes (class_name) VALUES ('क्लास 1')")
-        c.execute("INSERT INTO classes (class_name) VALUES ('क्लास 2')")
-        c.execute("INSERT INTO classes (class_name) VALUES ('क्लास 3')")
-        c.execute("INSERT INTO classes (class_name) VALUES ('क्लास 4')")
-        
-        c.execute("INSERT INTO salary_categories (category_name) VALUES ('श्रेणी A')")
-        c.execute("INSERT INTO salary_categories (category_name) VALUES ('श्रेणी B')")
-        c.execute("INSERT INTO salary_categories (category_name) VALUES ('श्रेणी C')")
-        
-        c.execute("INSERT INTO castes (caste_name) VALUES ('हिंदु')")
-        c.execute("INSERT INTO castes (caste_name) VALUES ('मुस्लिम')")
-        c.execute("INSERT INTO castes (caste_name) VALUES ('इतर')")
-        
-        c.execute("INSERT INTO sub_castes (caste_id, sub_caste_name) VALUES (1, 'मागासवर्ग')")
-        c.execute("INSERT INTO sub_castes (caste_id, sub_caste_name) VALUES (1, 'अन्य मागासवर्ग')")
-        c.execute("INSERT INTO sub_castes (caste_id, sub_caste_name) VALUES (3, 'इतर')")
-        
-        # Insert default office profile if not exists
-        c.execute("SELECT COUNT(*) FROM office_profile")
-        if c.fetchone()[0] == 0:
-            c.execute("""INSERT INTO office_profile 
-                         (office_name, office_address, email, phone, officer_name, designation, district_name, senior_clerk_names, junior_clerk_names)
-                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
-                      ("मुख्यालय", "", "", "", "", "", "", "", ""))
-        
-        conn.commit()
-    except sqlite3.IntegrityError:
-        pass  # Data already exists
+        directory = backup.backup_dir()
+        manifest = backup.snapshot(conn, directory)
+        removed = backup.prune(directory, app.config['BACKUP_KEEP'])
+    finally:
+        conn.close()
+    print('Snapshot %s written (%d pages, %d bytes compressed); %d old snapshot(s) removed'
+          % (os.path.join(directory, manifest['file']), manifest['pages'], manifest['archive_size'], len(removed)))
+
+@app.cli.command('restore-backup')
+@click.argument('archive', type=click.Path(exists=True, dir_okay=False))
+@click.confirmation_option(prompt='This replaces every row in the database. Continue?')
+def restore_backup_command(archive):
+    init_db()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    try:
+        directory = backup.backup_dir()
+        manifest, saved = backup.restore(conn, archive, directory)
+    except backup.BackupError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
     
-    conn.close()
+    # An older snapshot is brought up to date straight away
+    applied = init_db()
+    print('Previous database saved as %s' % os.path.join(directory, saved['file']))
+    print('Restored the snapshot taken at %s (schema version %d, %d migration(s) applied)'
+          % (manifest['created_at'], manifest['schema_version'], applied))
+
+# Fold office databases into this one (see consolidation.py)
+@app.cli.command('consolidate')
+@click.argument('sources', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=int, default=None, help='Processes reading the sources (default: one per CPU).')
+@click.option('--batch-size', default=consolidation.BATCH_SIZE, show_default=True,
+              help='Employees written per transaction.')
+def consolidate_command(sources, workers, batch_size):
+    master = os.path.realpath(app.config['DATABASE'])
+    if any(os.path.realpath(source) == master for source in sources):
+        raise click.ClickException('The master database %s cannot also be a source' % app.config['DATABASE'])
+    
+    init_db()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    try:
+        report = consolidation.merge(conn, list(sources), workers, batch_size)
+    finally:
+        conn.close()
+    
+    print('%d source(s) read, %d failed; %d employee(s): %d inserted, %d updated, %d unchanged, %d conflict(s); '
+          '%d lookup name(s) added' % (report['sources'], len(report['failed']), report['employees'],
+                                      report['inserted'], report['updated'], report['unchanged'],
+                                      len(report['conflicts']), report['lookups_added']))
+    for failure in report['failed']:
+        print('  %s: %s' % (failure['source'], failure['error']))
+    for conflict in report['conflicts']:
+        print('  %s, employee %d (%s): %s' % (conflict['source'], conflict['employee_id'], conflict['full_name'],
+                                            conflict['conflict']))
+    for conflict in report['lookup_conflicts']:
+        print('  %s, sub-caste %s: %s' % (conflict['source'], conflict['sub_caste'], conflict['conflict']))
 
 @app.route('/')
 def index():
@@ -196,28 +181,17 @@ def dashboard():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    # Get statistics
-    conn = sqlite3.connect('employee.db')
-    c = conn.cursor()
-    
-    # Total employees
-    c.execute("SELECT COUNT(*) FROM employees")
-    total_employees = c.fetchone()[0]
-    
-    # Total offices
-    c.execute("SELECT COUNT(*) FROM offices")
-    total_offices = c.fetchone()[0]
-    
-    # Total designations
-    c.execute("SELECT COUNT(*) FROM designations")
-    total_designations = c.fetchone()[0]
-    
-    conn.close()
+    # Statistics are precomputed by triggers (see dashboard_stats.py)
+    stats = dashboard_stats.load(get_db())
     
     return render_template('dashboard.html', 
-                          total_employees=total_employees,
-                          total_offices=total_offices,
-                          total_designations=total_designations)
+                          total_employees=stats['total_employees'],
+                          total_offices=stats['total_offices'],
+                          total_designations=stats['total_designations'],
+                          total_vacancies=stats['total_vacancies'],
+                          retiring_this_year=stats['retiring_this_year'],
+                          retiring_next_year=stats['retiring_next_year'],
+                          office_stats=stats['offices'])
 
 @app.route('/logout')
 def logout():
@@ -229,46 +203,63 @@ def employees():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    conn = get_db()
+    
+    # Filters, sort and keyset cursor all come from the query string
+    filters = employee_list.parse_filters(request.args)
+    sort, order = employee_list.parse_sort(request.args)
+    page_size = employee_list.parse_page_size(request.args)
+    cursor = request.args.get('cursor')
+    
+    employees, next_cursor = employee_list.fetch_page(conn, filters, sort, order, page_size, cursor)
+    
+    # Dropdown data for the filter bar
+    lookup = lookups.get_lookups(conn)
+    
+    return render_template('employees.html', employees=employees,
+                          filters=filters,
+                          sort=sort,
+                          order=order,
+                          page_size=page_size,
+                          cursor=cursor,
+                          next_cursor=next_cursor,
+                          offices=lookup['offices'],
+                          designations=lookup['designations'],
+                          classes=lookup['classes'],
+                          castes=lookup['castes'])
+
+# Export the employee list (same filters and order as /employees) as CSV
+# or JSON Lines, streamed in batches
+@app.route('/employees/export')
+def export_employees():
+    if 'username' not in session:
+        return redirect(url_for('login'))
     
-    c.execute('''SELECT e.*, o.office_name, d.designation_name, c.class_name, sc.category_name,
-                 cd.caste_name, s.sub_caste_name, jd.designation_name as joining_designation_name
-                 FROM employees e
-                 LEFT JOIN offices o ON e.office_id = o.id
-                 LEFT JOIN designations d ON e.designation_id = d.id
-                 LEFT JOIN classes c ON e.class_id = c.id
-                 LEFT JOIN salary_categories sc ON e.salary_category_id = sc.id
-                 LEFT JOIN castes cd ON e.caste_id = cd.id
-                 LEFT JOIN sub_castes s ON e.sub_caste_id = s.id
-                 LEFT JOIN designations jd ON e.joining_designation_id = jd.id''')
-    
-    employees = c.fetchall()
-    conn.close()
+    fmt = request.args.get('format', 'csv')
+    if fmt not in employee_export.FORMATS:
+        return jsonify({'error': 'Unsupported format: %s (use csv or jsonl)' % fmt}), 400
     
-    return render_template('employees.html', employees=employees)
+    filters = employee_list.parse_filters(request.args)
+    sort, order = employee_list.parse_sort(request.args)
+    
+    chunks = employee_export.generate(get_report_db(), fmt, filters, sort, order)
+    return Response(stream_with_context(chunks),
+                    content_type=employee_export.FORMATS[fmt],
+                    headers={'Content-Disposition': 'attachment; filename=employees.%s' % fmt})
 
 @app.route('/employee/<int:id>')
+@http_cache.conditional('employees', 'transfer_history', 'promotion_history', 'offices', 'designations',
+                        'classes', 'salary_categories', 'castes', 'sub_castes')
 def view_employee(id):
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     c = conn.cursor()
     
-    c.execute('''SELECT e.*, o.office_name, d.designation_name, c.class_name, sc.category_name,
-                 cd.caste_name, s.sub_caste_name, jd.designation_name as joining_designation_name
-                 FROM employees e
-                 LEFT JOIN offices o ON e.office_id = o.id
-                 LEFT JOIN designations d ON e.designation_id = d.id
-                 LEFT JOIN classes c ON e.class_id = c.id
-                 LEFT JOIN salary_categories sc ON e.salary_category_id = sc.id
-                 LEFT JOIN castes cd ON e.caste_id = cd.id
-                 LEFT JOIN sub_castes s ON e.sub_caste_id = s.id
-                 LEFT JOIN designations jd ON e.joining_designation_id = jd.id
-                 WHERE e.id = ?''', (id,))
+    # The employee with its office, designation, class, caste and other
+    # lookup names already resolved
+    c.execute("SELECT * FROM employee_details WHERE id = ?", (id,))
     
     employee = c.fetchone()
     
@@ -282,10 +273,7 @@ def view_employee(id):
         promotion_history = c.fetchall()
         
         # Get all designations for display
-        c.execute("SELECT id, designation_name FROM designations")
-        designations = c.fetchall()
-        
-        conn.close()
+        designations = lookups.get_lookups(conn)['designations']
         
         return render_template('view_employee.html', employee=employee, 
                               transfer_history=transfer_history, 
@@ -300,22 +288,11 @@ def edit_employee(id):
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     c = conn.cursor()
     
-    # Get employee data
-    c.execute('''SELECT e.*, o.office_name, d.designation_name, c.class_name, sc.category_name,
-                 cd.caste_name, s.sub_caste_name, jd.designation_name as joining_designation_name
-                 FROM employees e
-                 LEFT JOIN offices o ON e.office_id = o.id
-                 LEFT JOIN designations d ON e.designation_id = d.id
-                 LEFT JOIN classes c ON e.class_id = c.id
-                 LEFT JOIN salary_categories sc ON e.salary_category_id = sc.id
-                 LEFT JOIN castes cd ON e.caste_id = cd.id
-                 LEFT JOIN sub_castes s ON e.sub_caste_id = s.id
-                 LEFT JOIN designations jd ON e.joining_designation_id = jd.id
-                 WHERE e.id = ?''', (id,))
+    # Get employee data, with the lookup names already resolved
+    c.execute("SELECT * FROM employee_details WHERE id = ?", (id,))
     
     employee = c.fetchone()
     
@@ -359,197 +336,50 @@ def edit_employee(id):
         current_joining_date = request.form.get('current_joining_date', None)
         
         # Calculate retirement date based on birth date and class
-        # For classes 1-4: 58 years from birth date
-        # For class 4: 60 years from birth date
-        retirement_date = None
-        if birth_date:
-            birth_datetime = datetime.strptime(birth_date, '%Y-%m-%d')
-            if class_id in ['1', '2', '3']:  # Classes 1-3
-                retirement_date = birth_datetime.replace(year=birth_datetime.year + 58).strftime('%Y-%m-%d')
-            elif class_id == '4':  # Class 4
-                retirement_date = birth_datetime.replace(year=birth_datetime.year + 60).strftime('%Y-%m-%d')
-        
-        # Store old office and designation for position update
-        old_office_id = employee['office_id']
-        old_designation_id = employee['designation_id']
-        
-        # Update employee data
-        c.execute('''UPDATE employees SET
-            full_name = ?, gender = ?, birth_date = ?, office_id = ?, designation_id = ?, class_id = ?, 
-            salary_category_id = ?, joining_date = ?, joining_designation_id = ?, caste_id = ?, 
-            sub_caste_id = ?, caste_verified = ?, caste_verification_date = ?, bindu_number = ?, 
-            department_exam_passed = ?, department_exam_year = ?, pranidhi_id = ?, bank_name = ?, 
-            ifsc_code = ?, account_number = ?, aadhar_number = ?, gpf_number = ?, retirement_date = ?,
-            previous_office_release_date = ?, previous_district = ?, 
-            previous_designation = ?, current_joining_date = ?
-            WHERE id = ?''',
-        (full_name, gender, birth_date, office_id, designation_id, class_id, 
-         salary_category_id, joining_date, joining_designation_id, caste_id, 
-         sub_caste_id, caste_verified, caste_verification_date, bindu_number, 
-         department_exam_passed, department_exam_year, pranidhi_id, bank_name, 
-         ifsc_code, account_number, aadhar_number, gpf_number, retirement_date,
-         previous_office_release_date, previous_district, 
-         previous_designation, current_joining_date, id))
-        
-        conn.commit()
+        retirement_date = employee_records.retirement_date_for(birth_date, class_id)
         
-        # Handle existing transfer history records
-        existing_transfer_ids = request.form.getlist('existing_transfer_id[]')
-        existing_release_dates = request.form.getlist('existing_transfer_release_date[]')
-        existing_districts = request.form.getlist('existing_transfer_district[]')
-        existing_designations = request.form.getlist('existing_transfer_designation[]')
-        existing_joining_dates = request.form.getlist('existing_transfer_joining_date[]')
-        
-        # Update or delete existing records
-        for i in range(len(existing_transfer_ids)):
-            transfer_id = existing_transfer_ids[i]
-            release_date = existing_release_dates[i] if i < len(existing_release_dates) else None
-            district = existing_districts[i] if i < len(existing_districts) else ''
-            designation = existing_designations[i] if i < len(existing_designations) else ''
-            joining_date = existing_joining_dates[i] if i < len(existing_joining_dates) else None
-            
-            if district or designation:
-                # Update existing record
-                c.execute('''UPDATE transfer_history SET 
-                            previous_office_release_date = ?, 
-                            previous_district = ?, previous_designation = ?, current_joining_date = ?
-                            WHERE id = ?''',
-                          (release_date, district, designation, joining_date, transfer_id))
-            else:
-                # Delete record if all fields are empty
-                c.execute("DELETE FROM transfer_history WHERE id = ?", (transfer_id,))
-        
-        conn.commit()
-        
-        # Add new transfer history records
-        transfer_release_dates = request.form.getlist('transfer_release_date[]')
-        transfer_districts = request.form.getlist('transfer_district[]')
-        transfer_designations = request.form.getlist('transfer_designation[]')
-        transfer_joining_dates = request.form.getlist('transfer_joining_date[]')
-        
-        for i in range(len(transfer_release_dates)):
-            release_date = transfer_release_dates[i] if i < len(transfer_release_dates) else None
-            district = transfer_districts[i] if i < len(transfer_districts) else ''
-            designation = transfer_designations[i] if i < len(transfer_designations) else ''
-            joining_date = transfer_joining_dates[i] if i < len(transfer_joining_dates) else None
-            
-            if district or designation:
-                c.execute('''INSERT INTO transfer_history 
-                            (employee_id, previous_office_release_date, 
-                             previous_district, previous_designation, current_joining_date)
-                            VALUES (?, ?, ?, ?, ?)''',
-                          (id, release_date, district, designation, joining_date))
-                conn.commit()
-        
-        # Update promotion history
-        # For now, we'll just update the initial joining record
-        c.execute('''UPDATE promotion_history SET 
-                    designation = ?, joining_date = ?, promotion_date = ?
-                    WHERE employee_id = ? AND joining_date = promotion_date''',
-                  (joining_designation_id, joining_date, joining_date, id))
-        conn.commit()
-        
-        # Handle existing promotion history records
-        existing_promotion_ids = request.form.getlist('existing_promotion_id[]')
-        existing_promotion_designation_ids = request.form.getlist('existing_promotion_designation_id[]')
-        existing_promotion_joining_dates = request.form.getlist('existing_promotion_joining_date[]')
-        existing_promotion_dates = request.form.getlist('existing_promotion_date[]')
-        existing_promotion_designation_names = request.form.getlist('existing_promotion_designation_name[]')
-        
-        # Update or delete existing records
-        for i in range(len(existing_promotion_ids)):
-            promotion_id = existing_promotion_ids[i]
-            designation_id = existing_promotion_designation_ids[i] if i < len(existing_promotion_designation_ids) else None
-            joining_date = existing_promotion_joining_dates[i] if i < len(existing_promotion_joining_dates) else None
-            promotion_date = existing_promotion_dates[i] if i < len(existing_promotion_dates) else None
-            designation_name = existing_promotion_designation_names[i] if i < len(existing_promotion_designation_names) else ''
-            
-            if designation_id and promotion_date:
-                # Update existing record
-                c.execute('''UPDATE promotion_history SET 
-                            designation = ?, joining_date = ?, promotion_date = ?, designation_name = ?
-                            WHERE id = ?''',
-                          (designation_id, joining_date, promotion_date, designation_name, promotion_id))
-            else:
-                # Delete record if required fields are empty (but not the initial joining record)
-                c.execute("SELECT joining_date, promotion_date FROM promotion_history WHERE id = ?", (promotion_id,))
-                record = c.fetchone()
-                if record and record[0] != record[1]:  # Don't delete the initial joining record
-                    c.execute("DELETE FROM promotion_history WHERE id = ?", (promotion_id,))
-        
-        conn.commit()
-        
-        # Add new promotion history records
-        promotion_designation_ids = request.form.getlist('promotion_designation_id[]')
-        promotion_joining_dates = request.form.getlist('promotion_joining_date[]')
-        promotion_dates = request.form.getlist('promotion_date[]')
-        promotion_designation_names = request.form.getlist('promotion_designation_name[]')
-        
-        for i in range(len(promotion_designation_ids)):
-            designation_id = promotion_designation_ids[i] if i < len(promotion_designation_ids) else None
-            joining_date = promotion_joining_dates[i] if i < len(promotion_joining_dates) else None
-            promotion_date = promotion_dates[i] if i < len(promotion_dates) else None
-            designation_name = promotion_designation_names[i] if i < len(promotion_designation_names) else ''
-            
-            if designation_id and promotion_date:
-                c.execute('''INSERT INTO promotion_history 
-                            (employee_id, designation, joining_date, promotion_date, designation_name)
-                            VALUES (?, ?, ?, ?, ?)''',
-                          (id, designation_id, joining_date, promotion_date, designation_name))
-                conn.commit()
-        
-        conn.close()
-        
-        # Update office position counts for old position if it changed
-        if old_office_id != office_id or old_designation_id != designation_id:
-            # Update old position counts
-            update_office_position_counts(old_office_id, old_designation_id)
-            # Update new position counts
-            update_office_position_counts(office_id, designation_id)
-        else:
-            # Position didn't change, just update the current position
-            update_office_position_counts(office_id, designation_id)
+        # Save the employee row and both histories in one transaction,
+        # writing only the rows that changed
+        values = {
+            'full_name': full_name, 'gender': gender, 'birth_date': birth_date,
+            'office_id': office_id, 'designation_id': designation_id, 'class_id': class_id,
+            'salary_category_id': salary_category_id, 'joining_date': joining_date,
+            'joining_designation_id': joining_designation_id, 'caste_id': caste_id,
+            'sub_caste_id': sub_caste_id, 'caste_verified': caste_verified,
+            'caste_verification_date': caste_verification_date, 'bindu_number': bindu_number,
+            'department_exam_passed': department_exam_passed, 'department_exam_year': department_exam_year,
+            'pranidhi_id': pranidhi_id, 'bank_name': bank_name, 'ifsc_code': ifsc_code,
+            'account_number': account_number, 'aadhar_number': aadhar_number, 'gpf_number': gpf_number,
+            'retirement_date': retirement_date,
+            'previous_office_release_date': previous_office_release_date,
+            'previous_district': previous_district,
+            'previous_designation': previous_designation,
+            'current_joining_date': current_joining_date,
+        }
+        touched = employee_records.save_employee_edit(conn, id, values, request.form)
+        app.logger.info('Employee %d saved, %d row(s) written', id, touched)
         
         flash('कर्मचारी यशस्वीरित्या अद्यतनित केला गेला!')
         return redirect(url_for('employees'))
     
-    # Get dropdown data
-    c.execute("SELECT id, office_name FROM offices")
-    offices = c.fetchall()
-    
-    c.execute("SELECT id, designation_name FROM designations")
-    designations = c.fetchall()
-    
-    c.execute("SELECT id, class_name FROM classes")
-    classes = c.fetchall()
-    
-    c.execute("SELECT id, category_name FROM salary_categories")
-    salary_categories = c.fetchall()
-    
-    c.execute("SELECT id, caste_name FROM castes")
-    castes = c.fetchall()
-    
-    c.execute("SELECT id, sub_caste_name FROM sub_castes")
-    sub_castes = c.fetchall()
-    
-    conn.close()
+    # Get dropdown data (served from the lookup cache)
+    lookup = lookups.get_lookups(conn)
     
     return render_template('edit_employee.html', 
                           employee=employee,
-                          offices=offices,
-                          designations=designations,
-                          classes=classes,
-                          salary_categories=salary_categories,
-                          castes=castes,
-                          sub_castes=sub_castes)
+                          offices=lookup['offices'],
+                          designations=lookup['designations'],
+                          classes=lookup['classes'],
+                          salary_categories=lookup['salary_categories'],
+                          castes=lookup['castes'],
+                          sub_castes=lookup['sub_castes'])
 
 @app.route('/add_employee', methods=['GET', 'POST'])
 def add_employee():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     c = conn.cursor()
     
     if request.method == 'POST':
@@ -584,15 +414,7 @@ def add_employee():
         current_joining_date = request.form.get('current_joining_date', None)
         
         # Calculate retirement date based on birth date and class
-        # For classes 1-4: 58 years from birth date
-        # For class 4: 60 years from birth date
-        retirement_date = None
-        if birth_date:
-            birth_datetime = datetime.strptime(birth_date, '%Y-%m-%d')
-            if class_id in ['1', '2', '3']:  # Classes 1-3
-                retirement_date = birth_datetime.replace(year=birth_datetime.year + 58).strftime('%Y-%m-%d')
-            elif class_id == '4':  # Class 4
-                retirement_date = birth_datetime.replace(year=birth_datetime.year + 60).strftime('%Y-%m-%d')
+        retirement_date = employee_records.retirement_date_for(birth_date, class_id)
         
         # Insert employee data
         c.execute('''INSERT INTO employees (
@@ -603,7 +425,7 @@ def add_employee():
             ifsc_code, account_number, aadhar_number, gpf_number, retirement_date,
             previous_office_release_date, previous_district, 
             previous_designation, current_joining_date
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
         (full_name, gender, birth_date, office_id, designation_id, class_id, 
          salary_category_id, joining_date, joining_designation_id, caste_id, 
          sub_caste_id, caste_verified, caste_verification_date, bindu_number, 
@@ -613,7 +435,6 @@ def add_employee():
          previous_designation, current_joining_date))
         
         employee_id = c.lastrowid
-        conn.commit()
         
         # Insert transfer history records
         # First row (main fields)
@@ -624,7 +445,6 @@ def add_employee():
                         VALUES (?, ?, ?, ?, ?)''',
                       (employee_id, previous_office_release_date,
                        previous_district, previous_designation, current_joining_date))
-            conn.commit()
         
         # Additional transfer rows
         transfer_release_dates = request.form.getlist('transfer_release_date[]')
@@ -644,7 +464,6 @@ def add_employee():
                              previous_district, previous_designation, current_joining_date)
                             VALUES (?, ?, ?, ?, ?)''',
                           (employee_id, release_date, district, designation, joining_date))
-                conn.commit()
         
         # Insert promotion history if provided
         # For new employees, we'll add the initial joining as the first promotion
@@ -652,7 +471,6 @@ def add_employee():
                     (employee_id, designation, joining_date, promotion_date)
                     VALUES (?, ?, ?, ?)''',
                   (employee_id, joining_designation_id, joining_date, joining_date))
-        conn.commit()
         
         # Add additional promotion history records
         promotion_designation_ids = request.form.getlist('promotion_designation_id[]')
@@ -671,80 +489,380 @@ def add_employee():
                             (employee_id, designation, joining_date, promotion_date, designation_name)
                             VALUES (?, ?, ?, ?, ?)''',
                           (employee_id, designation_id, joining_date, promotion_date, designation_name))
-                conn.commit()
         
-        conn.close()
-        
-        # Update office position counts
-        update_office_position_counts(office_id, designation_id)
+        # The employee and all history rows commit together
+        conn.commit()
         
         flash('कर्मचारी यशस्वीरित्या जोडला गेला!')
         return redirect(url_for('employees'))
     
-    # Get dropdown data
-    c.execute("SELECT id, office_name FROM offices")
-    offices = c.fetchall()
+    # Get dropdown data (served from the lookup cache)
+    lookup = lookups.get_lookups(conn)
     
-    c.execute("SELECT id, designation_name FROM designations")
-    designations = c.fetchall()
+    return render_template('add_employee.html', 
+                          offices=lookup['offices'],
+                          designations=lookup['designations'],
+                          classes=lookup['classes'],
+                          salary_categories=lookup['salary_categories'],
+                          castes=lookup['castes'],
+                          sub_castes=lookup['sub_castes'])
+
+# Ranked employee search by name, office, designation or identifier
+# number; every word is matched as a prefix
+@app.route('/api/employees/search')
+def search_employees():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    c.execute("SELECT id, class_name FROM classes")
-    classes = c.fetchall()
+    limit = request.args.get('limit', employee_search.DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, employee_search.MAX_LIMIT))
     
-    c.execute("SELECT id, category_name FROM salary_categories")
-    salary_categories = c.fetchall()
+    rows = employee_search.search(get_db(), request.args.get('q', ''), limit)
+    return jsonify([dict(row) for row in rows])
+
+# Changes to employees, their history, positions and lookups after a
+# sequence number, oldest first, a page at a time
+@app.route('/api/changes')
+def changes():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    c.execute("SELECT id, caste_name FROM castes")
-    castes = c.fetchall()
+    since = max(0, request.args.get('since', 0, type=int))
+    if since > change_feed.MAX_SEQ:
+        return jsonify({'error': 'since must be at most %d' % change_feed.MAX_SEQ}), 400
+    limit = request.args.get('limit', change_feed.DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, change_feed.MAX_LIMIT))
     
-    c.execute("SELECT id, sub_caste_name FROM sub_castes")
-    sub_castes = c.fetchall()
+    try:
+        page = change_feed.changes_since(get_db(), since, limit)
+    except change_feed.ChangesPruned as e:
+        return jsonify({'error': str(e)}), 410
+    return jsonify(page)
+
+# Background jobs: submit with POST /api/jobs, either JSON
+# {"kind": ..., "params": {...}} or, for an import, a form with kind=import
+# and the file
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    conn.close()
+    upload = request.files.get('file')
+    if upload is not None:
+        kind = request.form.get('kind', 'import')
+        params = {}
+        if not upload.filename:
+            return jsonify({'error': 'A CSV or XLSX file is required'}), 400
+    else:
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind', '')
+        params = data.get('params') or {}
+        if not isinstance(params, dict):
+            return jsonify({'error': 'params must be an object'}), 400
+    if kind == 'import' and upload is None:
+        return jsonify({'error': 'A CSV or XLSX file is required'}), 400
+    
+    conn = get_db()
+    try:
+        job_id = jobs.submit(conn, kind, params, session['username'],
+                             upload, upload.filename if upload is not None else None)
+    except jobs.JobError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = jsonify(jobs.to_dict(jobs.get(conn, job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+@app.route('/api/jobs')
+def list_jobs():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    return render_template('add_employee.html', 
-                          offices=offices,
-                          designations=designations,
-                          classes=classes,
-                          salary_categories=salary_categories,
-                          castes=castes,
-                          sub_castes=sub_castes)
+    conn = get_db()
+    jobs.start(conn)
+    return jsonify([jobs.to_dict(row) for row in jobs.recent(conn)])
 
-@app.route('/settings')
-def settings():
+@app.route('/api/jobs/<int:job_id>')
+def job_status(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    conn = get_db()
+    jobs.start(conn)
+    row = jobs.get(conn, job_id)
+    if row is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(jobs.to_dict(row))
+
+@app.route('/api/jobs/<int:job_id>/result')
+def job_result(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    row = jobs.get(get_db(), job_id)
+    if row is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if row['status'] != 'done':
+        return jsonify({'error': 'Job is %s' % row['status']}), 409
+    
+    content_type, filename = jobs.result_file(row)
+    response = send_file(row['result_path'], as_attachment=True, download_name=filename)
+    response.headers['Content-Type'] = content_type
+    return response
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    conn = get_db()
+    row = jobs.get(conn, job_id)
+    if row is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not jobs.cancel(conn, job_id):
+        return jsonify({'error': 'Job is already %s' % row['status']}), 409
+    return jsonify(jobs.to_dict(jobs.get(conn, job_id)))
+
+@app.route('/api/employees/import', methods=['POST'])
+def import_employees():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'A CSV or XLSX file is required'}), 400
+    
+    try:
+        records = employee_import.read_file(upload.stream, upload.filename)
+        report = employee_import.import_employees(get_db(), records)
+    except employee_import.ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(report), 200
+
+# Employees retiring in the next N years (default 5), by month, year,
+# office, designation and class
+@app.route('/reports/retirements')
+def retirement_report():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    years = request.args.get('years', retirement_forecast.DEFAULT_YEARS, type=int)
+    years = max(1, min(years, retirement_forecast.MAX_YEARS))
     
-    c.execute("SELECT * FROM offices")
-    offices = c.fetchall()
+    forecast = retirement_forecast.get_forecast(get_report_db(), years)
+    return render_template('retirement_forecast.html', forecast=forecast, years=years)
+
+@app.route('/api/reports/retirements')
+def retirement_report_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    c.execute("SELECT * FROM designations")
-    designations = c.fetchall()
+    years = request.args.get('years', retirement_forecast.DEFAULT_YEARS, type=int)
+    years = max(1, min(years, retirement_forecast.MAX_YEARS))
     
-    c.execute("SELECT * FROM classes")
-    classes = c.fetchall()
+    return jsonify(retirement_forecast.get_forecast(get_report_db(), years))
+
+# Projected vacancies per office and designation for each of the next N
+# months (default 24), as retirements take effect
+@app.route('/reports/vacancies')
+def vacancy_report():
+    if 'username' not in session:
+        return redirect(url_for('login'))
     
-    c.execute("SELECT * FROM salary_categories")
-    salary_categories = c.fetchall()
+    months = request.args.get('months', vacancy_projection.DEFAULT_MONTHS, type=int)
+    months = max(1, min(months, vacancy_projection.MAX_MONTHS))
     
-    c.execute("SELECT * FROM castes")
-    castes = c.fetchall()
+    projection = vacancy_projection.get_projection(get_report_db(), months)
+    return render_template('vacancy_projection.html', projection=projection, months=months)
+
+@app.route('/api/reports/vacancies')
+def vacancy_report_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    c.execute("SELECT s.*, c.caste_name FROM sub_castes s JOIN castes c ON s.caste_id = c.id")
-    sub_castes = c.fetchall()
+    months = request.args.get('months', vacancy_projection.DEFAULT_MONTHS, type=int)
+    months = max(1, min(months, vacancy_projection.MAX_MONTHS))
     
-    conn.close()
+    return jsonify(vacancy_projection.get_projection(get_report_db(), months))
+
+# Seniority lists (ज्येष्ठता सूची) per designation and class, optionally
+# narrowed to one designation_id and/or class_id
+def _seniority_lists():
+    return seniority.get_seniority(get_report_db(),
+                                   request.args.get('designation_id', type=int),
+                                   request.args.get('class_id', type=int))
+
+@app.route('/reports/seniority')
+def seniority_report():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    lookup = lookups.get_lookups()
+    return render_template('seniority_list.html', seniority=_seniority_lists(),
+                          designations=lookup['designations'], classes=lookup['classes'],
+                          designation_id=request.args.get('designation_id', type=int),
+                          class_id=request.args.get('class_id', type=int))
+
+@app.route('/reports/seniority/export')
+def seniority_report_csv():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    return Response(seniority.to_csv(_seniority_lists()),
+                    content_type='text/csv; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename=seniority.csv'})
+
+@app.route('/api/reports/seniority')
+def seniority_report_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(_seniority_lists())
+
+# Bindu namavali (reservation roster) per office and designation: a summary
+# of every cadre, narrowed by office_id and/or designation_id, or the full
+# roster of one cadre when both are given
+@app.route('/reports/bindu')
+def bindu_report():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    office_id = request.args.get('office_id', type=int)
+    designation_id = request.args.get('designation_id', type=int)
+    cadre = None
+    if office_id is not None and designation_id is not None:
+        cadre = bindu.cadre(get_report_db(), office_id, designation_id)
+    
+    lookup = lookups.get_lookups()
+    return render_template('bindu_namavali.html', cadres=bindu.summary(get_report_db(), office_id, designation_id),
+                          cadre=cadre, categories=bindu.CATEGORY_NAMES,
+                          offices=lookup['offices'], designations=lookup['designations'],
+                          office_id=office_id, designation_id=designation_id)
+
+@app.route('/api/reports/bindu')
+def bindu_report_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    office_id = request.args.get('office_id', type=int)
+    designation_id = request.args.get('designation_id', type=int)
+    if office_id is not None and designation_id is not None:
+        cadre = bindu.cadre(get_report_db(), office_id, designation_id)
+        if cadre is None:
+            return jsonify({'error': 'No posts or employees for this office and designation'}), 404
+        return jsonify(cadre)
+    
+    return jsonify({'cadres': bindu.summary(get_report_db(), office_id, designation_id)})
+
+# Backups (see backup.py): POST takes a snapshot as a background job, whose
+# progress is at /api/jobs/<id>; GET lists the snapshots and recent backup jobs
+@app.route('/api/backups', methods=['POST'])
+def create_backup():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    conn = get_db()
+    job_id = jobs.submit(conn, 'backup', {}, session['username'])
+    
+    response = jsonify(jobs.to_dict(jobs.get(conn, job_id)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job_id)
+    return response
+
+@app.route('/api/backups')
+def list_backups():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    conn = get_db()
+    jobs.start(conn)
+    return jsonify({'snapshots': backup.snapshots(backup.backup_dir()),
+                    'jobs': [jobs.to_dict(row) for row in jobs.recent(conn) if row['kind'] == 'backup']})
+
+# District views: the dashboard, employee list and office position totals
+# consolidated over the office databases in FEDERATION_DATABASES (see
+# federation.py). Returns the result of load(), or an error response.
+def _district(load):
+    if not federation.configured():
+        return jsonify({'error': 'No office databases configured (set EMPLOYEE_FEDERATION)'}), 404
+    try:
+        return load()
+    except federation.FederationError as e:
+        return jsonify({'error': str(e)}), 503
+
+def _district_employees():
+    filters = federation.parse_filters(request.args)
+    sort, order = employee_list.parse_sort(request.args)
+    page_size = employee_list.parse_page_size(request.args)
+    cursor = request.args.get('cursor')
+    
+    employees, next_cursor = federation.fetch_employees(filters, sort, order, page_size, cursor)
+    return {'employees': employees, 'next_cursor': next_cursor, 'filters': filters,
+            'sort': sort, 'order': order, 'page_size': page_size, 'cursor': cursor}
+
+@app.route('/district/dashboard')
+def district_dashboard():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    return _district(lambda: render_template('district_dashboard.html',
+                                             **federation.dashboard(date.today())))
+
+@app.route('/api/district/dashboard')
+def district_dashboard_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return _district(lambda: jsonify(federation.dashboard(date.today())))
+
+@app.route('/district/employees')
+def district_employees():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    return _district(lambda: render_template('district_employees.html', names=federation.lookup_names(),
+                                             **_district_employees()))
+
+@app.route('/api/district/employees')
+def district_employees_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return _district(lambda: jsonify(_district_employees()))
+
+@app.route('/district/office_positions')
+def district_office_positions():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    return _district(lambda: render_template('district_positions.html', **federation.position_totals()))
+
+@app.route('/api/district/office_positions')
+def district_office_positions_api():
+    if 'username' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return _district(lambda: jsonify(federation.position_totals()))
+
+@app.route('/settings')
+@http_cache.conditional('offices', 'designations', 'classes', 'salary_categories', 'castes', 'sub_castes')
+def settings():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    lookup = lookups.get_lookups()
+    
+    # Only sub castes whose caste still exists
+    sub_castes = [s for s in lookup['sub_castes'] if s['caste_name'] is not None]
     
     return render_template('settings.html',
-                          offices=offices,
-                          designations=designations,
-                          classes=classes,
-                          salary_categories=salary_categories,
-                          castes=castes,
+                          offices=lookup['offices'],
+                          designations=lookup['designations'],
+                          classes=lookup['classes'],
+                          salary_categories=lookup['salary_categories'],
+                          castes=lookup['castes'],
                           sub_castes=sub_castes)
 
 # API routes for settings management
@@ -759,17 +877,16 @@ def add_office():
     if not office_name:
         return jsonify({'error': 'Office name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("INSERT INTO offices (office_name) VALUES (?)", (office_name,))
         conn.commit()
+        lookups.invalidate()
         office_id = c.lastrowid
-        conn.close()
         return jsonify({'id': office_id, 'name': office_name}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Office already exists'}), 400
 
 @app.route('/api/offices/<int:office_id>', methods=['PUT'])
@@ -783,21 +900,20 @@ def update_office(office_id):
     if not office_name:
         return jsonify({'error': 'Office name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("UPDATE offices SET office_name = ? WHERE id = ?", (office_name, office_id))
         conn.commit()
+        lookups.invalidate()
         rows_affected = c.rowcount
-        conn.close()
         
         if rows_affected == 0:
             return jsonify({'error': 'Office not found'}), 404
         
         return jsonify({'id': office_id, 'name': office_name}), 200
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Office name already exists'}), 400
 
 @app.route('/api/offices/<int:office_id>', methods=['DELETE'])
@@ -805,7 +921,7 @@ def delete_office(office_id):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     # Check if office is being used
@@ -813,13 +929,12 @@ def delete_office(office_id):
     employee_count = c.fetchone()[0]
     
     if employee_count > 0:
-        conn.close()
         return jsonify({'error': 'Cannot delete office. It is assigned to employees.'}), 400
     
     c.execute("DELETE FROM offices WHERE id = ?", (office_id,))
     conn.commit()
+    lookups.invalidate()
     rows_affected = c.rowcount
-    conn.close()
     
     if rows_affected == 0:
         return jsonify({'error': 'Office not found'}), 404
@@ -838,17 +953,16 @@ def add_designation():
     if not designation_name:
         return jsonify({'error': 'Designation name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("INSERT INTO designations (designation_name) VALUES (?)", (designation_name,))
         conn.commit()
+        lookups.invalidate()
         designation_id = c.lastrowid
-        conn.close()
         return jsonify({'id': designation_id, 'name': designation_name}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Designation already exists'}), 400
 
 @app.route('/api/designations/<int:designation_id>', methods=['PUT'])
@@ -862,21 +976,20 @@ def update_designation(designation_id):
     if not designation_name:
         return jsonify({'error': 'Designation name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("UPDATE designations SET designation_name = ? WHERE id = ?", (designation_name, designation_id))
         conn.commit()
+        lookups.invalidate()
         rows_affected = c.rowcount
-        conn.close()
         
         if rows_affected == 0:
             return jsonify({'error': 'Designation not found'}), 404
         
         return jsonify({'id': designation_id, 'name': designation_name}), 200
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Designation name already exists'}), 400
 
 @app.route('/api/designations/<int:designation_id>', methods=['DELETE'])
@@ -884,7 +997,7 @@ def delete_designation(designation_id):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     # Check if designation is being used
@@ -892,13 +1005,12 @@ def delete_designation(designation_id):
     employee_count = c.fetchone()[0]
     
     if employee_count > 0:
-        conn.close()
         return jsonify({'error': 'Cannot delete designation. It is assigned to employees.'}), 400
     
     c.execute("DELETE FROM designations WHERE id = ?", (designation_id,))
     conn.commit()
+    lookups.invalidate()
     rows_affected = c.rowcount
-    conn.close()
     
     if rows_affected == 0:
         return jsonify({'error': 'Designation not found'}), 404
@@ -917,17 +1029,16 @@ def add_class():
     if not class_name:
         return jsonify({'error': 'Class name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("INSERT INTO classes (class_name) VALUES (?)", (class_name,))
         conn.commit()
+        lookups.invalidate()
         class_id = c.lastrowid
-        conn.close()
         return jsonify({'id': class_id, 'name': class_name}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Class already exists'}), 400
 
 @app.route('/api/classes/<int:class_id>', methods=['PUT'])
@@ -941,21 +1052,20 @@ def update_class(class_id):
     if not class_name:
         return jsonify({'error': 'Class name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("UPDATE classes SET class_name = ? WHERE id = ?", (class_name, class_id))
         conn.commit()
+        lookups.invalidate()
         rows_affected = c.rowcount
-        conn.close()
         
         if rows_affected == 0:
             return jsonify({'error': 'Class not found'}), 404
         
         return jsonify({'id': class_id, 'name': class_name}), 200
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Class name already exists'}), 400
 
 @app.route('/api/classes/<int:class_id>', methods=['DELETE'])
@@ -963,7 +1073,7 @@ def delete_class(class_id):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     # Check if class is being used
@@ -971,13 +1081,12 @@ def delete_class(class_id):
     employee_count = c.fetchone()[0]
     
     if employee_count > 0:
-        conn.close()
         return jsonify({'error': 'Cannot delete class. It is assigned to employees.'}), 400
     
     c.execute("DELETE FROM classes WHERE id = ?", (class_id,))
     conn.commit()
+    lookups.invalidate()
     rows_affected = c.rowcount
-    conn.close()
     
     if rows_affected == 0:
         return jsonify({'error': 'Class not found'}), 404
@@ -996,17 +1105,16 @@ def add_salary_category():
     if not category_name:
         return jsonify({'error': 'Category name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("INSERT INTO salary_categories (category_name) VALUES (?)", (category_name,))
         conn.commit()
+        lookups.invalidate()
         category_id = c.lastrowid
-        conn.close()
         return jsonify({'id': category_id, 'name': category_name}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Salary category already exists'}), 400
 
 @app.route('/api/salary_categories/<int:category_id>', methods=['PUT'])
@@ -1020,21 +1128,20 @@ def update_salary_category(category_id):
     if not category_name:
         return jsonify({'error': 'Category name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("UPDATE salary_categories SET category_name = ? WHERE id = ?", (category_name, category_id))
         conn.commit()
+        lookups.invalidate()
         rows_affected = c.rowcount
-        conn.close()
         
         if rows_affected == 0:
             return jsonify({'error': 'Salary category not found'}), 404
         
         return jsonify({'id': category_id, 'name': category_name}), 200
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Salary category name already exists'}), 400
 
 @app.route('/api/salary_categories/<int:category_id>', methods=['DELETE'])
@@ -1042,7 +1149,7 @@ def delete_salary_category(category_id):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     # Check if salary category is being used
@@ -1050,13 +1157,12 @@ def delete_salary_category(category_id):
     employee_count = c.fetchone()[0]
     
     if employee_count > 0:
-        conn.close()
         return jsonify({'error': 'Cannot delete salary category. It is assigned to employees.'}), 400
     
     c.execute("DELETE FROM salary_categories WHERE id = ?", (category_id,))
     conn.commit()
+    lookups.invalidate()
     rows_affected = c.rowcount
-    conn.close()
     
     if rows_affected == 0:
         return jsonify({'error': 'Salary category not found'}), 404
@@ -1075,17 +1181,16 @@ def add_caste():
     if not caste_name:
         return jsonify({'error': 'Caste name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("INSERT INTO castes (caste_name) VALUES (?)", (caste_name,))
         conn.commit()
+        lookups.invalidate()
         caste_id = c.lastrowid
-        conn.close()
         return jsonify({'id': caste_id, 'name': caste_name}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Caste already exists'}), 400
 
 @app.route('/api/castes/<int:caste_id>', methods=['PUT'])
@@ -1099,21 +1204,20 @@ def update_caste(caste_id):
     if not caste_name:
         return jsonify({'error': 'Caste name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
         c.execute("UPDATE castes SET caste_name = ? WHERE id = ?", (caste_name, caste_id))
         conn.commit()
+        lookups.invalidate()
         rows_affected = c.rowcount
-        conn.close()
         
         if rows_affected == 0:
             return jsonify({'error': 'Caste not found'}), 404
         
         return jsonify({'id': caste_id, 'name': caste_name}), 200
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Caste name already exists'}), 400
 
 @app.route('/api/castes/<int:caste_id>', methods=['DELETE'])
@@ -1121,7 +1225,7 @@ def delete_caste(caste_id):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     # Check if caste is being used
@@ -1129,15 +1233,14 @@ def delete_caste(caste_id):
     employee_count = c.fetchone()[0]
     
     if employee_count > 0:
-        conn.close()
         return jsonify({'error': 'Cannot delete caste. It is assigned to employees.'}), 400
     
     # Also delete sub castes
     c.execute("DELETE FROM sub_castes WHERE caste_id = ?", (caste_id,))
     c.execute("DELETE FROM castes WHERE id = ?", (caste_id,))
     conn.commit()
+    lookups.invalidate()
     rows_affected = c.rowcount
-    conn.close()
     
     if rows_affected == 0:
         return jsonify({'error': 'Caste not found'}), 404
@@ -1153,21 +1256,26 @@ def add_sub_caste():
     data = request.get_json()
     caste_id = data.get('caste_id')
     sub_caste_name = data.get('name')
+    # Bindu roster category (see bindu.CATEGORIES); none means open
+    reservation_category = data.get('reservation_category') or None
     
     if not caste_id or not sub_caste_name:
         return jsonify({'error': 'Caste ID and sub caste name are required'}), 400
+    if reservation_category is not None and reservation_category not in bindu.CATEGORY_NAMES:
+        return jsonify({'error': 'Unknown reservation category'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     try:
-        c.execute("INSERT INTO sub_castes (caste_id, sub_caste_name) VALUES (?, ?)", (caste_id, sub_caste_name))
+        c.execute("INSERT INTO sub_castes (caste_id, sub_caste_name, reservation_category) VALUES (?, ?, ?)",
+                  (caste_id, sub_caste_name, reservation_category))
         conn.commit()
+        lookups.invalidate()
         sub_caste_id = c.lastrowid
-        conn.close()
-        return jsonify({'id': sub_caste_id, 'caste_id': caste_id, 'name': sub_caste_name}), 201
+        return jsonify({'id': sub_caste_id, 'caste_id': caste_id, 'name': sub_caste_name,
+                        'reservation_category': reservation_category}), 201
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Sub caste already exists for this caste'}), 400
 
 @app.route('/api/sub_castes/<int:sub_caste_id>', methods=['PUT'])
@@ -1181,21 +1289,32 @@ def update_sub_caste(sub_caste_id):
     if not sub_caste_name:
         return jsonify({'error': 'Sub caste name is required'}), 400
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
+    # The reservation category is only changed when it is given
+    if 'reservation_category' in data:
+        reservation_category = data.get('reservation_category') or None
+        if reservation_category is not None and reservation_category not in bindu.CATEGORY_NAMES:
+            return jsonify({'error': 'Unknown reservation category'}), 400
+    else:
+        reservation_category = c.execute("SELECT reservation_category FROM sub_castes WHERE id = ?",
+                                         (sub_caste_id,)).fetchone()
+        reservation_category = reservation_category[0] if reservation_category else None
+    
     try:
-        c.execute("UPDATE sub_castes SET sub_caste_name = ? WHERE id = ?", (sub_caste_name, sub_caste_id))
+        c.execute("UPDATE sub_castes SET sub_caste_name = ?, reservation_category = ? WHERE id = ?",
+                  (sub_caste_name, reservation_category, sub_caste_id))
         conn.commit()
+        lookups.invalidate()
         rows_affected = c.rowcount
-        conn.close()
         
         if rows_affected == 0:
             return jsonify({'error': 'Sub caste not found'}), 404
         
-        return jsonify({'id': sub_caste_id, 'name': sub_caste_name}), 200
+        return jsonify({'id': sub_caste_id, 'name': sub_caste_name,
+                        'reservation_category': reservation_category}), 200
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'error': 'Sub caste name already exists'}), 400
 
 @app.route('/api/sub_castes/<int:sub_caste_id>', methods=['DELETE'])
@@ -1203,7 +1322,7 @@ def delete_sub_caste(sub_caste_id):
     if 'username' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
     # Check if sub caste is being used
@@ -1211,13 +1330,12 @@ def delete_sub_caste(sub_caste_id):
     employee_count = c.fetchone()[0]
     
     if employee_count > 0:
-        conn.close()
         return jsonify({'error': 'Cannot delete sub caste. It is assigned to employees.'}), 400
     
     c.execute("DELETE FROM sub_castes WHERE id = ?", (sub_caste_id,))
     conn.commit()
+    lookups.invalidate()
     rows_affected = c.rowcount
-    conn.close()
     
     if rows_affected == 0:
         return jsonify({'error': 'Sub caste not found'}), 404
@@ -1225,12 +1343,12 @@ def delete_sub_caste(sub_caste_id):
     return jsonify({'message': 'Sub caste deleted successfully'}), 200
 
 @app.route('/office_positions')
+@http_cache.conditional('office_positions', 'offices', 'designations')
 def office_positions():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     c = conn.cursor()
     
     # Get all offices and positions with counts
@@ -1245,11 +1363,9 @@ def office_positions():
     positions = c.fetchall()
     
     # Get offices and designations for dropdowns
-    c.execute("SELECT id, office_name FROM offices")
-    offices = c.fetchall()
-    
-    c.execute("SELECT id, designation_name FROM designations")
-    designations = c.fetchall()
+    lookup = lookups.get_lookups(conn)
+    offices = lookup['offices']
+    designations = lookup['designations']
     
     # Get office-wise totals
     c.execute('''SELECT o.office_name,
@@ -1282,8 +1398,6 @@ def office_positions():
     
     overall_totals = c.fetchone()
     
-    conn.close()
-    
     return render_template('office_positions.html', 
                           positions=positions,
                           offices=offices,
@@ -1292,32 +1406,53 @@ def office_positions():
                           designation_totals=designation_totals,
                           overall_totals=overall_totals)
 
-# Function to update office position counts
-def update_office_position_counts(office_id, designation_id):
-    conn = sqlite3.connect('employee.db')
-    c = conn.cursor()
-    
-    # Count filled positions (employees with this office and designation)
-    c.execute("""SELECT COUNT(*) FROM employees 
-                 WHERE office_id = ? AND designation_id = ?""", 
-              (office_id, designation_id))
-    filled_count = c.fetchone()[0]
-    
-    # Check if office position exists
-    c.execute("SELECT id, approved_count FROM office_positions WHERE office_id = ? AND designation_id = ?", 
-              (office_id, designation_id))
-    position = c.fetchone()
-    
-    if position:
-        # Update existing position
-        vacant_count = position[1] - filled_count  # approved_count - filled_count
-        c.execute('''UPDATE office_positions 
-                     SET filled_count = ?, vacant_count = ?
-                     WHERE id = ?''', 
-                  (filled_count, vacant_count, position[0]))
-        conn.commit()
-    
+# Office position filled/vacant counts are kept current by triggers on the
+# employees table (see migrations.add_position_count_triggers). This full
+# recount is only needed to repair counts after editing the database by hand.
+def recount_office_positions(conn):
+    conn.execute('''UPDATE office_positions
+                    SET filled_count = (SELECT COUNT(*) FROM employees e
+                                        WHERE e.office_id = office_positions.office_id
+                                        AND e.designation_id = office_positions.designation_id)''')
+    conn.execute("UPDATE office_positions SET vacant_count = COALESCE(approved_count, 0) - filled_count")
+    conn.commit()
+
+@app.cli.command('recount-positions')
+def recount_positions_command():
+    init_db()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    recount_office_positions(conn)
     conn.close()
+    print('Office position counts recalculated')
+
+@app.cli.command('recount-stats')
+def recount_stats_command():
+    init_db()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    dashboard_stats.recount(conn)
+    conn.close()
+    print('Dashboard statistics recalculated')
+
+@app.cli.command('prune-changes')
+@click.option('--days', default=90, show_default=True, help='Keep changes recorded in this many days.')
+def prune_changes_command(days):
+    init_db()
+    cutoff = (date.today() - timedelta(days=days)).isoformat()
+    conn = db.connect(app.config['DATABASE'], app.config)
+    removed = change_feed.prune(conn, cutoff)
+    conn.close()
+    print('Removed %d change(s) recorded before %s' % (removed, cutoff))
+
+@app.cli.command('prune-jobs')
+@click.option('--days', default=None, type=int, help='Keep jobs created in this many days (default JOBS_KEEP_DAYS).')
+def prune_jobs_command(days):
+    init_db()
+    if days is None:
+        days = app.config['JOBS_KEEP_DAYS']
+    conn = db.connect(app.config['DATABASE'], app.config)
+    removed = jobs.prune(conn, days)
+    conn.close()
+    print('Removed %d finished job(s) older than %d days' % (removed, days))
 
 @app.route('/add_office_position', methods=['POST'])
 def add_office_position():
@@ -1326,40 +1461,35 @@ def add_office_position():
     
     office_id = request.form['office_id']
     designation_id = request.form['designation_id']
-    approved_count = request.form['approved_count']
+    approved_count = request.form.get('approved_count', type=int)
+    # The bindu namavali computes one roster point per approved post
+    if approved_count is None or not 0 <= approved_count <= bindu.MAX_POINTS:
+        flash('मंजूर पदांची संख्या 0 ते %d दरम्यान असावी' % bindu.MAX_POINTS)
+        return redirect(url_for('office_positions'))
     
-    conn = sqlite3.connect('employee.db')
+    conn = get_db()
     c = conn.cursor()
     
-    # Check if position already exists
-    c.execute("SELECT id FROM office_positions WHERE office_id = ? AND designation_id = ?", 
-              (office_id, designation_id))
-    
-    existing = c.fetchone()
-    
-    # Count filled positions (employees with this office and designation)
-    c.execute("""SELECT COUNT(*) FROM employees 
-                 WHERE office_id = ? AND designation_id = ?""", 
-              (office_id, designation_id))
-    filled_count = c.fetchone()[0]
-    
-    # Calculate vacant count
-    vacant_count = int(approved_count) - filled_count
-    
-    if existing:
-        # Update existing
-        c.execute('''UPDATE office_positions 
-                     SET approved_count = ?, filled_count = ?, vacant_count = ?
-                     WHERE id = ?''', 
-                  (approved_count, filled_count, vacant_count, existing[0]))
-    else:
-        # Insert new
+    # Existing position: filled_count is already current, only the
+    # approved and vacant counts change
+    c.execute('''UPDATE office_positions 
+                 SET approved_count = ?, vacant_count = ? - filled_count
+                 WHERE office_id = ? AND designation_id = ?''', 
+              (approved_count, approved_count, office_id, designation_id))
+    
+    if c.rowcount == 0:
+        # New position: count the employees already holding it once; the
+        # triggers keep the count current from here on
+        c.execute("""SELECT COUNT(*) FROM employees 
+                     WHERE office_id = ? AND designation_id = ?""", 
+                  (office_id, designation_id))
+        filled_count = c.fetchone()[0]
+        
         c.execute('''INSERT INTO office_positions (office_id, designation_id, approved_count, filled_count, vacant_count)
                      VALUES (?, ?, ?, ?, ?)''', 
-                  (office_id, designation_id, approved_count, filled_count, vacant_count))
+                  (office_id, designation_id, approved_count, filled_count, approved_count - filled_count))
     
     conn.commit()
-    conn.close()
     
     flash('कार्यालय पद यशस्वीरित्या अद्यतनित केले गेले!')
     return redirect(url_for('office_positions'))
@@ -1369,8 +1499,7 @@ def office_profile():
     if 'username' not in session:
         return redirect(url_for('login'))
     
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     c = conn.cursor()
     
     if request.method == 'POST':
@@ -1395,7 +1524,6 @@ def office_profile():
                    designation, district_name, senior_clerk_names, junior_clerk_names))
         
         conn.commit()
-        conn.close()
         
         flash('कार्यालय प्रोफाइल यशस्वीरित्या अद्यतनित केले गेले!')
         return redirect(url_for('office_profile'))
@@ -1404,20 +1532,12 @@ def office_profile():
     c.execute("SELECT * FROM office_profile WHERE id = 1")
     office_profile = c.fetchone()
     
-    conn.close()
-    
     return render_template('office_profile.html', office_profile=office_profile)
 
 @app.route('/get_sub_castes/<int:caste_id>')
+@http_cache.conditional('castes', 'sub_castes', max_age=60)
 def get_sub_castes(caste_id):
-    conn = sqlite3.connect('employee.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    c.execute("SELECT id, sub_caste_name FROM sub_castes WHERE caste_id = ?", (caste_id,))
-    sub_castes = c.fetchall()
-    
-    conn.close()
+    sub_castes = lookups.get_lookups()['sub_castes_by_caste'].get(caste_id, [])
     
     # Return as JSON-like structure for JavaScript
     result = []
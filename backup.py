@@ -0,0 +1,341 @@
+# Online backups
+#
+# A snapshot copies the live database with SQLite's online backup API,
+# BACKUP_PAGES pages per step with a BACKUP_SLEEP pause in between, so a
+# writer never waits for more than one step. A write from another
+# connection makes SQLite restart the copy; after MAX_RESTARTS restarts the
+# rest is copied in a single step, which in WAL mode still does not block
+# writers. The copy is packed with a manifest (schema version, page count,
+# SHA-256) into a compressed archive in BACKUP_DIR:
+#
+#     employee-20250131T020000Z.tar.gz
+#         manifest.json
+#         employee.db
+#
+# Snapshots are taken by the 'backup' background job (POST /api/backups,
+# progress under /api/jobs/<id>), by `flask --app app backup`, and on a
+# schedule when BACKUP_INTERVAL_HOURS is set: the first request after the
+# newest snapshot has grown older than that queues the job. Only the newest
+# BACKUP_KEEP snapshots are kept.
+#
+# `flask --app app restore-backup <archive>` checks the archive (SHA-256,
+# PRAGMA integrity_check, a schema version this release can read), takes a
+# snapshot of the current database, then writes the snapshot into it with
+# the backup API, so a running app sees the restored data on its next read.
+# The restored version counters and change log sequence continue past the
+# current ones, so ETags and cached results never match the wrong data.
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zlib
+
+from flask import current_app
+
+import change_feed
+import db
+import jobs
+import migrations
+
+DEFAULT_CONFIG = {
+    'BACKUP_DIR': None,             # None = a 'backups' directory next to the database
+    'BACKUP_PAGES': 256,            # pages copied per step
+    'BACKUP_SLEEP': 0.005,          # seconds between steps
+    'BACKUP_KEEP': 14,              # snapshots kept
+    'BACKUP_INTERVAL_HOURS': 0,     # scheduled snapshots; 0 = off
+}
+
+MAX_RESTARTS = 3
+
+# Seconds between checks for a due scheduled snapshot, per process
+SCHEDULE_CHECK_INTERVAL = 60
+
+ARCHIVE_SUFFIX = '.tar.gz'
+MANIFEST_NAME = 'manifest.json'
+DATABASE_NAME = 'employee.db'
+
+PENDING_SQL = "SELECT 1 FROM jobs WHERE status IN ('queued', 'running') AND kind = 'backup'"
+
+_lock = threading.Lock()
+_next_check = {}        # database path -> time.monotonic() of the next schedule check
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def backup_dir(config=None):
+    if config is None:
+        config = current_app.config
+    path = config.get('BACKUP_DIR')
+    if not path:
+        database = os.path.abspath(config.get('DATABASE', db.DEFAULT_DATABASE))
+        path = os.path.join(os.path.dirname(database), 'backups')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _prefix(config):
+    return os.path.splitext(os.path.basename(config.get('DATABASE', db.DEFAULT_DATABASE)))[0] + '-'
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Copy `conn`'s database into the file `path` with the backup API.
+# progress(done, total) is called after every step. Returns the number of
+# restarts caused by concurrent writes.
+def copy_database(conn, path, pages, sleep, progress=None):
+    state = {'remaining': None, 'restarts': 0}
+
+    def step(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+        state['remaining'] = remaining
+        if progress:
+            progress(total - remaining, total)
+        if state['restarts'] >= MAX_RESTARTS:
+            raise _Restarted()
+
+    target = sqlite3.connect(path)
+    try:
+        try:
+            conn.backup(target, pages=pages, progress=step, sleep=sleep)
+        except _Restarted:
+            conn.backup(target)
+        # A standalone file: no -wal next to it
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+    return state['restarts']
+
+
+# Take a snapshot of `conn`'s database into `directory`. Returns its manifest
+# with the archive's file name and size added.
+def snapshot(conn, directory, config=None, progress=None):
+    if config is None:
+        config = current_app.config
+    created = time.gmtime()
+    name = '%s%s%s' % (_prefix(config), time.strftime('%Y%m%dT%H%M%SZ', created), ARCHIVE_SUFFIX)
+    work = os.path.join(directory, '.%s.db' % uuid.uuid4().hex)
+    partial = os.path.join(directory, '.%s%s' % (uuid.uuid4().hex, ARCHIVE_SUFFIX))
+    try:
+        restarts = copy_database(conn, work, config.get('BACKUP_PAGES', DEFAULT_CONFIG['BACKUP_PAGES']),
+                                 config.get('BACKUP_SLEEP', DEFAULT_CONFIG['BACKUP_SLEEP']), progress)
+
+        copy = sqlite3.connect(work)
+        try:
+            schema_version = copy.execute('PRAGMA user_version').fetchone()[0]
+            page_size = copy.execute('PRAGMA page_size').fetchone()[0]
+            pages = copy.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            copy.close()
+        manifest = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', created),
+            'database': os.path.basename(config.get('DATABASE', db.DEFAULT_DATABASE)),
+            'schema_version': schema_version,
+            'page_size': page_size,
+            'pages': pages,
+            'size': os.path.getsize(work),
+            'sha256': _sha256(work),
+            'sqlite_version': sqlite3.sqlite_version,
+            'restarts': restarts,
+        }
+
+        with tarfile.open(partial, 'w:gz', compresslevel=6) as archive:
+            data = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = time.time()
+            archive.addfile(info, io.BytesIO(data))
+            archive.add(work, DATABASE_NAME)
+        os.replace(partial, os.path.join(directory, name))
+    finally:
+        _remove(work)
+        _remove(partial)
+
+    return dict(manifest, file=name, archive_size=os.path.getsize(os.path.join(directory, name)))
+
+
+# Snapshots in `directory`, newest first: dicts with file, size and created
+# (a Unix time taken from the file)
+def snapshots(directory, config=None):
+    if config is None:
+        config = current_app.config
+    prefix = _prefix(config)
+    found = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.startswith(prefix) and entry.name.endswith(ARCHIVE_SUFFIX):
+            stat = entry.stat()
+            found.append({'file': entry.name, 'size': stat.st_size, 'created': stat.st_mtime})
+    found.sort(key=lambda snapshot: snapshot['file'], reverse=True)
+    return found
+
+
+# Delete all but the newest `keep` snapshots. Returns the files removed.
+def prune(directory, keep, config=None):
+    removed = [snapshot['file'] for snapshot in snapshots(directory, config)[max(keep, 1):]]
+    for name in removed:
+        _remove(os.path.join(directory, name))
+    return removed
+
+
+# Check an archive and unpack its database into `directory`. Returns
+# (manifest, path of the unpacked database); raises BackupError when the
+# archive is damaged or the snapshot cannot be used.
+def verify(archive_path, directory):
+    path = os.path.join(directory, '.%s.db' % uuid.uuid4().hex)
+    try:
+        with tarfile.open(archive_path, 'r:gz') as archive:
+            manifest = json.load(archive.extractfile(MANIFEST_NAME))
+            source = archive.extractfile(DATABASE_NAME)
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(source, f)
+    except (OSError, EOFError, KeyError, ValueError, tarfile.TarError, zlib.error) as e:
+        _remove(path)
+        raise BackupError('Cannot read %s: %s' % (archive_path, e or e.__class__.__name__))
+
+    try:
+        if _sha256(path) != manifest.get('sha256'):
+            raise BackupError('%s: checksum mismatch, the snapshot is damaged' % archive_path)
+        conn = sqlite3.connect(path)
+        try:
+            result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.Error as e:
+            raise BackupError('%s: %s' % (archive_path, e))
+        finally:
+            conn.close()
+        if result != ['ok']:
+            raise BackupError('%s: integrity check failed: %s' % (archive_path, '; '.join(result[:5])))
+        if version > migrations.LATEST_VERSION:
+            raise BackupError('%s: schema version %d is newer than this release (%d)'
+                              % (archive_path, version, migrations.LATEST_VERSION))
+    except BackupError:
+        _remove(path)
+        raise
+    return manifest, path
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+# Move the counters in the unpacked snapshot `restored` past the ones `conn`
+# has handed out, so no ETag, cached result or change sequence number issued
+# before the restore can match different data after it. Each table_versions
+# and roster_versions counter continues from the larger of its two values
+# plus one random offset. The restored change log is emptied and its sequence
+# continues one past the live head, so every change feed consumer gets
+# ChangesPruned and resynchronises.
+def _advance_counters(conn, restored):
+    live, ours = _tables(conn), _tables(restored)
+    offset = random.randint(1000000, 1000000000)
+    with restored:
+        if 'table_versions' in ours:
+            versions = dict(conn.execute('SELECT name, version FROM table_versions').fetchall()
+                            if 'table_versions' in live else [])
+            for name, version in restored.execute('SELECT name, version FROM table_versions').fetchall():
+                restored.execute('UPDATE table_versions SET version = ? WHERE name = ?',
+                                 (max(version, versions.get(name, version)) + offset, name))
+        if 'roster_versions' in ours:
+            versions = {}
+            if 'roster_versions' in live:
+                versions = {(office_id, designation_id): version for office_id, designation_id, version
+                            in conn.execute('SELECT office_id, designation_id, version FROM roster_versions')}
+            for office_id, designation_id, version in restored.execute(
+                    'SELECT office_id, designation_id, version FROM roster_versions').fetchall():
+                restored.execute('UPDATE roster_versions SET version = ? WHERE office_id = ? AND designation_id = ?',
+                                 (max(version, versions.get((office_id, designation_id), version)) + offset,
+                                  office_id, designation_id))
+        if 'change_log' in ours:
+            heads = [row[0] for row in conn.execute(change_feed.LATEST_SQL)] if 'change_log' in live else []
+            heads += [row[0] for row in restored.execute(change_feed.LATEST_SQL)]
+            restored.execute('DELETE FROM change_log')
+            restored.execute("DELETE FROM sqlite_sequence WHERE name = 'change_log'")
+            restored.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)",
+                             (max(heads + [0]) + 1,))
+
+
+# Replace `conn`'s database with the snapshot in `archive_path`. The archive
+# is verified first, then the current database is saved as a snapshot in
+# `directory`. Returns (restored manifest, manifest of the saved snapshot).
+def restore(conn, archive_path, directory, config=None):
+    manifest, path = verify(archive_path, directory)
+    try:
+        saved = snapshot(conn, directory, config)
+        restored = sqlite3.connect(path)
+        try:
+            # The counters are moved in the unpacked copy, so they change in
+            # the same step as the data
+            _advance_counters(conn, restored)
+            restored.backup(conn)
+        finally:
+            restored.close()
+    finally:
+        _remove(path)
+    return manifest, saved
+
+
+@jobs.job_kind('backup')
+def run_backup(conn, job):
+    config = current_app.config
+    directory = backup_dir(config)
+    manifest = snapshot(conn, directory, config, job.progress)
+    removed = prune(directory, config['BACKUP_KEEP'], config)
+    with open(job.result_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(manifest, removed=removed), f, ensure_ascii=False)
+    return {'file': manifest['file'], 'size': manifest['archive_size'], 'pages': manifest['pages'],
+            'removed': len(removed)}
+
+
+# Queue a scheduled snapshot when the newest one is older than
+# BACKUP_INTERVAL_HOURS (checked at most once a minute per process)
+def _schedule():
+    config = current_app.config
+    hours = config.get('BACKUP_INTERVAL_HOURS')
+    if not hours:
+        return
+    path = config['DATABASE']
+    now = time.monotonic()
+    with _lock:
+        if _next_check.get(path, 0) > now:
+            return
+        _next_check[path] = now + SCHEDULE_CHECK_INTERVAL
+
+    latest = snapshots(backup_dir(config), config)[:1]
+    if latest and time.time() - latest[0]['created'] < hours * 3600:
+        return
+    conn = db.get_db()
+    if conn.execute(PENDING_SQL).fetchone():
+        return
+    jobs.submit(conn, 'backup', {'scheduled': True})
+
+
+def init_app(app):
+    for name, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(name, value)
+    app.before_request(_schedule)
@@ -0,0 +1,9 @@
+# Benchmarks (run from the repository root)
+#
+#     python -m benchmarks.generate bench.db --employees 100000
+#     python -m benchmarks.run --db bench.db --out results.json
+#     python -m benchmarks.compare old.json new.json
+#
+# generate builds a synthetic database, run drives every route through the
+# Flask test client and saves the measurements as JSON, and compare prints
+# the change between two result files.
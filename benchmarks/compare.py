@@ -0,0 +1,52 @@
+# Compare two benchmark result files
+#
+#     python -m benchmarks.compare before.json after.json
+#
+# Prints p50/p99 latency and statements per request for every route in
+# both files, with the relative change of the p50.
+import argparse
+import json
+
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        report = json.load(f)
+    return report, {route['route']: route for route in report['routes']}
+
+
+def _change(before, after):
+    if not before:
+        return ''
+    return '%+.0f%%' % ((after - before) * 100.0 / before)
+
+
+def compare(before_path, after_path):
+    before_report, before = _load(before_path)
+    after_report, after = _load(after_path)
+
+    lines = ['before: %s (%s)' % (before_path, before_report.get('commit') or 'unknown commit'),
+             'after:  %s (%s)' % (after_path, after_report.get('commit') or 'unknown commit'),
+             '',
+             '%-50s %17s %17s %7s %11s' % ('route', 'p50 ms', 'p99 ms', 'p50', 'statements')]
+    for name in list(before) + [name for name in after if name not in before]:
+        old, new = before.get(name), after.get(name)
+        if old is None or new is None:
+            lines.append('%-50s %s' % (name, 'only after' if old is None else 'only before'))
+            continue
+        lines.append('%-50s %8.2f→%-8.2f %8.2f→%-8.2f %7s %5.1f→%-5.1f' % (
+            name, old['p50_ms'], new['p50_ms'], old['p99_ms'], new['p99_ms'],
+            _change(old['p50_ms'], new['p50_ms']),
+            old['statements_per_request'], new['statements_per_request']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+    print(compare(args.before, args.after))
+
+
+if __name__ == '__main__':
+    main()
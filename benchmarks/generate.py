@@ -0,0 +1,227 @@
+# Synthetic employee database
+#
+# Builds a database at the current schema with a configurable number of
+# offices, designations and employees. Employees get Devanagari names,
+# dates, caste and bank details, their initial joining record and a few
+# transfers and promotions. The office_positions approvals are sized to the
+# expected headcount, and the filled counts, search index and statistics
+# are maintained by the schema's triggers as rows go in, exactly as they
+# would be in use.
+#
+#     python -m benchmarks.generate bench.db --employees 100000 --offices 100
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import db
+import migrations
+from employee_records import EMPLOYEE_COLUMNS, retirement_date_for
+
+BATCH_SIZE = 10000
+
+FIRST_NAMES = [
+    'राम', 'सुरेश', 'महेश', 'गणेश', 'विजय', 'संजय', 'अनिल', 'सुनील', 'प्रकाश', 'दिलीप',
+    'अशोक', 'रमेश', 'नितीन', 'सचिन', 'अमोल', 'प्रशांत', 'मंगेश', 'संतोष', 'योगेश', 'राजेंद्र',
+    'सुनीता', 'अनिता', 'सविता', 'मनीषा', 'वैशाली', 'स्मिता', 'प्रिया', 'अश्विनी', 'शुभांगी', 'मीनाक्षी',
+    'ज्योती', 'रेखा', 'कविता', 'सुवर्णा', 'माधुरी', 'उज्ज्वला', 'पूजा', 'स्वाती', 'दीपाली', 'रूपाली',
+]
+FEMALE_NAMES = set(FIRST_NAMES[20:])
+
+SURNAMES = [
+    'पाटील', 'देशमुख', 'जाधव', 'पवार', 'शिंदे', 'कुलकर्णी', 'जोशी', 'देशपांडे', 'गायकवाड', 'चव्हाण',
+    'भोसले', 'कदम', 'माने', 'मोरे', 'साळुंखे', 'कांबळे', 'वाघ', 'सावंत', 'घोरपडे', 'कुऱ्हाडे',
+    'लोखंडे', 'आव्हाड', 'बोरसे', 'ठाकरे', 'राऊत', 'गोखले', 'आपटे', 'केळकर', 'मराठे', 'नाईक',
+]
+
+DISTRICTS = ['पुणे', 'नाशिक', 'नागपूर', 'औरंगाबाद', 'कोल्हापूर', 'सातारा', 'सांगली', 'सोलापूर',
+             'अहमदनगर', 'जळगाव', 'अमरावती', 'लातूर', 'नांदेड', 'ठाणे', 'रत्नागिरी']
+
+DESIGNATIONS = ['कनिष्ठ लिपिक', 'वरिष्ठ लिपिक', 'सहाय्यक अधीक्षक', 'अधीक्षक', 'शिपाई', 'वाहनचालक',
+                'लघुलेखक', 'कक्ष अधिकारी', 'उप अभियंता', 'शाखा अभियंता', 'लेखापाल', 'तहसीलदार']
+
+BANKS = [('स्टेट बँक ऑफ इंडिया', 'SBIN'), ('बँक ऑफ महाराष्ट्र', 'MAHB'), ('बँक ऑफ बडोदा', 'BARB')]
+
+
+def _random_date(rng, start, end):
+    return start + timedelta(days=rng.randrange((end - start).days))
+
+
+def _lookup_ids(conn, table):
+    return [row[0] for row in conn.execute('SELECT id FROM %s ORDER BY id' % table)]
+
+
+def _add_lookups(conn, offices, designations):
+    have = conn.execute('SELECT COUNT(*) FROM offices').fetchone()[0]
+    conn.executemany('INSERT INTO offices (office_name) VALUES (?)',
+                     [('%s कार्यालय %d' % (DISTRICTS[i % len(DISTRICTS)], i),) for i in range(have, offices)])
+
+    have = conn.execute('SELECT COUNT(*) FROM designations').fetchone()[0]
+    conn.executemany('INSERT INTO designations (designation_name) VALUES (?)',
+                     [('%s %d' % (DESIGNATIONS[i % len(DESIGNATIONS)], i // len(DESIGNATIONS) + 1),)
+                      for i in range(have, designations)])
+
+
+def _employee(rng, ids, today):
+    first = rng.choice(FIRST_NAMES)
+    birth = _random_date(rng, date(today.year - 60, 1, 1), date(today.year - 21, 1, 1))
+    joining = _random_date(rng, birth + timedelta(days=21 * 365), today)
+    class_id = rng.choice(ids['classes'])
+    caste_id = rng.choice(ids['castes'])
+    sub_castes = ids['sub_castes'].get(caste_id)
+    bank_name, ifsc = rng.choice(BANKS)
+    designation_id = rng.choice(ids['designations'])
+    verified = rng.random() < 0.7
+    exam_passed = rng.random() < 0.5
+
+    values = {
+        'full_name': '%s %s %s' % (first, rng.choice(FIRST_NAMES[:20]), rng.choice(SURNAMES)),
+        'gender': 'स्त्री' if first in FEMALE_NAMES else 'पुरुष',
+        'birth_date': birth.isoformat(),
+        'office_id': rng.choice(ids['offices']),
+        'designation_id': designation_id,
+        'class_id': class_id,
+        'salary_category_id': rng.choice(ids['salary_categories']),
+        'joining_date': joining.isoformat(),
+        'joining_designation_id': designation_id if rng.random() < 0.6 else rng.choice(ids['designations']),
+        'caste_id': caste_id,
+        'sub_caste_id': rng.choice(sub_castes) if sub_castes else None,
+        'caste_verified': verified,
+        'caste_verification_date': _random_date(rng, joining, today + timedelta(days=1)).isoformat() if verified else None,
+        'bindu_number': str(rng.randrange(1, 200)),
+        'department_exam_passed': exam_passed,
+        'department_exam_year': rng.randrange(joining.year, today.year + 1) if exam_passed else None,
+        'pranidhi_id': 'PRAN%010d' % rng.randrange(10 ** 10),
+        'bank_name': bank_name,
+        'ifsc_code': '%s0%06d' % (ifsc, rng.randrange(10 ** 6)),
+        'account_number': '%011d' % rng.randrange(10 ** 11),
+        'aadhar_number': '%012d' % rng.randrange(10 ** 11, 10 ** 12),
+        'gpf_number': 'GPF/%d' % rng.randrange(10 ** 6),
+        'previous_office_release_date': None,
+        'previous_district': '',
+        'previous_designation': '',
+        'current_joining_date': None,
+    }
+    values['retirement_date'] = retirement_date_for(values['birth_date'], class_id)
+    return values
+
+
+def _history(rng, employee_id, values, designation_names, today):
+    joining = date.fromisoformat(values['joining_date'])
+    transfers = []
+    released = joining
+    for _ in range(rng.choice((0, 0, 1, 1, 2, 3))):
+        if (today - released).days < 60:
+            break
+        released = _random_date(rng, released + timedelta(days=30), today)
+        transfers.append((employee_id, released.isoformat(), rng.choice(DISTRICTS),
+                          designation_names[values['designation_id']],
+                          (released + timedelta(days=rng.randrange(1, 30))).isoformat()))
+
+    # The initial joining record, then any promotions
+    promotions = [(employee_id, values['joining_designation_id'], values['joining_date'],
+                   values['joining_date'], designation_names[values['joining_designation_id']])]
+    promoted = joining
+    for _ in range(rng.choice((0, 1, 1, 2))):
+        if (today - promoted).days < 400:
+            break
+        promoted = _random_date(rng, promoted + timedelta(days=365), today)
+        designation_id = rng.choice(list(designation_names))
+        promotions.append((employee_id, designation_id, promoted.isoformat(), promoted.isoformat(),
+                           designation_names[designation_id]))
+    return transfers, promotions
+
+
+def _add_positions(conn, rng, employees):
+    offices = _lookup_ids(conn, 'offices')
+    designations = _lookup_ids(conn, 'designations')
+    expected = employees / float(len(offices) * len(designations))
+
+    rows = []
+    for office_id in offices:
+        for designation_id in designations:
+            approved = max(1, int(round(expected * rng.uniform(0.9, 1.3))))
+            rows.append((office_id, designation_id, approved, 0, approved))
+    conn.executemany('''INSERT OR IGNORE INTO office_positions
+                        (office_id, designation_id, approved_count, filled_count, vacant_count)
+                        VALUES (?, ?, ?, ?, ?)''', rows)
+
+
+# Build (or extend) a database at path. Returns the number of employees
+# added.
+def generate(path, employees=10000, offices=50, designations=20, seed=1, progress=None):
+    rng = random.Random(seed)
+    today = date.today()
+
+    conn = db.connect(path, db.DEFAULT_CONFIG)
+    migrations.migrate(conn)
+    conn.isolation_level = None
+
+    conn.execute('BEGIN IMMEDIATE')
+    _add_lookups(conn, offices, designations)
+    _add_positions(conn, rng, employees)
+    conn.execute('COMMIT')
+
+    ids = {table: _lookup_ids(conn, table)
+           for table in ('offices', 'designations', 'classes', 'salary_categories', 'castes')}
+    ids['sub_castes'] = {}
+    for sub_caste_id, caste_id in conn.execute('SELECT id, caste_id FROM sub_castes'):
+        ids['sub_castes'].setdefault(caste_id, []).append(sub_caste_id)
+    designation_names = dict(conn.execute('SELECT id, designation_name FROM designations').fetchall())
+
+    next_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM employees').fetchone()[0] + 1
+    insert_employee = 'INSERT INTO employees (id, %s) VALUES (%s)' % (
+        ', '.join(EMPLOYEE_COLUMNS), ', '.join('?' * (len(EMPLOYEE_COLUMNS) + 1)))
+
+    added = 0
+    while added < employees:
+        batch = min(BATCH_SIZE, employees - added)
+        employee_rows, transfer_rows, promotion_rows = [], [], []
+        for employee_id in range(next_id, next_id + batch):
+            values = _employee(rng, ids, today)
+            employee_rows.append([employee_id] + [values[column] for column in EMPLOYEE_COLUMNS])
+            transfers, promotions = _history(rng, employee_id, values, designation_names, today)
+            transfer_rows.extend(transfers)
+            promotion_rows.extend(promotions)
+
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany(insert_employee, employee_rows)
+        conn.executemany('''INSERT INTO transfer_history
+                            (employee_id, previous_office_release_date, previous_district,
+                             previous_designation, current_joining_date)
+                            VALUES (?, ?, ?, ?, ?)''', transfer_rows)
+        conn.executemany('''INSERT INTO promotion_history
+                            (employee_id, designation, joining_date, promotion_date, designation_name)
+                            VALUES (?, ?, ?, ?, ?)''', promotion_rows)
+        conn.execute('COMMIT')
+
+        next_id += batch
+        added += batch
+        if progress:
+            progress(added, employees)
+
+    conn.close()
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic employee database')
+    parser.add_argument('path', help='database file to create or extend')
+    parser.add_argument('--employees', type=int, default=10000)
+    parser.add_argument('--offices', type=int, default=50)
+    parser.add_argument('--designations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    started = time.time()
+
+    def progress(done, total):
+        print('\r%d/%d employees (%.0fs)' % (done, total, time.time() - started), end='', flush=True)
+
+    generate(args.path, args.employees, args.offices, args.designations, args.seed, progress)
+    print('\n%s: %d employees, %d offices, %d designations' % (
+        args.path, args.employees, args.offices, args.designations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+# Route benchmarks
+#
+# Drives every route of app.py through the Flask test client against a
+# generated database and records, per route: throughput, p50/p95/p99
+# latency, SQL statements per request (top-level and nested) and
+# the peak Python memory of one request. Results are written as JSON so
+# runs of different versions can be compared (benchmarks/compare.py).
+#
+#     python -m benchmarks.run --db bench.db --requests 200 --out results.json
+#
+# Without --db a temporary database is generated first. The HTML templates
+# are not part of this repository; when they cannot be found, a stand-in
+# template that renders every context value is used and the results say so.
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import jinja2
+from flask import g
+
+import db
+import report_db
+from benchmarks.generate import generate
+
+DEFAULT_REQUESTS = 100
+
+# Templates rendered by app.py, for the stand-in loader
+TEMPLATES = [
+    'login.html', 'dashboard.html', 'employees.html', 'view_employee.html', 'edit_employee.html',
+    'add_employee.html', 'settings.html', 'office_positions.html', 'office_profile.html',
+    'retirement_forecast.html', 'vacancy_projection.html', 'seniority_list.html',
+    'bindu_namavali.html',
+]
+
+# Like the real layout, it takes the flashed messages off the session
+STAND_IN_TEMPLATE = '''{{ get_flashed_messages() }}
+{% for name, value in self._TemplateReference__context.items() %}
+{{ name }}: {{ value }}
+{% endfor %}'''
+
+
+class Context:
+    # Ids sampled from the benchmark database, plus a counter for unique names
+    def __init__(self, conn, rng):
+        self.rng = rng
+        self.serial = 0
+        self.employee_ids = [row[0] for row in conn.execute('SELECT id FROM employees')]
+        self.office_ids = [row[0] for row in conn.execute('SELECT id FROM offices')]
+        self.designation_ids = [row[0] for row in conn.execute('SELECT id FROM designations')]
+        self.caste_ids = [row[0] for row in conn.execute('SELECT id FROM castes')]
+        self.names = [row[0] for row in conn.execute('SELECT full_name FROM employees LIMIT 1000')]
+        self.change_head = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+        self.cadres = [tuple(row) for row in conn.execute(
+            'SELECT office_id, designation_id FROM office_positions')] or [(self.office_ids[0], self.designation_ids[0])]
+        self.employee_form = _employee_form(conn, self.employee_ids[0])
+
+    def employee_id(self):
+        return self.rng.choice(self.employee_ids)
+
+    def unique(self, prefix):
+        self.serial += 1
+        return '%s %d %d' % (prefix, os.getpid(), self.serial)
+
+
+def _employee_form(conn, employee_id):
+    row = conn.execute('SELECT * FROM employees WHERE id = ?', (employee_id,)).fetchone()
+    form = {key: '' if row[key] is None else str(row[key]) for key in row.keys() if key != 'id'}
+    for flag in ('caste_verified', 'department_exam_passed'):
+        if row[flag]:
+            form[flag] = 'on'
+        else:
+            form.pop(flag)
+    return form
+
+
+# Each route: (name, function(client, ctx) -> response). The update and
+# delete benchmarks create the row they work on within the timed call. The
+# runner always works on a copy of the database, so rows added here never
+# reach the source file. /logout is left out: it would end the benchmark's
+# session.
+def _crud(kind, payload):
+    def create(client, ctx):
+        return client.post('/api/%s' % kind, json=payload(ctx))
+
+    def update(client, ctx):
+        created = client.post('/api/%s' % kind, json=payload(ctx)).get_json()
+        response = client.put('/api/%s/%d' % (kind, created['id']), json=payload(ctx))
+        client.delete('/api/%s/%d' % (kind, created['id']))
+        return response
+
+    def delete(client, ctx):
+        created = client.post('/api/%s' % kind, json=payload(ctx)).get_json()
+        return client.delete('/api/%s/%d' % (kind, created['id']))
+
+    return [
+        ('POST /api/%s' % kind, create),
+        ('PUT /api/%s/<id> (with create+delete)' % kind, update),
+        ('DELETE /api/%s/<id> (with create)' % kind, delete),
+    ]
+
+
+def _routes():
+    def edit_employee(client, ctx):
+        form = dict(ctx.employee_form)
+        form['bindu_number'] = str(ctx.rng.randrange(1, 200))
+        return client.post('/employee/%d/edit' % ctx.employee_ids[0], data=form)
+
+    def import_employees(client, ctx):
+        data = 'full_name,gender,birth_date,office,designation,class\n%s,पुरुष,1980-01-01,%d,%d,1\n' % (
+            ctx.unique('आयात'), ctx.rng.choice(ctx.office_ids), ctx.rng.choice(ctx.designation_ids))
+        return client.post('/api/employees/import', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(data.encode('utf-8')), 'employees.csv')})
+
+    def add_employee(client, ctx):
+        form = dict(ctx.employee_form)
+        form['full_name'] = ctx.unique('बेंचमार्क')
+        return client.post('/add_employee', data=form)
+
+    routes = [
+        ('GET /', lambda client, ctx: client.get('/')),
+        ('GET /login', lambda client, ctx: client.get('/login')),
+        ('POST /login', lambda client, ctx: client.post('/login', data={'username': 'admin', 'password': '123'})),
+        ('GET /dashboard', lambda client, ctx: client.get('/dashboard')),
+        ('GET /employees', lambda client, ctx: client.get('/employees')),
+        ('GET /employees?office_id', lambda client, ctx: client.get(
+            '/employees?office_id=%d' % ctx.rng.choice(ctx.office_ids))),
+        ('GET /employees?sort=joining_date&order=desc', lambda client, ctx: client.get(
+            '/employees?sort=joining_date&order=desc')),
+        ('GET /employees/export?office_id', lambda client, ctx: client.get(
+            '/employees/export?office_id=%d' % ctx.rng.choice(ctx.office_ids))),
+        ('GET /employees/export?format=jsonl&office_id', lambda client, ctx: client.get(
+            '/employees/export?format=jsonl&office_id=%d' % ctx.rng.choice(ctx.office_ids))),
+        ('GET /employee/<id>', lambda client, ctx: client.get('/employee/%d' % ctx.employee_id())),
+        ('GET /employee/<id>/edit', lambda client, ctx: client.get('/employee/%d/edit' % ctx.employee_id())),
+        ('POST /employee/<id>/edit', edit_employee),
+        ('GET /add_employee', lambda client, ctx: client.get('/add_employee')),
+        ('POST /add_employee', add_employee),
+        ('GET /api/employees/search', lambda client, ctx: client.get(
+            '/api/employees/search', query_string={'q': ctx.rng.choice(ctx.names).split()[0][:3]})),
+        ('POST /api/employees/import (one row)', import_employees),
+        ('GET /api/changes (last full page)', lambda client, ctx: client.get(
+            '/api/changes', query_string={'since': max(0, ctx.change_head - 500)})),
+        ('GET /reports/retirements', lambda client, ctx: client.get('/reports/retirements')),
+        ('GET /api/reports/retirements', lambda client, ctx: client.get('/api/reports/retirements')),
+        ('GET /reports/vacancies', lambda client, ctx: client.get('/reports/vacancies')),
+        ('GET /api/reports/vacancies', lambda client, ctx: client.get('/api/reports/vacancies')),
+        ('GET /reports/seniority', lambda client, ctx: client.get('/reports/seniority')),
+        ('GET /reports/seniority/export', lambda client, ctx: client.get('/reports/seniority/export')),
+        ('GET /api/reports/seniority?designation_id', lambda client, ctx: client.get(
+            '/api/reports/seniority?designation_id=%d' % ctx.rng.choice(ctx.designation_ids))),
+        ('GET /reports/bindu', lambda client, ctx: client.get('/reports/bindu')),
+        ('GET /api/reports/bindu', lambda client, ctx: client.get('/api/reports/bindu')),
+        ('GET /api/reports/bindu?office_id&designation_id', lambda client, ctx: client.get(
+            '/api/reports/bindu?office_id=%d&designation_id=%d' % ctx.rng.choice(ctx.cadres))),
+        ('GET /office_positions', lambda client, ctx: client.get('/office_positions')),
+        ('POST /add_office_position', lambda client, ctx: client.post('/add_office_position', data={
+            'office_id': ctx.rng.choice(ctx.office_ids),
+            'designation_id': ctx.rng.choice(ctx.designation_ids),
+            'approved_count': ctx.rng.randrange(5, 50)})),
+        ('GET /office_profile', lambda client, ctx: client.get('/office_profile')),
+        ('POST /office_profile', lambda client, ctx: client.post('/office_profile', data={
+            'office_name': 'जिल्हा कार्यालय', 'office_address': 'पुणे', 'email': 'office@example.org',
+            'phone': '020-0000000', 'officer_name': ctx.unique('अधिकारी'), 'designation': 'अधीक्षक',
+            'district_name': 'पुणे', 'senior_clerk_names': '', 'junior_clerk_names': ''})),
+        ('GET /settings', lambda client, ctx: client.get('/settings')),
+        ('GET /get_sub_castes/<id>', lambda client, ctx: client.get(
+            '/get_sub_castes/%d' % ctx.rng.choice(ctx.caste_ids))),
+    ]
+    routes += _crud('offices', lambda ctx: {'name': ctx.unique('कार्यालय')})
+    routes += _crud('designations', lambda ctx: {'name': ctx.unique('पद')})
+    routes += _crud('classes', lambda ctx: {'name': ctx.unique('क्लास')})
+    routes += _crud('salary_categories', lambda ctx: {'name': ctx.unique('श्रेणी')})
+    routes += _crud('castes', lambda ctx: {'name': ctx.unique('जात')})
+    routes += _crud('sub_castes', lambda ctx: {'name': ctx.unique('प्रवर्ग'),
+                                               'caste_id': ctx.rng.choice(ctx.caste_ids)})
+    return routes
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+        self.nested_statements = 0
+
+    def __call__(self, sql):
+        # sqlite reports nested statements (trigger programs, the FTS5
+        # shadow table queries) as '-- ...' comments
+        if sql.startswith('--'):
+            self.nested_statements += 1
+        else:
+            self.statements += 1
+
+
+def _install_stand_in_templates(app):
+    try:
+        app.jinja_env.get_template('dashboard.html')
+        return False
+    except jinja2.TemplateNotFound:
+        stand_in = jinja2.DictLoader({name: STAND_IN_TEMPLATE for name in TEMPLATES})
+        app.jinja_loader = jinja2.ChoiceLoader([app.jinja_loader, stand_in])
+        app.jinja_env.loader = app.jinja_loader
+        return True
+
+
+def run(app, requests=DEFAULT_REQUESTS, seed=1, only=None):
+    counter = StatementCounter()
+
+    # Count statements on whichever pooled connections serve the request:
+    # the request's own and, for reports and exports, the report connection
+    on_acquire = app.config['DB_ON_ACQUIRE']
+
+    def trace_statements(conn):
+        if on_acquire is not None:
+            on_acquire(conn)
+        conn.set_trace_callback(counter)
+    app.config['DB_ON_ACQUIRE'] = trace_statements
+
+    @app.teardown_request
+    def stop_tracing(exception=None):
+        for name in ('db', 'report_db'):
+            conn = g.get(name)
+            if conn is not None:
+                conn.set_trace_callback(None)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+
+    rng = random.Random(seed)
+    with app.app_context():
+        ctx = Context(db.get_db(), rng)
+
+    results = []
+    for name, call in _routes():
+        if only and only not in name:
+            continue
+
+        # Warm up caches and pooled connections first
+        call(client, ctx)
+
+        latencies = []
+        statuses = {}
+        counter.statements = counter.nested_statements = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            t = time.perf_counter()
+            response = call(client, ctx)
+            response.get_data()
+            latencies.append((time.perf_counter() - t) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - started
+        statements = counter.statements
+        nested_statements = counter.nested_statements
+
+        # Memory is measured on a separate request, tracing slows everything down
+        tracemalloc.start()
+        call(client, ctx).get_data()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        latencies.sort()
+        results.append({
+            'route': name,
+            'requests': requests,
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'throughput_rps': round(requests / elapsed, 1),
+            'p50_ms': round(_percentile(latencies, 0.50), 3),
+            'p95_ms': round(_percentile(latencies, 0.95), 3),
+            'p99_ms': round(_percentile(latencies, 0.99), 3),
+            'statements_per_request': round(statements / float(requests), 2),
+            'nested_statements_per_request': round(nested_statements / float(requests), 2),
+            'peak_memory_kb': round(peak / 1024.0, 1),
+        })
+        print('%-50s %8.1f req/s  p50 %7.2f ms  p99 %7.2f ms  %5.1f stmts' % (
+            name, results[-1]['throughput_rps'], results[-1]['p50_ms'], results[-1]['p99_ms'],
+            results[-1]['statements_per_request']))
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _dataset(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {table: conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+                for table in ('employees', 'offices', 'designations', 'office_positions',
+                              'transfer_history', 'promotion_history')}
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route through the Flask test client')
+    parser.add_argument('--db', help='database to benchmark (a copy is used, the file is not modified)')
+    parser.add_argument('--employees', type=int, default=10000, help='employees to generate when --db is not given')
+    parser.add_argument('--offices', type=int, default=50)
+    parser.add_argument('--designations', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='requests per route')
+    parser.add_argument('--route', help='only run routes whose name contains this text')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='employee-bench-')
+    try:
+        path = os.path.join(workdir, 'bench.db')
+        if args.db:
+            # Write routes change the data; work on a copy
+            source = sqlite3.connect(args.db)
+            target = sqlite3.connect(path)
+            source.backup(target)
+            source.close()
+            target.close()
+        else:
+            print('Generating %d employees...' % args.employees)
+            generate(path, args.employees, args.offices, args.designations, args.seed)
+
+        import app as app_module
+        app = app_module.app
+        app.config['DATABASE'] = path
+        app.config['TESTING'] = True
+        app_module.init_db()
+        stand_in = _install_stand_in_templates(app)
+
+        dataset = _dataset(path)
+        started = datetime.now(timezone.utc)
+        routes = run(app, args.requests, args.seed, args.route)
+
+        report = {
+            'started': started.isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'dataset': dataset,
+            'requests_per_route': args.requests,
+            'stand_in_templates': stand_in,
+            'max_rss_kb': _max_rss_kb(),
+            'routes': routes,
+        }
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print('Results written to %s' % args.out)
+    finally:
+        db.close_pool()
+        report_db.close_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, KiB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# Bindu namavali (reservation roster)
+#
+# Every cadre (office x designation) has a roster of approved_count points.
+# Each point is reserved for a category, following the proportional method
+# over CATEGORIES: a point goes to the category that is furthest behind its
+# share (once it is owed at least half a point), otherwise it is open
+# (खुला), so every block of 100 points matches the shares after rounding.
+# Employees occupy the point in their bindu_number; their category comes
+# from their sub-caste's reservation_category (none means open).
+#
+# For each cadre the engine reports, per category, the points reserved,
+# the employees holding them and the backlog (reserved points vacant or
+# held by someone of another category), plus point and employee level
+# issues: a reserved point held by another category or by an employee whose
+# caste is not verified, two employees on one point, and missing or
+# out-of-range bindu numbers. Retired employees are left out.
+#
+# All cadres are computed in one batched pass (one positions query, one
+# employees query). Results are cached per cadre; the roster_versions
+# counters, bumped by triggers on employees and office_positions (see
+# migrations.add_bindu_roster), tell which cadres a write touched, and only
+# those are recomputed. A sub-caste, office or designation change, or a new
+# day, recomputes everything.
+import json
+import threading
+from datetime import date
+
+import lookups
+from db import cache_path
+from http_cache import table_versions
+
+# (code, name, share of the roster in percent); the rest is open
+CATEGORIES = (
+    ('SC', 'अनुसूचित जाती', 13),
+    ('ST', 'अनुसूचित जमाती', 7),
+    ('VJ-A', 'विमुक्त जाती (अ)', 3),
+    ('NT-B', 'भटक्या जमाती (ब)', 2.5),
+    ('NT-C', 'भटक्या जमाती (क)', 3.5),
+    ('NT-D', 'भटक्या जमाती (ड)', 2),
+    ('SBC', 'विशेष मागास प्रवर्ग', 2),
+    ('OBC', 'इतर मागास वर्ग', 19),
+    ('EWS', 'आर्थिकदृष्ट्या दुर्बल घटक', 10),
+)
+OPEN = 'OPEN'
+OPEN_NAME = 'खुला'
+
+CATEGORY_NAMES = dict([(code, name) for code, name, _ in CATEGORIES] + [(OPEN, OPEN_NAME)])
+
+# Longest roster computed; a cadre with more approved posts is reported
+# with an issue and its first MAX_POINTS points
+MAX_POINTS = 10000
+
+# Changes to these recompute every cadre
+DEPENDS_ON = ('sub_castes', 'offices', 'designations')
+
+VERSIONS_SQL = 'SELECT office_id, designation_id, version FROM roster_versions'
+
+POSITIONS_SQL = 'SELECT office_id, designation_id, approved_count FROM office_positions'
+
+EMPLOYEES_SQL = '''SELECT e.office_id, e.designation_id, e.id, e.full_name, e.bindu_number,
+                          e.caste_verified, s.reservation_category
+                   FROM employees e
+                   LEFT JOIN sub_castes s ON s.id = e.sub_caste_id
+                   WHERE e.office_id IS NOT NULL AND e.designation_id IS NOT NULL
+                     AND COALESCE(e.retirement_date, '9999-12-31') >= ?'''
+
+# The same two queries for a list of cadres, given as a JSON array of
+# [office_id, designation_id] pairs
+_CADRES = '''(SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))'''
+POSITIONS_FOR_CADRES_SQL = POSITIONS_SQL + ' WHERE (office_id, designation_id) IN ' + _CADRES
+EMPLOYEES_FOR_CADRES_SQL = EMPLOYEES_SQL + ' AND (e.office_id, e.designation_id) IN ' + _CADRES
+
+_lock = threading.Lock()
+_cache = {}             # database path -> cache state
+_sequence = []          # roster categories of points 1, 2, ... computed so far
+
+
+# Reserved category of each roster point 1..count (at most MAX_POINTS)
+def roster(count):
+    count = min(count, MAX_POINTS)
+    with _lock:
+        if len(_sequence) < count:
+            allotted = {code: 0 for code, _, _ in CATEGORIES}
+            for category in _sequence:
+                if category in allotted:
+                    allotted[category] += 1
+            for point in range(len(_sequence) + 1, count + 1):
+                owed = [(point * share / 100.0 - allotted[code], -index, code)
+                        for index, (code, _, share) in enumerate(CATEGORIES)]
+                deficit, _, code = max(owed)
+                if deficit >= 0.5:
+                    allotted[code] += 1
+                    _sequence.append(code)
+                else:
+                    _sequence.append(OPEN)
+        return _sequence[:count]
+
+
+def _point(bindu_number):
+    try:
+        point = int(str(bindu_number).strip())
+    except (TypeError, ValueError):
+        return None
+    return point if point > 0 else None
+
+
+def _cadre(office_id, designation_id, approved, employees, office_names, designation_names):
+    points = roster(approved)
+    holders = {}
+    issues = []
+    if approved > MAX_POINTS:
+        issues.append({'issue': 'approved posts beyond the %d point roster limit' % MAX_POINTS})
+    filled = {}
+    for employee_id, full_name, bindu_number, caste_verified, category in employees:
+        category = category if category in CATEGORY_NAMES else OPEN
+        filled[category] = filled.get(category, 0) + 1
+        point = _point(bindu_number)
+        employee = {'id': employee_id, 'full_name': full_name, 'category': category,
+                    'caste_verified': bool(caste_verified), 'bindu_number': bindu_number}
+        if point is None:
+            issues.append({'employee_id': employee_id, 'issue': 'missing bindu number'})
+        elif point > approved:
+            issues.append({'employee_id': employee_id, 'point': point, 'issue': 'bindu number beyond approved posts'})
+        elif point > len(points):
+            issues.append({'employee_id': employee_id, 'point': point, 'issue': 'bindu number beyond the roster limit'})
+        else:
+            holders.setdefault(point, []).append(employee)
+
+    held = {}
+    roster_points = []
+    for point, reserved in enumerate(points, start=1):
+        occupants = holders.get(point, [])
+        point_issues = []
+        if len(occupants) > 1:
+            point_issues.append('more than one employee')
+        for employee in occupants:
+            if reserved != OPEN and employee['category'] != reserved:
+                point_issues.append('held by another category')
+            elif reserved != OPEN and not employee['caste_verified']:
+                point_issues.append('caste not verified')
+        if occupants and not point_issues:
+            held[reserved] = held.get(reserved, 0) + 1
+        for issue in point_issues:
+            issues.append({'point': point, 'issue': issue})
+        roster_points.append({'point': point, 'category': reserved, 'employees': occupants,
+                              'issues': point_issues})
+
+    reserved_counts = {}
+    for category in points:
+        reserved_counts[category] = reserved_counts.get(category, 0) + 1
+    categories = []
+    for code in [code for code, _, _ in CATEGORIES] + [OPEN]:
+        reserved = reserved_counts.get(code, 0)
+        categories.append({
+            'code': code,
+            'name': CATEGORY_NAMES[code],
+            'reserved': reserved,
+            'held': held.get(code, 0),
+            'employees': filled.get(code, 0),
+            'backlog': reserved - held.get(code, 0) if code != OPEN else 0,
+        })
+
+    return {
+        'office_id': office_id,
+        'office': office_names.get(office_id),
+        'designation_id': designation_id,
+        'designation': designation_names.get(designation_id),
+        'approved': approved,
+        'employees': len(employees),
+        'backlog': sum(category['backlog'] for category in categories),
+        'compliant': not issues,
+        'categories': categories,
+        'issues': issues,
+        'points': roster_points,
+    }
+
+
+# Compute the given cadres (all when None) in one pass
+def _compute(conn, cadres, today):
+    lookup = lookups.get_lookups(conn)
+    office_names = {row['id']: row['office_name'] for row in lookup['offices']}
+    designation_names = {row['id']: row['designation_name'] for row in lookup['designations']}
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    if cadres is None:
+        positions = cursor.execute(POSITIONS_SQL).fetchall()
+        employees = cursor.execute(EMPLOYEES_SQL, (today.isoformat(),)).fetchall()
+    else:
+        pairs = json.dumps(sorted(cadres))
+        positions = cursor.execute(POSITIONS_FOR_CADRES_SQL, (pairs,)).fetchall()
+        employees = cursor.execute(EMPLOYEES_FOR_CADRES_SQL, (today.isoformat(), pairs)).fetchall()
+
+    approved = {(office_id, designation_id): count or 0 for office_id, designation_id, count in positions}
+    by_cadre = {}
+    for row in employees:
+        by_cadre.setdefault((row[0], row[1]), []).append(row[2:])
+
+    keys = set(approved) | set(by_cadre) if cadres is None else set(cadres)
+    return {key: _cadre(key[0], key[1], approved.get(key, 0), by_cadre.get(key, []),
+                        office_names, designation_names)
+            for key in keys}
+
+
+# Roster results for every cadre, keyed by (office_id, designation_id).
+# The results are shared between requests and must not be modified.
+def get_rosters(conn, today=None):
+    today = today or date.today()
+    path = cache_path(conn)
+
+    versions = table_versions(conn)
+    basis = (today, tuple(versions.get(table) for table in DEPENDS_ON))
+    cadre_versions = {(office_id, designation_id): version
+                      for office_id, designation_id, version in conn.execute(VERSIONS_SQL)}
+
+    with _lock:
+        state = _cache.get(path)
+    if state is None or state['basis'] != basis:
+        results = _compute(conn, None, today)
+        stale = None
+    else:
+        stale = {key for key, version in cadre_versions.items() if state['versions'].get(key) != version}
+        if not stale:
+            return state['results']
+        results = dict(state['results'])
+        results.update(_compute(conn, stale, today))
+
+    # Cadres with neither posts nor employees left drop out
+    results = {key: result for key, result in results.items() if result['approved'] or result['employees']}
+    with _lock:
+        _cache[path] = {'basis': basis, 'versions': cadre_versions, 'results': results}
+    return results
+
+
+# Summary of every cadre (no point lists), ordered by office and designation
+def summary(conn, office_id=None, designation_id=None):
+    rows = []
+    for key, result in sorted(get_rosters(conn).items()):
+        if office_id not in (None, key[0]) or designation_id not in (None, key[1]):
+            continue
+        rows.append({name: value for name, value in result.items() if name not in ('points', 'issues')})
+    return rows
+
+
+# Full roster of one cadre, or None when it has no posts or employees
+def cadre(conn, office_id, designation_id):
+    return get_rosters(conn).get((office_id, designation_id))
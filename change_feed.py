@@ -0,0 +1,114 @@
+# Change feed for incremental synchronisation
+#
+# Triggers on every synchronised table (migrations.LOGGED_TABLES) append a
+# row to change_log in the same transaction as the write, so the log can
+# never disagree with the data. Consumers remember the last sequence number
+# they applied and ask for everything after it:
+#
+#     GET /api/changes?since=<seq>&limit=<n>
+#
+# Each change carries the row as it is now (None once it has been deleted),
+# so a row changed several times is sent with its latest values each time
+# and applying the changes in order is always safe to repeat. A consumer
+# starting from scratch reads `latest` first, takes a full export, then
+# pulls changes since that sequence number.
+#
+# Old entries are removed with `flask --app app prune-changes`; a consumer
+# whose `since` falls before the oldest kept entry gets ChangesPruned and
+# has to start again from a full export. So does one whose `since` is past
+# the latest sequence number, as after a restore or a recreated database.
+import json
+
+from migrations import LOGGED_TABLES
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+# Largest sequence number SQLite can store
+MAX_SEQ = 2 ** 63 - 1
+
+PAGE_SQL = '''SELECT seq, table_name, row_id, operation, changed_at
+              FROM change_log
+              WHERE seq > ?
+              ORDER BY seq
+              LIMIT ?'''
+
+# Highest sequence number ever handed out, whether or not it has been pruned
+LATEST_SQL = "SELECT seq FROM sqlite_sequence WHERE name = 'change_log'"
+
+OLDEST_SQL = 'SELECT MIN(seq) FROM change_log'
+
+# Current values of a page's rows, one query per table
+ROWS_SQL = {table: 'SELECT * FROM %s WHERE id IN (SELECT value FROM json_each(?))' % table
+            for table in LOGGED_TABLES}
+
+# Newest entry older than the cutoff; walks back from the newest end and
+# stops there, so it reads only the entries being kept
+PRUNE_THROUGH_SQL = '''SELECT seq FROM change_log
+                       WHERE changed_at < ?
+                       ORDER BY seq DESC
+                       LIMIT 1'''
+
+
+class ChangesPruned(Exception):
+    pass
+
+
+def latest(conn):
+    row = conn.execute(LATEST_SQL).fetchone()
+    return row[0] if row else 0
+
+
+# One page of changes after `since`. Returns a dict with the changes, the
+# sequence number to ask for next, whether more are waiting and the latest
+# sequence number.
+def changes_since(conn, since, limit=DEFAULT_LIMIT):
+    head = latest(conn)
+    # Ahead of every number handed out: the database was restored or
+    # recreated, and waiting would silently skip changes up to `since`
+    if since > head:
+        raise ChangesPruned('Sequence number %d is past the latest change (%d); resynchronise from a full export'
+                            % (since, head))
+    if since < head:
+        oldest = conn.execute(OLDEST_SQL).fetchone()[0]
+        # Sequence numbers are contiguous, so a gap after `since` means the
+        # entries were pruned
+        if oldest is None or oldest > since + 1:
+            raise ChangesPruned('Changes after %d have been pruned; resynchronise from a full export' % since)
+
+    entries = conn.execute(PAGE_SQL, (since, limit + 1)).fetchall()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    ids = {}
+    for entry in entries:
+        ids.setdefault(entry['table_name'], set()).add(entry['row_id'])
+    rows = {}
+    for table, table_ids in ids.items():
+        for row in conn.execute(ROWS_SQL[table], (json.dumps(sorted(table_ids)),)):
+            rows[table, row['id']] = dict(row)
+
+    changes = [{'seq': entry['seq'],
+                'table': entry['table_name'],
+                'id': entry['row_id'],
+                'operation': entry['operation'],
+                'changed_at': entry['changed_at'],
+                'row': rows.get((entry['table_name'], entry['row_id']))}
+               for entry in entries]
+    return {
+        'changes': changes,
+        'next': changes[-1]['seq'] if changes else since,
+        'more': more,
+        'latest': max(head, changes[-1]['seq']) if changes else head,
+    }
+
+
+# Delete entries recorded before `cutoff` (an ISO timestamp). Returns the
+# number of entries removed.
+def prune(conn, cutoff):
+    row = conn.execute(PRUNE_THROUGH_SQL, (cutoff,)).fetchone()
+    if row is None:
+        return 0
+    removed = conn.execute('DELETE FROM change_log WHERE seq <= ?', (row[0],)).rowcount
+    conn.commit()
+    return removed
@@ -0,0 +1,354 @@
+# Consolidation of office databases into one master database
+#
+# Every month the state office folds the office databases into its own
+# database (the app's DATABASE):
+#
+#     flask --app app consolidate offices/*.db
+#
+# Sources are read in parallel by a process pool (read_source); the master
+# is written by this process alone, with executemany in transactions of
+# about BATCH_SIZE employees. Lookup ids (offices, designations, classes,
+# salary categories, castes, sub-castes) are mapped onto the master by
+# name, adding the names it does not have yet. Employees are matched on
+# aadhar_number, then gpf_number: a match is updated, anything else is
+# inserted, and the employee's transfer and promotion history becomes the
+# source's. Rows and histories that are already identical are left alone,
+# so running the same merge twice writes nothing the second time.
+#
+# Records that cannot be merged safely are skipped and reported as
+# conflicts: no aadhar or gpf number, the two numbers belonging to
+# different master employees or disagreeing with the matched one, or the
+# employee having been merged from an earlier source in the same run.
+# Sub-castes whose caste is missing from their source are skipped too, and
+# reported as lookup conflicts, as is a sub-caste whose reservation
+# category disagrees with the master's (the master's is kept; one the
+# master lacks is filled in).
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from employee_records import EMPLOYEE_COLUMNS, TRANSFER_COLUMNS
+
+BATCH_SIZE = 20000
+
+# Lookup table -> name column; sub-castes are matched on (caste, name)
+LOOKUP_TABLES = {
+    'offices': 'office_name',
+    'designations': 'designation_name',
+    'classes': 'class_name',
+    'salary_categories': 'category_name',
+    'castes': 'caste_name',
+}
+
+# Employee column -> lookup table its id refers to
+LOOKUP_COLUMNS = {
+    'office_id': 'offices',
+    'designation_id': 'designations',
+    'joining_designation_id': 'designations',
+    'class_id': 'classes',
+    'salary_category_id': 'salary_categories',
+    'caste_id': 'castes',
+}
+
+SUB_CASTE_COLUMNS = ('caste_id', 'sub_caste_name', 'reservation_category')
+
+# promotion_history.designation holds a designation id (as text)
+PROMOTION_COLUMNS = ('designation', 'joining_date', 'promotion_date', 'designation_name')
+
+_AADHAR = EMPLOYEE_COLUMNS.index('aadhar_number')
+_GPF = EMPLOYEE_COLUMNS.index('gpf_number')
+
+
+# Columns of `table` in the order given, NULL for any an older database lacks
+def _select_list(conn, table, columns):
+    present = {row[1] for row in conn.execute('PRAGMA table_info(%s)' % table)}
+    return ', '.join(column if column in present else 'NULL' for column in columns)
+
+
+def _read(conn, path):
+    lookups = {table: dict(conn.execute('SELECT id, %s FROM %s' % (column, table)))
+               for table, column in LOOKUP_TABLES.items()}
+    sub_castes = {row[0]: row[1:] for row in conn.execute(
+        'SELECT id, %s FROM sub_castes' % _select_list(conn, 'sub_castes', SUB_CASTE_COLUMNS))}
+
+    employees = conn.execute('SELECT id, %s FROM employees ORDER BY id'
+                             % _select_list(conn, 'employees', EMPLOYEE_COLUMNS)).fetchall()
+    transfers = {}
+    for row in conn.execute('SELECT employee_id, %s FROM transfer_history ORDER BY id'
+                            % _select_list(conn, 'transfer_history', TRANSFER_COLUMNS)):
+        transfers.setdefault(row[0], []).append(row[1:])
+    promotions = {}
+    for row in conn.execute('SELECT employee_id, %s FROM promotion_history ORDER BY id'
+                            % _select_list(conn, 'promotion_history', PROMOTION_COLUMNS)):
+        promotions.setdefault(row[0], []).append(row[1:])
+
+    return {'path': path, 'error': None, 'lookups': lookups, 'sub_castes': sub_castes,
+            'employees': employees, 'transfers': transfers, 'promotions': promotions}
+
+
+# Everything the merge needs from one office database, as plain tuples and
+# dicts so it can be sent back from a worker process. A database that
+# cannot be read comes back with only its path and the error.
+def read_source(path):
+    try:
+        conn = sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            return _read(conn, path)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return {'path': path, 'error': str(e)}
+
+
+# Aadhar and GPF numbers are compared without spaces and case
+def _key(value):
+    if value is None:
+        return None
+    return ''.join(str(value).split()).upper() or None
+
+
+class _Merge:
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        self.names = {table: {name: lookup_id for lookup_id, name in
+                              cursor.execute('SELECT id, %s FROM %s' % (column, table))}
+                      for table, column in LOOKUP_TABLES.items()}
+        self.sub_castes = {}
+        self.categories = {}    # master sub-caste id -> reservation category
+        for sub_caste_id, caste_id, name, category in cursor.execute(
+                'SELECT id, %s FROM sub_castes ORDER BY id' % ', '.join(SUB_CASTE_COLUMNS)):
+            self.sub_castes.setdefault((caste_id, name), sub_caste_id)
+            self.categories[sub_caste_id] = category
+
+        self.employees = {}
+        self.by_aadhar = {}
+        self.by_gpf = {}
+        for row in cursor.execute('SELECT id, %s FROM employees' % ', '.join(EMPLOYEE_COLUMNS)):
+            self.employees[row[0]] = row[1:]
+            self._index(row[0], row[1:])
+        self.transfers = {}
+        for row in cursor.execute('SELECT employee_id, %s FROM transfer_history ORDER BY id'
+                                  % ', '.join(TRANSFER_COLUMNS)):
+            self.transfers.setdefault(row[0], []).append(row[1:])
+        self.promotions = {}
+        for row in cursor.execute('SELECT employee_id, %s FROM promotion_history ORDER BY id'
+                                  % ', '.join(PROMOTION_COLUMNS)):
+            self.promotions.setdefault(row[0], []).append(row[1:])
+
+        # AUTOINCREMENT never reuses an id, so start past sqlite_sequence too
+        self.next_id = cursor.execute('''SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'employees'), 0),
+                                                  COALESCE((SELECT MAX(id) FROM employees), 0))''').fetchone()[0] + 1
+
+        self.merged = {}        # master employee id -> source merged from in this run
+        self.inserts = []
+        self.updates = []
+        self.histories = []     # master employee ids whose history is replaced
+        self.report = {'sources': 0, 'failed': [], 'employees': 0, 'inserted': 0, 'updated': 0,
+                       'unchanged': 0, 'lookups_added': 0, 'conflicts': [], 'lookup_conflicts': []}
+
+    def _index(self, employee_id, values):
+        aadhar = _key(values[_AADHAR])
+        gpf = _key(values[_GPF])
+        if aadhar:
+            self.by_aadhar[aadhar] = employee_id
+        if gpf:
+            self.by_gpf[gpf] = employee_id
+
+    def _begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+
+    # Master id for a lookup name, adding the name when the master lacks it
+    def _lookup_id(self, table, name):
+        if name is None:
+            return None
+        ids = self.names[table]
+        if name not in ids:
+            self._begin()
+            ids[name] = self.conn.execute('INSERT INTO %s (%s) VALUES (?)' % (table, LOOKUP_TABLES[table]),
+                                          (name,)).lastrowid
+            self.report['lookups_added'] += 1
+        return ids[name]
+
+    def _sub_caste_id(self, path, caste_id, name, category):
+        key = (caste_id, name)
+        if key not in self.sub_castes:
+            self._begin()
+            sub_caste_id = self.conn.execute('''INSERT INTO sub_castes (caste_id, sub_caste_name, reservation_category)
+                                                VALUES (?, ?, ?)''', (caste_id, name, category)).lastrowid
+            self.sub_castes[key] = sub_caste_id
+            self.categories[sub_caste_id] = category
+            self.report['lookups_added'] += 1
+            return sub_caste_id
+
+        sub_caste_id = self.sub_castes[key]
+        master = self.categories.get(sub_caste_id)
+        if category is not None and master is None:
+            self._begin()
+            self.conn.execute('UPDATE sub_castes SET reservation_category = ? WHERE id = ?', (category, sub_caste_id))
+            self.categories[sub_caste_id] = category
+        elif category is not None and category != master:
+            self._lookup_conflict(path, name, 'reservation category %s differs from the master\'s %s'
+                                  % (category, master))
+        return sub_caste_id
+
+    def _lookup_conflict(self, path, sub_caste, conflict):
+        self.report['lookup_conflicts'].append({'source': path, 'sub_caste': sub_caste, 'conflict': conflict})
+
+    # Source lookup id -> master id maps for one source
+    def _id_maps(self, source):
+        maps = {table: {lookup_id: self._lookup_id(table, name)
+                        for lookup_id, name in source['lookups'][table].items()}
+                for table in LOOKUP_TABLES}
+        maps['sub_castes'] = {}
+        for sub_caste_id, (caste_id, name, category) in source['sub_castes'].items():
+            if name is None:
+                continue
+            master_caste_id = maps['castes'].get(caste_id)
+            if master_caste_id is None:
+                # No caste dropdown could ever show it in the master
+                self._lookup_conflict(source['path'], name, 'caste %s is not in the source' % caste_id)
+                continue
+            maps['sub_castes'][sub_caste_id] = self._sub_caste_id(source['path'], master_caste_id, name, category)
+        return maps
+
+    # The master employee a source record belongs to (None for a new one),
+    # or a conflict message
+    def _match(self, values):
+        aadhar = _key(values[_AADHAR])
+        gpf = _key(values[_GPF])
+        if not aadhar and not gpf:
+            return None, 'no aadhar or gpf number'
+
+        by_aadhar = self.by_aadhar.get(aadhar) if aadhar else None
+        by_gpf = self.by_gpf.get(gpf) if gpf else None
+        if by_aadhar and by_gpf and by_aadhar != by_gpf:
+            return None, 'aadhar number matches employee %d but gpf number matches employee %d' % (by_aadhar, by_gpf)
+
+        employee_id = by_aadhar or by_gpf
+        if employee_id is None:
+            return None, None
+        master = self.employees[employee_id]
+        if aadhar and _key(master[_AADHAR]) not in (None, aadhar):
+            return None, 'aadhar number differs from employee %d' % employee_id
+        if gpf and _key(master[_GPF]) not in (None, gpf):
+            return None, 'gpf number differs from employee %d' % employee_id
+        if employee_id in self.merged:
+            return None, 'employee %d already merged from %s' % (employee_id, self.merged[employee_id])
+        return employee_id, None
+
+    def add(self, source):
+        self.report['sources'] += 1
+        if source['error']:
+            self.report['failed'].append({'source': source['path'], 'error': source['error']})
+            return
+
+        path = source['path']
+        maps = self._id_maps(source)
+        designation_ids = {str(source_id): str(master_id) for source_id, master_id in maps['designations'].items()}
+
+        for row in source['employees']:
+            self.report['employees'] += 1
+            source_id = row[0]
+            values = []
+            for column, value in zip(EMPLOYEE_COLUMNS, row[1:]):
+                if column in LOOKUP_COLUMNS:
+                    value = maps[LOOKUP_COLUMNS[column]].get(value)
+                elif column == 'sub_caste_id':
+                    value = maps['sub_castes'].get(value)
+                values.append(value)
+            values = tuple(values)
+
+            employee_id, conflict = self._match(values)
+            if conflict:
+                self.report['conflicts'].append({'source': path, 'employee_id': source_id,
+                                                 'full_name': values[0], 'conflict': conflict})
+                continue
+
+            transfers = [tuple(transfer) for transfer in source['transfers'].get(source_id, [])]
+            promotions = [(designation_ids.get(str(designation), designation),) + tuple(rest)
+                          for designation, *rest in source['promotions'].get(source_id, [])]
+
+            if employee_id is None:
+                employee_id = self.next_id
+                self.next_id += 1
+                self.inserts.append((employee_id,) + values)
+                self.report['inserted'] += 1
+            elif self.employees[employee_id] != values:
+                self.updates.append(values + (employee_id,))
+                self.report['updated'] += 1
+            else:
+                self.report['unchanged'] += 1
+
+            if (self.transfers.get(employee_id, []) != transfers
+                    or self.promotions.get(employee_id, []) != promotions):
+                self.histories.append(employee_id)
+                self.transfers[employee_id] = transfers
+                self.promotions[employee_id] = promotions
+
+            self.employees[employee_id] = values
+            self._index(employee_id, values)
+            self.merged[employee_id] = path
+
+        if len(self.inserts) + len(self.updates) + len(self.histories) >= self.batch_size:
+            self.flush()
+
+    # Write the pending employees and histories in one transaction
+    def flush(self):
+        if not (self.inserts or self.updates or self.histories or self.conn.in_transaction):
+            return
+
+        self._begin()
+        try:
+            conn = self.conn
+            conn.executemany('INSERT INTO employees (id, %s) VALUES (%s)' % (
+                ', '.join(EMPLOYEE_COLUMNS), ', '.join('?' * (len(EMPLOYEE_COLUMNS) + 1))), self.inserts)
+            conn.executemany('UPDATE employees SET %s WHERE id = ?' % ', '.join(
+                '%s = ?' % column for column in EMPLOYEE_COLUMNS), self.updates)
+
+            ids = [(employee_id,) for employee_id in self.histories]
+            conn.executemany('DELETE FROM transfer_history WHERE employee_id = ?', ids)
+            conn.executemany('DELETE FROM promotion_history WHERE employee_id = ?', ids)
+            conn.executemany('INSERT INTO transfer_history (employee_id, %s) VALUES (?, %s)' % (
+                ', '.join(TRANSFER_COLUMNS), ', '.join('?' * len(TRANSFER_COLUMNS))),
+                [(employee_id,) + transfer for employee_id in self.histories
+                 for transfer in self.transfers[employee_id]])
+            conn.executemany('INSERT INTO promotion_history (employee_id, %s) VALUES (?, %s)' % (
+                ', '.join(PROMOTION_COLUMNS), ', '.join('?' * len(PROMOTION_COLUMNS))),
+                [(employee_id,) + promotion for employee_id in self.histories
+                 for promotion in self.promotions[employee_id]])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.inserts = []
+        self.updates = []
+        self.histories = []
+
+
+# Merge the office databases at `paths` into `conn`, in path order. Sources
+# are read by `workers` processes (default: one per CPU). progress, if
+# given, is called with (sources merged, total) after each source. Returns
+# a report dict: sources read, failed sources, employees read, inserted,
+# updated and unchanged, lookup names added and the conflicts.
+def merge(conn, paths, workers=None, batch_size=BATCH_SIZE, progress=None):
+    state = _Merge(conn, batch_size)
+    workers = workers or os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(paths) // (workers * 4))
+            for source in executor.map(read_source, paths, chunksize=chunksize):
+                state.add(source)
+                if progress:
+                    progress(state.report['sources'], len(paths))
+        state.flush()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return state.report
@@ -0,0 +1,61 @@
+# Dashboard statistics
+#
+# The dashboard reads precomputed figures instead of counting rows on every
+# load. dashboard_stats (one row), office_stats (one row per office) and
+# retirement_stats (retirements per year and office) are kept current by
+# triggers on employees, offices, designations and office_positions (see
+# migrations.add_dashboard_stats), so every write path - forms, the
+# settings API, bulk import - updates them in its own transaction.
+from datetime import date
+
+OFFICE_STATS_SQL = '''SELECT o.id, o.office_name, st.headcount, st.approved, st.vacancies,
+                      COALESCE(r0.retirements, 0) AS retiring_this_year,
+                      COALESCE(r1.retirements, 0) AS retiring_next_year
+                      FROM office_stats st
+                      JOIN offices o ON st.office_id = o.id
+                      LEFT JOIN retirement_stats r0 ON r0.year = ? AND r0.office_id = st.office_id
+                      LEFT JOIN retirement_stats r1 ON r1.year = ? AND r1.office_id = st.office_id
+                      ORDER BY o.id'''
+
+RETIREMENTS_SQL = 'SELECT COALESCE(SUM(retirements), 0) FROM retirement_stats WHERE year = ?'
+
+
+# Figures for the dashboard: a dict with the totals, retirements due this
+# and next calendar year, and per-office rows
+def load(conn, today=None):
+    year = (today or date.today()).year
+
+    totals = conn.execute('SELECT * FROM dashboard_stats WHERE id = 1').fetchone()
+    offices = conn.execute(OFFICE_STATS_SQL, (year, year + 1)).fetchall()
+
+    return {
+        'total_employees': totals['total_employees'] if totals else 0,
+        'total_offices': totals['total_offices'] if totals else 0,
+        'total_designations': totals['total_designations'] if totals else 0,
+        'total_vacancies': sum(office['vacancies'] for office in offices),
+        'retiring_this_year': conn.execute(RETIREMENTS_SQL, (year,)).fetchone()[0],
+        'retiring_next_year': conn.execute(RETIREMENTS_SQL, (year + 1,)).fetchone()[0],
+        'offices': offices,
+    }
+
+
+# Rebuild all statistics from the underlying tables. Only needed after
+# editing the database by hand.
+def recount(conn):
+    conn.execute('''INSERT OR REPLACE INTO dashboard_stats (id, total_employees, total_offices, total_designations)
+                    VALUES (1, (SELECT COUNT(*) FROM employees), (SELECT COUNT(*) FROM offices),
+                            (SELECT COUNT(*) FROM designations))''')
+    conn.execute('DELETE FROM office_stats')
+    conn.execute('''INSERT INTO office_stats (office_id, headcount, approved, vacancies)
+                    SELECT o.id,
+                           (SELECT COUNT(*) FROM employees e WHERE e.office_id = o.id),
+                           (SELECT COALESCE(SUM(approved_count), 0) FROM office_positions op WHERE op.office_id = o.id),
+                           (SELECT COALESCE(SUM(vacant_count), 0) FROM office_positions op WHERE op.office_id = o.id)
+                    FROM offices o''')
+    conn.execute('DELETE FROM retirement_stats')
+    conn.execute('''INSERT INTO retirement_stats (year, office_id, retirements)
+                    SELECT CAST(substr(retirement_date, 1, 4) AS INTEGER), COALESCE(office_id, 0), COUNT(*)
+                    FROM employees
+                    WHERE retirement_date IS NOT NULL
+                    GROUP BY 1, 2''')
+    conn.commit()
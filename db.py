@@ -0,0 +1,167 @@
+# Database connection management
+#
+# Every request borrows one SQLite connection, stored on flask.g, and hands
+# it back to a small per-thread pool when the app context is torn down.
+# Connections are opened once with the pragmas below, so short requests do
+# not pay for connect/PRAGMA/close on every call.
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+
+from flask import current_app, g
+
+DEFAULT_DATABASE = 'employee.db'
+
+# Defaults for the connection pragmas; each one can be overridden from
+# app.config (see init_app)
+DEFAULT_CONFIG = {
+    'DATABASE': DEFAULT_DATABASE,
+    'DB_POOL_SIZE': 4,
+    'DB_BUSY_TIMEOUT': 5000,        # milliseconds
+    'DB_CACHE_SIZE': -16000,        # negative = KiB, so roughly 16 MB
+    'DB_MMAP_SIZE': 256 * 1024 * 1024,
+    # Set by metrics.init_app to count statements per request
+    'DB_CONNECTION_CLASS': None,    # None = Connection
+    'DB_ON_ACQUIRE': None,          # called with the request's connection
+    'DB_ON_RELEASE': None,          # called before it goes back to the pool
+}
+
+_local = threading.local()
+
+
+# Connections are opened with this class so per-connection state (for
+# example the data_version last seen by the lookup cache) can be kept as
+# plain attributes
+class Connection(sqlite3.Connection):
+    # Database whose data the connection reads, for the in-process caches;
+    # None = app.config['DATABASE']
+    cache_path = None
+
+
+def _setting(name, config=None):
+    if config is None:
+        config = current_app.config
+    return config.get(name, DEFAULT_CONFIG[name])
+
+
+# Open a new connection with the tuned pragmas applied
+def connect(path=None, config=None):
+    if path is None:
+        path = _setting('DATABASE', config)
+
+    conn = sqlite3.connect(path, timeout=_setting('DB_BUSY_TIMEOUT', config) / 1000.0,
+                           factory=_setting('DB_CONNECTION_CLASS', config) or Connection)
+    conn.row_factory = sqlite3.Row
+
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA busy_timeout = %d' % int(_setting('DB_BUSY_TIMEOUT', config)))
+    conn.execute('PRAGMA cache_size = %d' % int(_setting('DB_CACHE_SIZE', config)))
+    conn.execute('PRAGMA mmap_size = %d' % int(_setting('DB_MMAP_SIZE', config)))
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+# Open a read-only connection (mode=ro, query_only). An immutable database is
+# one that no connection will ever change, so SQLite skips locking entirely.
+def connect_readonly(path, config=None, immutable=False):
+    uri = 'file:%s?mode=ro' % quote(os.path.abspath(path))
+    if immutable:
+        uri += '&immutable=1'
+
+    conn = sqlite3.connect(uri, uri=True, timeout=_setting('DB_BUSY_TIMEOUT', config) / 1000.0,
+                           factory=_setting('DB_CONNECTION_CLASS', config) or Connection)
+    conn.row_factory = sqlite3.Row
+    conn.cache_path = path
+
+    conn.execute('PRAGMA query_only = 1')
+    conn.execute('PRAGMA busy_timeout = %d' % int(_setting('DB_BUSY_TIMEOUT', config)))
+    conn.execute('PRAGMA cache_size = %d' % int(_setting('DB_CACHE_SIZE', config)))
+    conn.execute('PRAGMA mmap_size = %d' % int(_setting('DB_MMAP_SIZE', config)))
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+# Key under which results computed from `conn` are cached
+def cache_path(conn):
+    return getattr(conn, 'cache_path', None) or _setting('DATABASE')
+
+
+def _pool(path):
+    pools = getattr(_local, 'pools', None)
+    if pools is None:
+        pools = _local.pools = {}
+    return pools.setdefault(path, [])
+
+
+# Take an idle connection from this thread's pool, or open a new one
+def acquire(path=None):
+    if path is None:
+        path = _setting('DATABASE')
+
+    pool = _pool(path)
+    if pool:
+        return pool.pop()
+    return connect(path)
+
+
+# Give a connection back to this thread's pool, closing it if the pool is full
+def release(conn, path=None):
+    if path is None:
+        path = _setting('DATABASE')
+
+    # Never hand out a connection with a half-finished transaction
+    if conn.in_transaction:
+        conn.rollback()
+
+    pool = _pool(path)
+    if len(pool) < _setting('DB_POOL_SIZE'):
+        pool.append(conn)
+    else:
+        conn.close()
+
+
+# Connection for the current app context; the same one is returned for the
+# whole request
+def get_db():
+    if 'db' not in g:
+        g.db_path = _setting('DATABASE')
+        g.db = acquire(g.db_path)
+        on_acquire = _setting('DB_ON_ACQUIRE')
+        if on_acquire is not None:
+            on_acquire(g.db)
+    return g.db
+
+
+def close_db(exception=None):
+    conn = g.pop('db', None)
+    path = g.pop('db_path', None)
+    if conn is None:
+        return
+
+    on_release = _setting('DB_ON_RELEASE')
+    if on_release is not None:
+        on_release(conn)
+    try:
+        release(conn, path)
+    except sqlite3.Error:
+        conn.close()
+
+
+# Close every pooled connection owned by the calling thread
+def close_pool():
+    pools = getattr(_local, 'pools', None)
+    if not pools:
+        return
+
+    for pool in pools.values():
+        while pool:
+            pool.pop().close()
+    pools.clear()
+
+
+def init_app(app):
+    for name, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(name, value)
+    app.teardown_appcontext(close_db)
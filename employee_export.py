@@ -0,0 +1,69 @@
+# Employee export
+#
+# Streams the employee list, with the same columns, filters and order as
+# /employees, as CSV or JSON Lines. Rows are read FETCH_SIZE at a time with
+# fetchmany and written out chunk by chunk, so memory use does not grow with
+# the number of employees exported.
+import csv
+import io
+import json
+
+import employee_list
+
+FETCH_SIZE = 500
+
+# Format -> content type; the format name is also the file extension
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Excel only detects UTF-8 (and so shows Devanagari correctly) when the
+# file starts with a byte order mark
+CSV_BOM = '\ufeff'
+
+
+def _batches(conn, filters, sort, order):
+    sql, params = employee_list.export_query(filters, sort, order)
+    cursor = conn.execute(sql, params)
+    try:
+        columns = [column[0] for column in cursor.description if column[0] != 'sort_key']
+        yield columns
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield [[row[column] for column in columns] for row in rows]
+    finally:
+        cursor.close()
+
+
+def iter_csv(conn, filters, sort='name', order='asc'):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    batches = _batches(conn, filters, sort, order)
+    writer.writerow(next(batches))
+    yield CSV_BOM + buffer.getvalue()
+
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def iter_jsonl(conn, filters, sort='name', order='asc'):
+    batches = _batches(conn, filters, sort, order)
+    columns = next(batches)
+
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                      for row in rows)
+
+
+# Chunks of the export in the given format ('csv' or 'jsonl')
+def generate(conn, fmt, filters, sort='name', order='asc'):
+    if fmt == 'jsonl':
+        return iter_jsonl(conn, filters, sort, order)
+    return iter_csv(conn, filters, sort, order)
@@ -0,0 +1,320 @@
+# Bulk employee import
+#
+# Reads employees from a CSV or XLSX file one row at a time, resolves office,
+# designation, class, salary category, caste and sub-caste names to ids with
+# the in-memory lookup maps, validates each row and inserts the valid ones
+# with executemany, BATCH_SIZE rows per transaction. Every new employee also
+# gets the initial promotion_history row that add_employee creates.
+#
+# Office position counts need no separate pass: the employees triggers
+# adjust them inside the same transactions.
+#
+# A file that cannot be read part way through (bad encoding, broken CSV
+# quoting, a damaged workbook) stops the import with ImportFormatError,
+# naming the row and how many rows earlier batches already committed.
+#
+# XLSX support needs openpyxl (pip install openpyxl); CSV has no extra
+# dependencies.
+import csv
+import io
+import re
+import zipfile
+import zlib
+from datetime import date, datetime
+
+import lookups
+from employee_records import EMPLOYEE_COLUMNS, retirement_date_for
+
+BATCH_SIZE = 10000
+
+# Column name -> accepted header spellings (compared case-insensitively)
+HEADERS = {
+    'full_name': ('full_name', 'name', 'संपुर्ण नांव'),
+    'gender': ('gender', 'जेंडर'),
+    'birth_date': ('birth_date', 'जन्मतारीख'),
+    'office': ('office', 'office_name', 'office_id', 'कार्यालयाचे नांव'),
+    'designation': ('designation', 'designation_name', 'designation_id', 'पदनाम'),
+    'class': ('class', 'class_name', 'class_id', 'क्लास'),
+    'salary_category': ('salary_category', 'category_name', 'salary_category_id', 'वेतनश्रेणी'),
+    'joining_date': ('joining_date', 'नोकरीत हजर दिनांक'),
+    'joining_designation': ('joining_designation', 'joining_designation_id', 'नोकरीत कोणत्या पदावर हजर'),
+    'caste': ('caste', 'caste_name', 'caste_id', 'जात'),
+    'sub_caste': ('sub_caste', 'sub_caste_name', 'sub_caste_id', 'जात प्रवर्ग'),
+    'caste_verified': ('caste_verified', 'जात पडताळणी झाली आहे काय?'),
+    'caste_verification_date': ('caste_verification_date',),
+    'bindu_number': ('bindu_number', 'बिंदु नामावतील क्रमाक'),
+    'department_exam_passed': ('department_exam_passed', 'विभागीय परिक्षा पास आहे काय?'),
+    'department_exam_year': ('department_exam_year',),
+    'pranidhi_id': ('pranidhi_id', 'pran_id', 'आर सरीता आय डी'),
+    'bank_name': ('bank_name', 'बॅकचे नांव'),
+    'ifsc_code': ('ifsc_code', 'आयएफसी कोड'),
+    'account_number': ('account_number', 'अकाऊट नंबर'),
+    'aadhar_number': ('aadhar_number', 'आधार नंबर'),
+    'gpf_number': ('gpf_number', 'जी पी एफ नंबर'),
+}
+
+_HEADER_LOOKUP = {alias.strip().lower(): field
+                  for field, aliases in HEADERS.items() for alias in aliases}
+
+# Lookup fields: field -> (lookups map, name of the ids in error messages)
+LOOKUP_FIELDS = {
+    'office': ('office_ids', 'office'),
+    'designation': ('designation_ids', 'designation'),
+    'class': ('class_ids', 'class'),
+    'salary_category': ('salary_category_ids', 'salary category'),
+    'joining_designation': ('designation_ids', 'joining designation'),
+    'caste': ('caste_ids', 'caste'),
+}
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'होय', 'हो'}
+
+# Accepted date forms: 2024-03-31, and day first 31/03/2024, 31-03-2024, 31.03.2024
+_ISO_DATE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+_DMY_DATE = re.compile(r'^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})$')
+
+
+# Errors from reading the file itself, as opposed to a bad value in a row
+READ_ERRORS = (csv.Error, ValueError, KeyError, EOFError, OSError, zipfile.BadZipFile, zlib.error)
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets hand numbers back as floats
+        value = int(value)
+    return str(value).strip()
+
+
+def _date(value, field):
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, date):
+        return value.isoformat()
+
+    # strptime is slow enough to dominate a large import, so parse by hand
+    text = _text(value)
+    try:
+        match = _ISO_DATE.match(text)
+        if match:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+        match = _DMY_DATE.match(text)
+        if match:
+            return date(int(match.group(3)), int(match.group(2)), int(match.group(1))).isoformat()
+    except ValueError:
+        pass
+    raise ValueError('%s: invalid date %r' % (field, text))
+
+
+def _lookup_id(ids, value, label):
+    text = _text(value)
+    if not text:
+        return None
+    if text in ids:
+        return ids[text]
+    # Also accept the numeric id itself
+    if text.isdigit() and int(text) in ids.values():
+        return int(text)
+    raise ValueError('unknown %s %r' % (label, text))
+
+
+# Turn one raw record (field -> cell value) into employee column values.
+# Raises ValueError describing the first problem found.
+def parse_record(record, lookup):
+    full_name = _text(record.get('full_name'))
+    if not full_name:
+        raise ValueError('full_name is required')
+    gender = _text(record.get('gender'))
+    if not gender:
+        raise ValueError('gender is required')
+    birth_date = _date(record.get('birth_date'), 'birth_date')
+    if not birth_date:
+        raise ValueError('birth_date is required')
+
+    values = {
+        'full_name': full_name,
+        'gender': gender,
+        'birth_date': birth_date,
+        'joining_date': _date(record.get('joining_date'), 'joining_date'),
+        'caste_verified': _text(record.get('caste_verified')).lower() in TRUE_VALUES,
+        'caste_verification_date': _date(record.get('caste_verification_date'), 'caste_verification_date'),
+        'bindu_number': _text(record.get('bindu_number')),
+        'department_exam_passed': _text(record.get('department_exam_passed')).lower() in TRUE_VALUES,
+        'department_exam_year': _text(record.get('department_exam_year')) or None,
+        'pranidhi_id': _text(record.get('pranidhi_id')),
+        'bank_name': _text(record.get('bank_name')),
+        'ifsc_code': _text(record.get('ifsc_code')),
+        'account_number': _text(record.get('account_number')),
+        'aadhar_number': _text(record.get('aadhar_number')),
+        'gpf_number': _text(record.get('gpf_number')),
+        'previous_office_release_date': None,
+        'previous_district': '',
+        'previous_designation': '',
+        'current_joining_date': None,
+    }
+
+    resolved = {}
+    for field, (map_name, label) in LOOKUP_FIELDS.items():
+        resolved[field] = _lookup_id(lookup[map_name], record.get(field), label)
+    values['office_id'] = resolved['office']
+    values['designation_id'] = resolved['designation']
+    values['class_id'] = resolved['class']
+    values['salary_category_id'] = resolved['salary_category']
+    values['joining_designation_id'] = resolved['joining_designation'] or resolved['designation']
+    values['caste_id'] = resolved['caste']
+
+    # Sub-castes are named within their caste
+    sub_caste = _text(record.get('sub_caste'))
+    values['sub_caste_id'] = None
+    if sub_caste:
+        sub_caste_id = lookup['sub_caste_ids'].get((values['caste_id'], sub_caste))
+        if sub_caste_id is None and sub_caste.isdigit():
+            sub_caste_id = int(sub_caste)
+            if sub_caste_id not in lookup['sub_caste_ids'].values():
+                sub_caste_id = None
+        if sub_caste_id is None:
+            raise ValueError('unknown sub caste %r for this caste' % sub_caste)
+        values['sub_caste_id'] = sub_caste_id
+
+    values['retirement_date'] = retirement_date_for(birth_date, values['class_id'])
+    return values
+
+
+# The rows of a reader, with read errors raised as ImportFormatError
+def _checked(rows):
+    rows = iter(rows)
+    row_number = 1
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except READ_ERRORS as e:
+            raise ImportFormatError('Cannot read row %d of the file: %s' % (row_number, e))
+        yield row
+        row_number += 1
+
+
+def _records(rows):
+    rows = _checked(rows)
+    header = next(rows, None)
+    if header is None:
+        raise ImportFormatError('The file is empty')
+
+    fields = [_HEADER_LOOKUP.get(_text(name).lower()) for name in header]
+    if 'full_name' not in fields:
+        raise ImportFormatError('No full_name column found in the header row')
+
+    # Row numbers count the header as row 1, as a spreadsheet shows them
+    for row_number, row in enumerate(rows, start=2):
+        if not any(_text(cell) for cell in row):
+            continue
+        yield row_number, {field: cell for field, cell in zip(fields, row) if field}
+
+
+# Decode a binary stream one line at a time, so a decoding error surfaces
+# on the row it is in
+def _lines(stream):
+    for number, line in enumerate(stream):
+        yield line.decode('utf-8-sig' if number == 0 else 'utf-8')
+
+
+def read_csv(stream):
+    if not isinstance(stream, io.TextIOBase):
+        stream = _lines(stream)
+    return _records(csv.reader(stream))
+
+
+def read_xlsx(stream):
+    try:
+        import openpyxl
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ImportFormatError('XLSX import needs the openpyxl package (pip install openpyxl)')
+
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except (InvalidFileException,) + READ_ERRORS as e:
+        raise ImportFormatError('Cannot read the workbook: %s' % e)
+    return _records(workbook.active.iter_rows(values_only=True))
+
+
+# Pick the reader from the file name
+def read_file(stream, filename):
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        return read_xlsx(stream)
+    if filename.lower().endswith(('.csv', '.txt')):
+        return read_csv(stream)
+    raise ImportFormatError('Unsupported file type: %s (use .csv or .xlsx)' % filename)
+
+
+def _insert_batch(conn, batch):
+    if conn.in_transaction:
+        conn.commit()
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Assign ids up front so the promotion rows can reference them;
+        # AUTOINCREMENT never reuses an id, so start past sqlite_sequence too
+        last_id = conn.execute('''SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'employees'), 0),
+                                             COALESCE((SELECT MAX(id) FROM employees), 0))''').fetchone()[0]
+
+        employee_rows = []
+        promotion_rows = []
+        for offset, values in enumerate(batch, start=1):
+            employee_id = last_id + offset
+            employee_rows.append([employee_id] + [values[column] for column in EMPLOYEE_COLUMNS])
+            promotion_rows.append((employee_id, values['joining_designation_id'],
+                                   values['joining_date'], values['joining_date']))
+
+        conn.executemany('INSERT INTO employees (id, %s) VALUES (%s)' % (
+            ', '.join(EMPLOYEE_COLUMNS), ', '.join('?' * (len(EMPLOYEE_COLUMNS) + 1))), employee_rows)
+        conn.executemany('''INSERT INTO promotion_history
+                            (employee_id, designation, joining_date, promotion_date)
+                            VALUES (?, ?, ?, ?)''', promotion_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Import (row_number, record) pairs from read_file(). Returns a report dict
+# with the number of data rows read, rows inserted and a list of per-row
+# errors ({'row': n, 'error': message}). progress, if given, is called with
+# the number of rows read after each batch is committed.
+def import_employees(conn, records, batch_size=BATCH_SIZE, progress=None):
+    lookup = lookups.get_lookups(conn)
+    report = {'rows': 0, 'inserted': 0, 'errors': []}
+
+    batch = []
+    try:
+        for row_number, record in records:
+            report['rows'] += 1
+            try:
+                batch.append(parse_record(record, lookup))
+            except ValueError as e:
+                report['errors'].append({'row': row_number, 'error': str(e)})
+                continue
+
+            if len(batch) >= batch_size:
+                _insert_batch(conn, batch)
+                report['inserted'] += len(batch)
+                batch = []
+                if progress:
+                    progress(report['rows'])
+    except ImportFormatError as e:
+        if report['inserted']:
+            raise ImportFormatError('%s; %d rows before it were already imported' % (e, report['inserted']))
+        raise
+
+    if batch:
+        _insert_batch(conn, batch)
+        report['inserted'] += len(batch)
+
+    return report
@@ -0,0 +1,174 @@
+# Employee list queries
+#
+# The /employees page is served a page at a time with keyset (seek)
+# pagination: each page remembers the sort key and id of its last row, and
+# the next page starts strictly after it. Only the columns the list shows
+# are selected, so bank and Aadhar data never leave the database here.
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Columns shown in the employee list
+LIST_COLUMNS = '''e.id, e.full_name, e.gender, e.birth_date, e.joining_date, e.retirement_date,
+                 e.bindu_number, e.caste_verified, e.department_exam_passed,
+                 e.office_id, e.designation_id, e.class_id, e.caste_id,
+                 e.office_name, e.designation_name, e.class_name, e.category_name,
+                 e.caste_name, e.sub_caste_name, e.joining_designation_name'''
+
+# employee_details carries the lookup names alongside the ids (see
+# migrations.add_employee_details), so the list reads a single table
+LIST_FROM = 'FROM employee_details e'
+
+# Sort name -> SQL expression; the expression must never be NULL so that
+# the (key, id) seek comparison stays well defined
+SORT_KEYS = {
+    'name': 'e.full_name',
+    'joining_date': "COALESCE(e.joining_date, '')",
+}
+
+INT_FILTERS = ('office_id', 'designation_id', 'class_id', 'caste_id')
+
+
+def _int_arg(args, name):
+    value = args.get(name, '')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Read the list filters from request arguments, ignoring blank or bad values
+def parse_filters(args):
+    filters = {}
+    for name in INT_FILTERS:
+        value = _int_arg(args, name)
+        if value is not None:
+            filters[name] = value
+
+    gender = (args.get('gender') or '').strip()
+    if gender:
+        filters['gender'] = gender
+
+    retirement_year = _int_arg(args, 'retirement_year')
+    if retirement_year is not None:
+        filters['retirement_year'] = retirement_year
+
+    return filters
+
+
+# Build the WHERE clause for a set of filters
+def filter_clause(filters):
+    conditions = []
+    params = []
+
+    for name in INT_FILTERS:
+        if name in filters:
+            conditions.append('e.%s = ?' % name)
+            params.append(filters[name])
+
+    if 'gender' in filters:
+        conditions.append('e.gender = ?')
+        params.append(filters['gender'])
+
+    if 'retirement_year' in filters:
+        # Range form so an index on retirement_date can be used
+        year = filters['retirement_year']
+        conditions.append('e.retirement_date >= ? AND e.retirement_date < ?')
+        params.extend(['%04d-01-01' % year, '%04d-01-01' % (year + 1)])
+
+    return conditions, params
+
+
+def parse_sort(args):
+    sort = args.get('sort', 'name')
+    if sort not in SORT_KEYS:
+        sort = 'name'
+    order = 'desc' if args.get('order') == 'desc' else 'asc'
+    return sort, order
+
+
+def parse_page_size(args):
+    page_size = _int_arg(args, 'page_size')
+    if page_size is None or page_size < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def encode_cursor(key, row_id):
+    raw = json.dumps([key, row_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+# Whether a decoded cursor value can be bound as a query parameter; a
+# crafted cursor could hold a list, an object or an integer SQLite cannot
+# store
+def valid_cursor_value(value):
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return value is None or isinstance(value, (str, float))
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        row_id = int(row_id)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if not valid_cursor_value(key) or not valid_cursor_value(row_id):
+        return None
+    return key, row_id
+
+
+def _ordered_query(filters, sort, order, cursor=None):
+    sort_key = SORT_KEYS[sort]
+    conditions, params = filter_clause(filters)
+
+    after = decode_cursor(cursor)
+    if after is not None:
+        comparison = '<' if order == 'desc' else '>'
+        conditions.append('(%s, e.id) %s (?, ?)' % (sort_key, comparison))
+        params.extend(after)
+
+    sql = 'SELECT %s, %s AS sort_key %s' % (LIST_COLUMNS, sort_key, LIST_FROM)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    sql += ' ORDER BY %s %s, e.id %s' % (sort_key, direction, direction)
+
+    return sql, params
+
+
+# Build the SQL and parameters for one page of the employee list. One row
+# more than page_size is requested so the caller can tell whether another
+# page follows.
+def page_query(filters, sort='name', order='asc', page_size=DEFAULT_PAGE_SIZE, cursor=None):
+    sql, params = _ordered_query(filters, sort, order, cursor)
+    sql += ' LIMIT ?'
+    params.append(page_size + 1)
+
+    return sql, params
+
+
+# Build the SQL and parameters for every row matching the filters, in list
+# order, for exports
+def export_query(filters, sort='name', order='asc'):
+    return _ordered_query(filters, sort, order)
+
+
+# Fetch one page of the employee list.
+# Returns (rows, next_cursor); next_cursor is None on the last page.
+def fetch_page(conn, filters, sort='name', order='asc', page_size=DEFAULT_PAGE_SIZE, cursor=None):
+    sql, params = page_query(filters, sort, order, page_size, cursor)
+    rows = conn.execute(sql, params).fetchall()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['sort_key'], last['id'])
+
+    return rows, next_cursor
@@ -0,0 +1,210 @@
+# Saving employee records
+#
+# An edit form save reconciles the employee row, transfer history and
+# promotion history in one transaction. The current rows are read under the
+# write lock, compared with what the form asks for, and only the rows that
+# actually differ are written, in batches.
+from datetime import date
+
+
+# Columns of the employees table written by the add and edit forms
+EMPLOYEE_COLUMNS = (
+    'full_name', 'gender', 'birth_date', 'office_id', 'designation_id', 'class_id',
+    'salary_category_id', 'joining_date', 'joining_designation_id', 'caste_id',
+    'sub_caste_id', 'caste_verified', 'caste_verification_date', 'bindu_number',
+    'department_exam_passed', 'department_exam_year', 'pranidhi_id', 'bank_name',
+    'ifsc_code', 'account_number', 'aadhar_number', 'gpf_number', 'retirement_date',
+    'previous_office_release_date', 'previous_district',
+    'previous_designation', 'current_joining_date',
+)
+
+TRANSFER_COLUMNS = ('previous_office_release_date', 'previous_district',
+                    'previous_designation', 'current_joining_date')
+
+PROMOTION_COLUMNS = ('designation', 'joining_date', 'promotion_date', 'designation_name')
+
+
+# Calculate retirement date based on birth date and class
+# For classes 1-3: 58 years from birth date
+# For class 4: 60 years from birth date
+def retirement_date_for(birth_date, class_id):
+    if not birth_date:
+        return None
+
+    class_id = str(class_id)
+    if class_id in ['1', '2', '3']:  # Classes 1-3
+        years = 58
+    elif class_id == '4':  # Class 4
+        years = 60
+    else:
+        return None
+
+    birth = date.fromisoformat(birth_date)
+    try:
+        retirement = birth.replace(year=birth.year + years)
+    except ValueError:
+        # Born on 29 February and the retirement year is not a leap year
+        retirement = birth.replace(year=birth.year + years, day=28)
+    return retirement.isoformat()
+
+
+# Compare form strings with stored values: ids arrive as '3' but are stored
+# as 3, booleans are stored as 0/1, and a blank field may be '' or NULL
+def _normalize(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        value = int(value)
+    return str(value)
+
+
+def _changed(row, values, columns):
+    return any(_normalize(row[column]) != _normalize(value)
+               for column, value in zip(columns, values))
+
+
+# Read parallel list fields (name[]) from the form as a list of tuples,
+# padding short lists with None
+def form_rows(form, names):
+    lists = [form.getlist(name) for name in names]
+    count = len(lists[0]) if lists else 0
+    return [tuple(values[i] if i < len(values) else None for values in lists)
+            for i in range(count)]
+
+
+def _update_employee(conn, employee_id, values):
+    row = conn.execute('SELECT * FROM employees WHERE id = ?', (employee_id,)).fetchone()
+    new_values = [values[column] for column in EMPLOYEE_COLUMNS]
+    if not _changed(row, new_values, EMPLOYEE_COLUMNS):
+        return 0
+
+    assignments = ', '.join('%s = ?' % column for column in EMPLOYEE_COLUMNS)
+    conn.execute('UPDATE employees SET %s WHERE id = ?' % assignments,
+                 new_values + [employee_id])
+    return 1
+
+
+def _sync_transfers(conn, employee_id, form):
+    existing = {str(row['id']): row for row in
+                conn.execute('SELECT * FROM transfer_history WHERE employee_id = ?', (employee_id,))}
+
+    updates = []
+    deletes = []
+    for transfer_id, release_date, district, designation, joining_date in form_rows(form, [
+            'existing_transfer_id[]', 'existing_transfer_release_date[]', 'existing_transfer_district[]',
+            'existing_transfer_designation[]', 'existing_transfer_joining_date[]']):
+        row = existing.get(transfer_id)
+        if row is None:
+            # Not one of this employee's rows
+            continue
+
+        if district or designation:
+            values = (release_date, district or '', designation or '', joining_date)
+            if _changed(row, values, TRANSFER_COLUMNS):
+                updates.append(values + (row['id'],))
+        else:
+            # All fields emptied: remove the record
+            deletes.append((row['id'],))
+
+    inserts = []
+    for release_date, district, designation, joining_date in form_rows(form, [
+            'transfer_release_date[]', 'transfer_district[]',
+            'transfer_designation[]', 'transfer_joining_date[]']):
+        if district or designation:
+            inserts.append((employee_id, release_date, district or '', designation or '', joining_date))
+
+    if updates:
+        conn.executemany('''UPDATE transfer_history SET
+                            previous_office_release_date = ?,
+                            previous_district = ?, previous_designation = ?, current_joining_date = ?
+                            WHERE id = ?''', updates)
+    if deletes:
+        conn.executemany('DELETE FROM transfer_history WHERE id = ?', deletes)
+    if inserts:
+        conn.executemany('''INSERT INTO transfer_history
+                            (employee_id, previous_office_release_date,
+                             previous_district, previous_designation, current_joining_date)
+                            VALUES (?, ?, ?, ?, ?)''', inserts)
+
+    return len(updates) + len(deletes) + len(inserts)
+
+
+def _sync_promotions(conn, employee_id, form, joining_designation_id, joining_date):
+    rows = conn.execute('SELECT * FROM promotion_history WHERE employee_id = ?', (employee_id,)).fetchall()
+
+    # Desired state of each existing row, starting from what is stored
+    desired = {}
+    initial = set()
+    for row in rows:
+        desired[row['id']] = tuple(row[column] for column in PROMOTION_COLUMNS)
+        # The initial joining record has joining_date == promotion_date and
+        # follows the employee's joining designation and date
+        if row['joining_date'] is not None and row['joining_date'] == row['promotion_date']:
+            initial.add(row['id'])
+            desired[row['id']] = (joining_designation_id, joining_date, joining_date, row['designation_name'])
+
+    ids = {str(row['id']): row['id'] for row in rows}
+    for promotion_id, designation_id, promotion_joining_date, promotion_date, designation_name in form_rows(form, [
+            'existing_promotion_id[]', 'existing_promotion_designation_id[]', 'existing_promotion_joining_date[]',
+            'existing_promotion_date[]', 'existing_promotion_designation_name[]']):
+        row_id = ids.get(promotion_id)
+        if row_id is None:
+            continue
+
+        if designation_id and promotion_date:
+            desired[row_id] = (designation_id, promotion_joining_date, promotion_date, designation_name or '')
+        elif row_id not in initial:
+            # Required fields emptied: remove it, but never the initial joining record
+            desired[row_id] = None
+
+    updates = []
+    deletes = []
+    for row in rows:
+        values = desired[row['id']]
+        if values is None:
+            deletes.append((row['id'],))
+        elif _changed(row, values, PROMOTION_COLUMNS):
+            updates.append(values + (row['id'],))
+
+    inserts = []
+    for designation_id, promotion_joining_date, promotion_date, designation_name in form_rows(form, [
+            'promotion_designation_id[]', 'promotion_joining_date[]',
+            'promotion_date[]', 'promotion_designation_name[]']):
+        if designation_id and promotion_date:
+            inserts.append((employee_id, designation_id, promotion_joining_date, promotion_date, designation_name or ''))
+
+    if updates:
+        conn.executemany('''UPDATE promotion_history SET
+                            designation = ?, joining_date = ?, promotion_date = ?, designation_name = ?
+                            WHERE id = ?''', updates)
+    if deletes:
+        conn.executemany('DELETE FROM promotion_history WHERE id = ?', deletes)
+    if inserts:
+        conn.executemany('''INSERT INTO promotion_history
+                            (employee_id, designation, joining_date, promotion_date, designation_name)
+                            VALUES (?, ?, ?, ?, ?)''', inserts)
+
+    return len(updates) + len(deletes) + len(inserts)
+
+
+# Save an edit form: values holds the EMPLOYEE_COLUMNS for the employee row,
+# form supplies the transfer and promotion history lists. Everything
+# commits together or not at all. Returns the number of rows written.
+def save_employee_edit(conn, employee_id, values, form):
+    if conn.in_transaction:
+        conn.commit()
+
+    # Take the write lock before reading, so the diff is against the rows
+    # that will actually be replaced
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        touched = _update_employee(conn, employee_id, values)
+        touched += _sync_transfers(conn, employee_id, form)
+        touched += _sync_promotions(conn, employee_id, form,
+                                    values['joining_designation_id'], values['joining_date'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return touched
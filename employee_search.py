@@ -0,0 +1,58 @@
+# Employee search
+#
+# Full-text search over the employee_search FTS5 table (see
+# migrations.add_employee_search), which the employees, offices and
+# designations triggers keep in step with every write. Each word of the
+# query is matched as a prefix, all words must match, and results are
+# ranked with bm25, weighting the name above office, designation and the
+# identifier numbers.
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# bm25 weights, in employee_search column order: full_name, office_name,
+# designation_name, aadhar_number, gpf_number, pranidhi_id, account_number
+WEIGHTS = (10.0, 2.0, 2.0, 5.0, 5.0, 5.0, 5.0)
+
+# Eyelash ra typed as RA + virama + ZWJ, and its RRA + virama form
+_EYELASH_RA = '\u0930\u094d\u200d'
+_EYELASH_RRA = '\u0931\u094d'
+
+# Zero-width non-joiner / joiner
+_ZERO_WIDTH = {0x200c: None, 0x200d: None}
+
+
+# Turn free text typed by a user into an FTS5 MATCH expression: every word
+# quoted (so FTS5 operators and punctuation are taken literally) and marked
+# as a prefix. Returns None when there is nothing to search for.
+def match_expression(query):
+    # Same folding as the indexed text (see migrations._search_text), and
+    # nothing more: normalising only the query (to NFC, say) would stop it
+    # matching names stored in another normalisation form
+    query = (query or '').replace(_EYELASH_RA, _EYELASH_RRA).translate(_ZERO_WIDTH)
+
+    terms = []
+    for word in query.split():
+        # Only keep words with something the tokenizer indexes
+        if not any(char.isalnum() for char in word):
+            continue
+        terms.append('"%s"*' % word.replace('"', '""'))
+
+    if not terms:
+        return None
+    return ' '.join(terms)
+
+
+SEARCH_SQL = '''SELECT rowid AS id, full_name, office_name, designation_name
+                FROM employee_search
+                WHERE employee_search MATCH ?
+                ORDER BY bm25(employee_search, %s)
+                LIMIT ?''' % ', '.join(str(weight) for weight in WEIGHTS)
+
+
+# Best matching employees for a search string, as a list of rows with id,
+# full_name, office_name and designation_name
+def search(conn, query, limit=DEFAULT_LIMIT):
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    return conn.execute(SEARCH_SQL, (expression, limit)).fetchall()
@@ -0,0 +1,357 @@
+# Federated (district) views over several office databases
+#
+# Every office runs its own employee.db. A district app is given the office
+# databases in FEDERATION_DATABASES (the EMPLOYEE_FEDERATION environment
+# variable, paths separated by os.pathsep) and serves consolidated views of
+# them without copying data: the databases are ATTACHed read-only to an
+# in-memory connection, in batches no larger than SQLite's attach limit,
+# each batch is answered by one UNION ALL query, and the batches are merged
+# here.
+#
+# Ids are local to each office database, so a shard is identified by its
+# position in FEDERATION_DATABASES and lookups are matched by name: the
+# employee list filters on office, designation, class and caste names,
+# resolved to each shard's own id inside its branch of the query. The
+# dashboard and position totals read each shard's partial aggregates (the
+# same precomputed tables the single-office pages use) and add them up.
+import base64
+import heapq
+import json
+import sqlite3
+import threading
+from itertools import islice
+from pathlib import Path
+
+from flask import current_app
+
+import db
+import employee_list
+
+DEFAULT_CONFIG = {
+    'FEDERATION_DATABASES': [],
+    'FEDERATION_ATTACH_BATCH': 10,      # capped at SQLite's attach limit
+}
+
+# Shards must have the employee_details read model (migration 12)
+MIN_SCHEMA_VERSION = 12
+
+# Name filter -> (employee_details column, lookup table, name column)
+NAME_FILTERS = {
+    'office': ('office_id', 'offices', 'office_name'),
+    'designation': ('designation_id', 'designations', 'designation_name'),
+    'class': ('class_id', 'classes', 'class_name'),
+    'caste': ('caste_id', 'castes', 'caste_name'),
+}
+
+# One branch of the employee list: a shard's first rows after the cursor.
+# {schema} is the attached shard, {shard} its index.
+EMPLOYEES_SQL = '''SELECT * FROM (SELECT {shard} AS shard, %s, {sort_key} AS sort_key
+                                  FROM {schema}.employee_details e
+                                  {where}
+                                  ORDER BY {sort_key} {direction}, e.id {direction}
+                                  LIMIT ?)''' % employee_list.LIST_COLUMNS
+
+DASHBOARD_SQL = '''SELECT {shard} AS shard,
+                          COALESCE((SELECT total_employees FROM {schema}.dashboard_stats WHERE id = 1), 0)
+                              AS total_employees,
+                          COALESCE((SELECT total_offices FROM {schema}.dashboard_stats WHERE id = 1), 0)
+                              AS total_offices,
+                          (SELECT COALESCE(SUM(retirements), 0) FROM {schema}.retirement_stats WHERE year = ?)
+                              AS retiring_this_year,
+                          (SELECT COALESCE(SUM(retirements), 0) FROM {schema}.retirement_stats WHERE year = ?)
+                              AS retiring_next_year'''
+
+OFFICE_STATS_SQL = '''SELECT {shard} AS shard, o.id, o.office_name, st.headcount, st.approved, st.vacancies,
+                             COALESCE(r0.retirements, 0) AS retiring_this_year,
+                             COALESCE(r1.retirements, 0) AS retiring_next_year
+                      FROM {schema}.office_stats st
+                      JOIN {schema}.offices o ON st.office_id = o.id
+                      LEFT JOIN {schema}.retirement_stats r0 ON r0.year = ? AND r0.office_id = st.office_id
+                      LEFT JOIN {schema}.retirement_stats r1 ON r1.year = ? AND r1.office_id = st.office_id'''
+
+OFFICE_TOTALS_SQL = '''SELECT {shard} AS shard, o.office_name,
+                              COALESCE(SUM(op.approved_count), 0) AS total_approved,
+                              COALESCE(SUM(op.filled_count), 0) AS total_filled,
+                              COALESCE(SUM(op.vacant_count), 0) AS total_vacant
+                       FROM {schema}.offices o
+                       LEFT JOIN {schema}.office_positions op ON o.id = op.office_id
+                       GROUP BY o.id, o.office_name'''
+
+DESIGNATION_TOTALS_SQL = '''SELECT {shard} AS shard, d.designation_name,
+                                   COALESCE(SUM(op.approved_count), 0) AS total_approved,
+                                   COALESCE(SUM(op.filled_count), 0) AS total_filled,
+                                   COALESCE(SUM(op.vacant_count), 0) AS total_vacant
+                            FROM {schema}.designations d
+                            LEFT JOIN {schema}.office_positions op ON d.id = op.designation_id
+                            GROUP BY d.id, d.designation_name'''
+
+# Lookup names for the filter bar
+LOOKUP_NAMES_SQL = ''' UNION ALL '''.join(
+    "SELECT '%s' AS lookup, %s AS name FROM {schema}.%s" % (name, name_column, table)
+    for name, (_, table, name_column) in NAME_FILTERS.items())
+
+_local = threading.local()
+_attach_limit = None
+
+
+class FederationError(Exception):
+    pass
+
+
+def configured(config=None):
+    return bool((config or current_app.config).get('FEDERATION_DATABASES'))
+
+
+# The configured office databases as a list of {index, name, path}; the
+# name is the file name without its extension
+def shards(config=None):
+    paths = (config or current_app.config).get('FEDERATION_DATABASES') or []
+    return [{'index': index, 'name': Path(path).stem, 'path': path} for index, path in enumerate(paths)]
+
+
+def _schema(index):
+    return 's%d' % index
+
+
+def _batch_size(config):
+    global _attach_limit
+    if _attach_limit is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            _attach_limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        except AttributeError:
+            # Python < 3.11; SQLite's compiled-in default
+            _attach_limit = 10
+        finally:
+            conn.close()
+    return max(1, min(int(config.get('FEDERATION_ATTACH_BATCH', DEFAULT_CONFIG['FEDERATION_ATTACH_BATCH'])),
+                      _attach_limit))
+
+
+# In-memory connection with one batch of shards attached read-only
+def _open(batch, config):
+    busy_timeout = config.get('DB_BUSY_TIMEOUT', db.DEFAULT_CONFIG['DB_BUSY_TIMEOUT'])
+    cache_size = config.get('DB_CACHE_SIZE', db.DEFAULT_CONFIG['DB_CACHE_SIZE'])
+    conn = sqlite3.connect(':memory:', uri=True, timeout=busy_timeout / 1000.0, factory=db.Connection)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA temp_store = MEMORY')
+    try:
+        for shard in batch:
+            schema = _schema(shard['index'])
+            uri = Path(shard['path']).resolve().as_uri() + '?mode=ro'
+            try:
+                conn.execute('ATTACH DATABASE ? AS %s' % schema, (uri,))
+                version = conn.execute('PRAGMA %s.user_version' % schema).fetchone()[0]
+            except sqlite3.Error as e:
+                raise FederationError('Cannot open office database %s: %s' % (shard['path'], e))
+            if version < MIN_SCHEMA_VERSION:
+                raise FederationError('Office database %s is at schema version %d (at least %d is needed); '
+                                      'run "flask --app app migrate" on it' % (shard['path'], version,
+                                                                               MIN_SCHEMA_VERSION))
+            conn.execute('PRAGMA %s.cache_size = %d' % (schema, int(cache_size)))
+    except FederationError:
+        conn.close()
+        raise
+    return conn
+
+
+# The shards in batches, each with its connection. Connections are kept per
+# thread, like the db.py pool, and reopened when the configuration changes.
+def _batches(config=None):
+    config = config or current_app.config
+    all_shards = shards(config)
+    size = _batch_size(config)
+
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    batches = []
+    for start in range(0, len(all_shards), size):
+        batch = all_shards[start:start + size]
+        key = tuple((shard['index'], shard['path']) for shard in batch)
+        conn = connections.get(key)
+        if conn is None:
+            conn = connections[key] = _open(batch, config)
+        batches.append((batch, conn))
+    return batches
+
+
+# Run `template` once per batch as a UNION ALL of one branch per shard,
+# with `params` repeated for every branch. Returns all rows as dicts.
+def _union(template, params=(), config=None):
+    rows = []
+    for batch, conn in _batches(config):
+        sql = ' UNION ALL '.join(template.format(shard=shard['index'], schema=_schema(shard['index']))
+                                 for shard in batch)
+        rows.extend(dict(row) for row in conn.execute(sql, list(params) * len(batch)))
+    return rows
+
+
+# Employee list filters: the name filters, plus gender and retirement year
+# as on /employees
+def parse_filters(args):
+    filters = {name: value for name, value in employee_list.parse_filters(args).items()
+               if name in ('gender', 'retirement_year')}
+    for name in NAME_FILTERS:
+        value = (args.get(name) or '').strip()
+        if value:
+            filters[name] = value
+    return filters
+
+
+def encode_cursor(key, shard, row_id):
+    raw = json.dumps([key, shard, row_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        key, shard, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        shard, row_id = int(shard), int(row_id)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if not all(employee_list.valid_cursor_value(value) for value in (key, shard, row_id)):
+        return None
+    return key, shard, row_id
+
+
+# One shard's branch of the employee list. The merged list is ordered by
+# (sort key, shard, id), so after the cursor's row a shard ahead of the
+# cursor's shard may repeat its sort key and one behind it may not.
+# `schema` defaults to the shard's attached name.
+def employees_branch(shard, filters, sort, order, after, schema=None):
+    schema = schema or _schema(shard)
+    conditions, params = employee_list.filter_clause(
+        {name: value for name, value in filters.items() if name not in NAME_FILTERS})
+    for name, (column, table, name_column) in NAME_FILTERS.items():
+        if name in filters:
+            conditions.append('e.%s = (SELECT id FROM %s.%s WHERE %s = ?)' % (column, schema, table, name_column))
+            params.append(filters[name])
+
+    sort_key = employee_list.SORT_KEYS[sort]
+    comparison = '<' if order == 'desc' else '>'
+    if after is not None:
+        key, after_shard, after_id = after
+        if shard == after_shard:
+            conditions.append('(%s, e.id) %s (?, ?)' % (sort_key, comparison))
+            params.extend([key, after_id])
+        else:
+            ahead = shard < after_shard if order == 'desc' else shard > after_shard
+            conditions.append('%s %s%s ?' % (sort_key, comparison, '=' if ahead else ''))
+            params.append(key)
+
+    sql = EMPLOYEES_SQL.format(shard=shard, schema=schema, sort_key=sort_key,
+                               where='WHERE ' + ' AND '.join(conditions) if conditions else '',
+                               direction='DESC' if order == 'desc' else 'ASC')
+    return sql, params
+
+
+# One page of the consolidated employee list. Each batch returns its first
+# page_size + 1 rows in order; the batches are merged and the page cut from
+# the front. Returns (rows, next_cursor) like employee_list.fetch_page, the
+# rows being dicts with the shard index and name added.
+def fetch_employees(filters, sort='name', order='asc', page_size=employee_list.DEFAULT_PAGE_SIZE,
+                    cursor=None, config=None):
+    after = decode_cursor(cursor)
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    names = {shard['index']: shard['name'] for shard in shards(config)}
+
+    batches = []
+    for batch, conn in _batches(config):
+        branches = []
+        params = []
+        for shard in batch:
+            sql, branch_params = employees_branch(shard['index'], filters, sort, order, after)
+            branches.append(sql)
+            params.extend(branch_params + [page_size + 1])
+        sql = ' UNION ALL '.join(branches) + ' ORDER BY sort_key %s, shard %s, id %s LIMIT ?' % (
+            direction, direction, direction)
+        batches.append([dict(row) for row in conn.execute(sql, params + [page_size + 1])])
+
+    rows = list(islice(heapq.merge(*batches, key=lambda row: (row['sort_key'], row['shard'], row['id']),
+                                   reverse=order == 'desc'),
+                       page_size + 1))
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['sort_key'], last['shard'], last['id'])
+
+    for row in rows:
+        row['shard_name'] = names[row['shard']]
+        del row['sort_key']
+    return rows, next_cursor
+
+
+# Distinct lookup names across all shards, for the filter bar
+def lookup_names(config=None):
+    names = {name: set() for name in NAME_FILTERS}
+    for row in _union(LOOKUP_NAMES_SQL, config=config):
+        names[row['lookup']].add(row['name'])
+    return {name: sorted(values) for name, values in names.items()}
+
+
+# District dashboard: the dashboard_stats.load figures summed over all
+# shards, with per-shard totals and every shard's office rows
+def dashboard(today, config=None):
+    year = today.year
+    names = {shard['index']: shard['name'] for shard in shards(config)}
+
+    shard_rows = _union(DASHBOARD_SQL, (year, year + 1), config)
+    offices = _union(OFFICE_STATS_SQL, (year, year + 1), config)
+    offices.sort(key=lambda office: (office['shard'], office['id']))
+    vacancies = {}
+    for office in offices:
+        office['shard_name'] = names[office['shard']]
+        vacancies[office['shard']] = vacancies.get(office['shard'], 0) + (office['vacancies'] or 0)
+    for row in shard_rows:
+        row['shard_name'] = names[row['shard']]
+        row['total_vacancies'] = vacancies.get(row['shard'], 0)
+    shard_rows.sort(key=lambda row: row['shard'])
+
+    return {
+        'total_employees': sum(row['total_employees'] for row in shard_rows),
+        'total_offices': sum(row['total_offices'] for row in shard_rows),
+        # The same designation in two offices is one designation
+        'total_designations': len(lookup_names(config)['designation']),
+        'total_vacancies': sum(row['total_vacancies'] for row in shard_rows),
+        'retiring_this_year': sum(row['retiring_this_year'] for row in shard_rows),
+        'retiring_next_year': sum(row['retiring_next_year'] for row in shard_rows),
+        'shards': shard_rows,
+        'offices': offices,
+    }
+
+
+# District office position totals: per office (of every shard), per
+# designation name (summed across shards) and overall
+def position_totals(config=None):
+    names = {shard['index']: shard['name'] for shard in shards(config)}
+
+    office_totals = _union(OFFICE_TOTALS_SQL, config=config)
+    for office in office_totals:
+        office['shard_name'] = names[office['shard']]
+    office_totals.sort(key=lambda office: (office['shard'], office['office_name']))
+
+    by_designation = {}
+    for row in _union(DESIGNATION_TOTALS_SQL, config=config):
+        totals = by_designation.setdefault(row['designation_name'], {
+            'designation_name': row['designation_name'], 'total_approved': 0, 'total_filled': 0, 'total_vacant': 0})
+        for column in ('total_approved', 'total_filled', 'total_vacant'):
+            totals[column] += row[column]
+
+    return {
+        'office_totals': office_totals,
+        'designation_totals': [by_designation[name] for name in sorted(by_designation)],
+        'overall_totals': {
+            'overall_approved': sum(office['total_approved'] for office in office_totals),
+            'overall_filled': sum(office['total_filled'] for office in office_totals),
+            'overall_vacant': sum(office['total_vacant'] for office in office_totals),
+        },
+    }
+
+
+def init_app(app):
+    for name, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(name, value)
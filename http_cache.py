@@ -0,0 +1,99 @@
+# Conditional GET for read-mostly pages, and in-process caching of
+# computed reports
+#
+# Every write to a versioned table bumps its counter in table_versions (by
+# trigger, see migrations.add_table_versions). A page's ETag is a hash of
+# the counters of the tables it reads, the URL and the logged in user, so
+# it changes exactly when the page could. A request whose If-None-Match
+# still matches gets 304 Not Modified without the view running.
+#
+# The counters themselves are cached on the connection and only re-read when
+# PRAGMA data_version (commits by other connections) or total_changes
+# (writes by this connection) has moved. cached_by_versions() uses the same
+# counters to keep computed reports in memory until their tables change.
+import functools
+import hashlib
+import json
+import threading
+
+from flask import make_response, request, session
+
+from db import cache_path, get_db
+
+
+def _data_version(conn):
+    return conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+# Current counter of every versioned table, as a dict
+def table_versions(conn):
+    key = (_data_version(conn), conn.total_changes)
+    cached = getattr(conn, 'table_versions', None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    versions = dict(conn.execute('SELECT name, version FROM table_versions').fetchall())
+    conn.table_versions = (key, versions)
+    return versions
+
+
+_results = {}
+_results_lock = threading.Lock()
+
+
+# Return build() for the current database and key, computing it only when
+# one of the given tables has changed since it was last built. The result is
+# shared between requests and must not be modified.
+def cached_by_versions(conn, tables, key, build):
+    versions = table_versions(conn)
+    versions = tuple(versions.get(table) for table in tables)
+    key = (cache_path(conn), tables, key)
+
+    with _results_lock:
+        cached = _results.get(key)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+
+    result = build()
+    with _results_lock:
+        # Older results for the same tables can never be used again
+        for old_key in [k for k, v in _results.items()
+                        if k[:2] == key[:2] and v[0] != versions]:
+            del _results[old_key]
+        _results[key] = (versions, result)
+    return result
+
+
+def etag_for(conn, tables):
+    versions = table_versions(conn)
+    raw = json.dumps([request.full_path, session.get('username'),
+                      [versions.get(table) for table in tables]])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+# Decorator for GET views that only read the given tables. max_age lets the
+# browser reuse the response for that many seconds without asking at all;
+# with the default of 0 it revalidates on every use.
+def conditional(*tables, max_age=0):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # A pending flash message is part of the next page rendered
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+
+            etag = etag_for(get_db(), tables)
+            cache_control = 'private, max-age=%d' % max_age if max_age else 'private, no-cache'
+
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
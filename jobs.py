@@ -0,0 +1,436 @@
+# Background jobs
+#
+# Long operations (bulk import, full exports, reports) run on a small thread
+# pool instead of inside the request. Each job is a row in the jobs table:
+# submitting inserts it as 'queued', a worker claims it ('running') with a
+# conditional UPDATE so a job never runs twice even with several web
+# processes, and it ends as 'done', 'failed' or 'cancelled'. Results are
+# written to a file under JOBS_DIR and downloaded from
+# /api/jobs/<id>/result.
+#
+# Workers report progress (rows done out of a total, when known) through
+# Job.progress, which also notices a cancel request and stops the job at
+# that point. Work already committed stays committed: an import cancelled
+# halfway keeps the batches it has inserted.
+#
+# At most JOBS_WORKERS jobs run at once per process; the rest wait in the
+# queue. The pool starts with the first jobs API call of a process, which
+# also picks up jobs still queued from before a restart and fails the ones
+# whose worker process has gone.
+#
+# An import's uploaded file is saved under JOBS_DIR by submit() and its path
+# kept in the jobs.upload_path column, never in the caller's params; files
+# are only ever removed from inside JOBS_DIR.
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+import db
+import employee_export
+import employee_import
+import employee_list
+import retirement_forecast
+import seniority
+import vacancy_projection
+
+DEFAULT_CONFIG = {
+    'JOBS_WORKERS': 2,
+    'JOBS_DIR': None,           # None = a 'jobs' directory next to the database
+    'JOBS_KEEP_DAYS': 7,
+}
+
+# Seconds between progress writes (and cancel checks) of a running job
+PROGRESS_INTERVAL = 0.5
+
+LIST_LIMIT = 50
+
+log = logging.getLogger('employee.jobs')
+
+_lock = threading.Lock()
+_executors = {}         # database path -> ThreadPoolExecutor
+_tokens = {}            # pid -> token of the process that has it now
+
+# kind -> (runner, content type, file extension)
+_kinds = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobError(ValueError):
+    pass
+
+
+# Params only submit() may set
+RESERVED_PARAMS = ('upload', 'filename')
+
+
+def job_kind(name, content_type='application/json; charset=utf-8', extension='json'):
+    def register(runner):
+        _kinds[name] = (runner, content_type, extension)
+        return runner
+    return register
+
+
+def kinds():
+    return sorted(_kinds)
+
+
+# Random token for this process, stored next to worker_pid: after a restart
+# the new process may be given the same pid (always, for pid 1 in a
+# container), and only the token tells it from the one that ran the job
+def _process_token():
+    pid = os.getpid()
+    with _lock:
+        return _tokens.setdefault(pid, uuid.uuid4().hex)
+
+
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def jobs_dir(config=None):
+    if config is None:
+        config = current_app.config
+    path = config.get('JOBS_DIR')
+    if not path:
+        database = os.path.abspath(config.get('DATABASE', db.DEFAULT_DATABASE))
+        path = os.path.join(os.path.dirname(database), 'jobs')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Handle passed to a running job's function
+class Job:
+    def __init__(self, conn, row):
+        self._conn = conn
+        self.id = row['id']
+        self.params = json.loads(row['params'])
+        self.upload_path = row['upload_path']
+        self.result_path = row['result_path']
+        self._last_write = 0.0
+
+    # Record progress; raises JobCancelled once the job has been cancelled.
+    # Writes are throttled to one per PROGRESS_INTERVAL unless forced.
+    def progress(self, done, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+
+        self._conn.execute('''UPDATE jobs SET progress_done = ?, progress_total = COALESCE(?, progress_total)
+                              WHERE id = ?''', (done, total, self.id))
+        row = self._conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (self.id,)).fetchone()
+        if row[0]:
+            raise JobCancelled()
+
+
+def _state_connection(config):
+    # Job bookkeeping is kept off the connection the job works on, so a
+    # progress write never has to wait for (or commit) the job's transaction
+    conn = db.connect(config['DATABASE'], config)
+    conn.isolation_level = None
+    return conn
+
+
+# Delete a job's file; anything outside the jobs directory is left alone
+def _remove(path, config=None):
+    if not path:
+        return
+    directory = os.path.realpath(jobs_dir(config))
+    if os.path.dirname(os.path.realpath(path)) != directory:
+        log.warning('Not removing %s: outside %s', path, directory)
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _run(app, job_id):
+    config = app.config
+    state = _state_connection(config)
+    try:
+        claimed = state.execute('''UPDATE jobs SET status = 'running', started_at = ?, worker_pid = ?,
+                                       worker_token = ?
+                                   WHERE id = ? AND status = 'queued' ''',
+                                (_now(), os.getpid(), _process_token(), job_id)).rowcount
+        if not claimed:
+            return
+
+        row = state.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        job = Job(state, row)
+        try:
+            runner = _kinds[row['kind']][0]
+            with app.app_context():
+                summary = runner(db.get_db(), job)
+        except JobCancelled:
+            _remove(job.result_path, config)
+            state.execute('''UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?''',
+                          (_now(), job_id))
+        except Exception as e:
+            log.exception('Job %d (%s) failed', job_id, row['kind'])
+            _remove(job.result_path, config)
+            state.execute('''UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?''',
+                          (str(e) or e.__class__.__name__, _now(), job_id))
+        else:
+            state.execute('''UPDATE jobs SET status = 'done', summary = ?, finished_at = ?,
+                                 progress_done = COALESCE(progress_total, progress_done)
+                             WHERE id = ?''',
+                          (json.dumps(summary, ensure_ascii=False), _now(), job_id))
+        finally:
+            _remove(job.upload_path, config)
+    finally:
+        state.close()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+# Whether the process that claimed a running job is still there
+def _worker_alive(row):
+    if row['worker_pid'] is None:
+        return False
+    if row['worker_pid'] == os.getpid():
+        return row['worker_token'] == _process_token()
+    return _pid_alive(row['worker_pid'])
+
+
+# Fail jobs whose worker process has gone and queue the ones still waiting
+def _recover(app, executor, conn):
+    for row in conn.execute("SELECT id, worker_pid, worker_token FROM jobs WHERE status = 'running'").fetchall():
+        if not _worker_alive(row):
+            conn.execute('''UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart', finished_at = ?
+                            WHERE id = ? AND status = 'running' ''', (_now(), row['id']))
+    conn.commit()
+
+    for row in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id").fetchall():
+        executor.submit(_run, app, row['id'])
+
+
+# This process's pool for the current app's database, started on first use
+def _executor(conn):
+    app = current_app._get_current_object()
+    path = app.config['DATABASE']
+    with _lock:
+        executor = _executors.get(path)
+        if executor is not None:
+            return executor
+        executor = _executors[path] = ThreadPoolExecutor(max_workers=app.config['JOBS_WORKERS'],
+                                                         thread_name_prefix='job')
+    _recover(app, executor, conn)
+    return executor
+
+
+# Start this process's workers (and recover queued jobs) if not yet running
+def start(conn):
+    _executor(conn)
+
+
+# Queue a job. upload is an optional uploaded file (werkzeug FileStorage)
+# saved for the job to read, e.g. the bulk import file. Returns the job id.
+def submit(conn, kind, params, user=None, upload=None, upload_name=None):
+    if kind not in _kinds:
+        raise JobError('Unknown job kind: %s (use one of %s)' % (kind, ', '.join(kinds())))
+    params = dict(params or {})
+    reserved = [name for name in RESERVED_PARAMS if name in params]
+    if reserved:
+        raise JobError('params may not set %s' % ', '.join(reserved))
+    directory = jobs_dir()
+
+    upload_path = None
+    if upload is not None:
+        extension = os.path.splitext(upload_name or '')[1].lower()
+        upload_path = os.path.join(directory, 'upload-%s%s' % (uuid.uuid4().hex, extension))
+        params['filename'] = upload_name
+        upload.save(upload_path)
+
+    extension = _kinds[kind][2]
+    if callable(extension):
+        extension = extension(params)
+    result_path = os.path.join(directory, 'result-%s.%s' % (uuid.uuid4().hex, extension))
+
+    job_id = conn.execute('''INSERT INTO jobs (kind, params, submitted_by, upload_path, result_path)
+                             VALUES (?, ?, ?, ?, ?)''',
+                          (kind, json.dumps(params, ensure_ascii=False), user, upload_path,
+                           result_path)).lastrowid
+    conn.commit()
+
+    _executor(conn).submit(_run, current_app._get_current_object(), job_id)
+    return job_id
+
+
+# Cancel a queued or running job. Returns False if it had already finished
+# (or does not exist).
+def cancel(conn, job_id):
+    cancelled = conn.execute('''UPDATE jobs SET status = 'cancelled', finished_at = ?
+                                WHERE id = ? AND status = 'queued' ''', (_now(), job_id)).rowcount
+    if cancelled:
+        conn.commit()
+        # It will never run, so nothing else removes its upload
+        _remove(get(conn, job_id)['upload_path'])
+        return True
+
+    cancelled = conn.execute('''UPDATE jobs SET cancel_requested = 1
+                                WHERE id = ? AND status = 'running' ''', (job_id,)).rowcount
+    conn.commit()
+    return bool(cancelled)
+
+
+def get(conn, job_id):
+    return conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def recent(conn, limit=LIST_LIMIT):
+    return conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+
+
+# Content type and download file name of a finished job's result
+def result_file(row):
+    content_type = _kinds[row['kind']][1]
+    if callable(content_type):
+        content_type = content_type(json.loads(row['params']))
+    return content_type, '%s-%d%s' % (row['kind'], row['id'], os.path.splitext(row['result_path'])[1])
+
+
+# Public view of a job row, for the API
+def to_dict(row):
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'params': json.loads(row['params']),
+        'status': row['status'],
+        'submitted_by': row['submitted_by'],
+        'progress': {'done': row['progress_done'], 'total': row['progress_total']},
+        'cancel_requested': bool(row['cancel_requested']),
+        'summary': json.loads(row['summary']) if row['summary'] else None,
+        'error': row['error'],
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+    }
+
+
+# Delete finished jobs created more than `days` days ago, and their files.
+# Returns the number of jobs removed.
+def prune(conn, days):
+    cutoff = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - days * 86400))
+    rows = conn.execute('''SELECT id, upload_path, result_path FROM jobs
+                           WHERE status IN ('done', 'failed', 'cancelled') AND created_at < ?''',
+                        (cutoff,)).fetchall()
+    for row in rows:
+        _remove(row['result_path'])
+        _remove(row['upload_path'])
+    conn.executemany('DELETE FROM jobs WHERE id = ?', [(row['id'],) for row in rows])
+    conn.commit()
+    return len(rows)
+
+
+def _write_json(path, value):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False)
+
+
+# Job kinds
+
+@job_kind('import')
+def run_import(conn, job):
+    with open(job.upload_path, 'rb') as f:
+        records = employee_import.read_file(f, job.params.get('filename') or job.upload_path)
+        report = employee_import.import_employees(conn, records, progress=job.progress)
+    _write_json(job.result_path, report)
+    return {'rows': report['rows'], 'inserted': report['inserted'], 'errors': len(report['errors'])}
+
+
+def _export_format(params):
+    return params.get('format') if params.get('format') in employee_export.FORMATS else 'csv'
+
+
+@job_kind('export', lambda params: employee_export.FORMATS[_export_format(params)], _export_format)
+def run_export(conn, job):
+    fmt = _export_format(job.params)
+    filters = employee_list.parse_filters(job.params.get('filters') or {})
+    sort, order = employee_list.parse_sort(job.params)
+
+    conditions, params = employee_list.filter_clause(filters)
+    total = conn.execute('SELECT COUNT(*) FROM employees e' +
+                         (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params).fetchone()[0]
+    job.progress(0, total, force=True)
+
+    done = 0
+    with open(job.result_path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in employee_export.generate(conn, fmt, filters, sort, order):
+            f.write(chunk)
+            done = min(total, done + employee_export.FETCH_SIZE)
+            job.progress(done, total)
+    return {'rows': total, 'format': fmt}
+
+
+def _optional_int(params, name):
+    try:
+        return int(params[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _int_param(params, name, default, low, high):
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    return max(low, min(value, high))
+
+
+@job_kind('retirement_forecast')
+def run_retirement_forecast(conn, job):
+    job.progress(0, 1, force=True)
+    years = _int_param(job.params, 'years', retirement_forecast.DEFAULT_YEARS, 1, retirement_forecast.MAX_YEARS)
+    forecast = retirement_forecast.get_forecast(conn, years)
+    _write_json(job.result_path, forecast)
+    return {'years': years, 'total': forecast['total']}
+
+
+@job_kind('vacancy_projection')
+def run_vacancy_projection(conn, job):
+    job.progress(0, 1, force=True)
+    months = _int_param(job.params, 'months', vacancy_projection.DEFAULT_MONTHS, 1, vacancy_projection.MAX_MONTHS)
+    projection = vacancy_projection.get_projection(conn, months)
+    _write_json(job.result_path, projection)
+    return {'months': months}
+
+
+def _seniority_format(params):
+    return 'csv' if params.get('format') == 'csv' else 'json'
+
+
+@job_kind('seniority', lambda params: ('text/csv; charset=utf-8' if _seniority_format(params) == 'csv'
+                                       else 'application/json; charset=utf-8'), _seniority_format)
+def run_seniority(conn, job):
+    job.progress(0, 1, force=True)
+    lists = seniority.get_seniority(conn, _optional_int(job.params, 'designation_id'),
+                                    _optional_int(job.params, 'class_id'))
+    if _seniority_format(job.params) == 'csv':
+        with open(job.result_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(seniority.to_csv(lists))
+    else:
+        _write_json(job.result_path, lists)
+    return {'total': lists['total']}
+
+
+def init_app(app):
+    for name, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(name, value)
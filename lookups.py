@@ -0,0 +1,95 @@
+# Lookup table cache
+#
+# Offices, designations, classes, salary categories, castes and sub-castes
+# change perhaps once a month but every form page needs all of them. They
+# are loaded together once per process and served from memory until:
+#
+#   * a settings write handler in this process calls invalidate(), or
+#   * the table_versions counters of the lookup tables (bumped by triggers,
+#     see migrations.add_table_versions) no longer match the ones stored
+#     with the cached copy.
+#
+# The counters are only read when PRAGMA data_version shows that another
+# connection has committed since this connection last checked; data_version
+# is per connection, so each connection remembers the value it last saw.
+# Employee saves and job progress writes move data_version but not the
+# counters, so they cost one small query and no reload. The cache is kept
+# per database, so lookups read from a report snapshot (see report_db.py)
+# never stand in for the live ones.
+import threading
+
+from flask import current_app
+
+from db import cache_path, get_db
+from http_cache import table_versions
+
+TABLES = {
+    'offices': 'SELECT * FROM offices ORDER BY id',
+    'designations': 'SELECT * FROM designations ORDER BY id',
+    'classes': 'SELECT * FROM classes ORDER BY id',
+    'salary_categories': 'SELECT * FROM salary_categories ORDER BY id',
+    'castes': 'SELECT * FROM castes ORDER BY id',
+    'sub_castes': '''SELECT s.*, c.caste_name FROM sub_castes s
+                     LEFT JOIN castes c ON s.caste_id = c.id
+                     ORDER BY s.id''',
+}
+
+_cache = {}             # database path -> (lookup table counters, lookups)
+_lock = threading.Lock()
+
+
+def _data_version(conn):
+    return conn.execute('PRAGMA data_version').fetchone()[0]
+
+
+def _load(conn):
+    lookups = {}
+    for name, sql in TABLES.items():
+        lookups[name] = conn.execute(sql).fetchall()
+
+    by_caste = {}
+    for sub_caste in lookups['sub_castes']:
+        by_caste.setdefault(sub_caste['caste_id'], []).append(sub_caste)
+    lookups['sub_castes_by_caste'] = by_caste
+
+    # Name -> id maps, for resolving names in imported data
+    lookups['office_ids'] = {row['office_name']: row['id'] for row in lookups['offices']}
+    lookups['designation_ids'] = {row['designation_name']: row['id'] for row in lookups['designations']}
+    lookups['class_ids'] = {row['class_name']: row['id'] for row in lookups['classes']}
+    lookups['salary_category_ids'] = {row['category_name']: row['id'] for row in lookups['salary_categories']}
+    lookups['caste_ids'] = {row['caste_name']: row['id'] for row in lookups['castes']}
+    lookups['sub_caste_ids'] = {(row['caste_id'], row['sub_caste_name']): row['id']
+                                for row in lookups['sub_castes']}
+    return lookups
+
+
+# All lookup tables for the current database, as a dict of row lists.
+# The result is shared between requests and must not be modified.
+def get_lookups(conn=None):
+    if conn is None:
+        conn = get_db()
+    path = cache_path(conn)
+
+    version = _data_version(conn)
+    with _lock:
+        cached = _cache.get(path)
+    if cached is not None and getattr(conn, 'lookup_data_version', None) == version:
+        return cached[1]
+
+    versions = table_versions(conn)
+    counters = tuple(versions.get(table) for table in TABLES)
+    if cached is None or cached[0] != counters:
+        # Read after the counters, so the rows are never older than them
+        cached = (counters, _load(conn))
+        with _lock:
+            _cache[path] = cached
+    conn.lookup_data_version = version
+    return cached[1]
+
+
+# Drop the cached lookups; call after committing a change to a lookup table
+def invalidate(path=None):
+    if path is None:
+        path = current_app.config['DATABASE']
+    with _lock:
+        _cache.pop(path, None)
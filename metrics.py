@@ -0,0 +1,272 @@
+# Request and SQL instrumentation, exposed for Prometheus on /metrics
+#
+# When METRICS_ENABLED is set (the default), connections are opened with
+# InstrumentedConnection, which counts every statement, the time spent in
+# it, the rows fetched and each commit against the endpoint serving the
+# request. Statements slower than SLOW_QUERY_MS are logged to the
+# 'employee.slow_query' logger with the statement and the types of the
+# bound parameters (never their values: they include Aadhar and account
+# numbers). Request latency goes into a histogram per endpoint.
+#
+# With METRICS_ENABLED off nothing is installed: connections are the plain
+# db.Connection class and no request hooks run, so there is no cost at all.
+#
+# Figures are per process; with several worker processes each one is
+# scraped separately.
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from flask import Response, g, request
+
+import db
+
+DEFAULT_CONFIG = {
+    'METRICS_ENABLED': True,
+    'SLOW_QUERY_MS': 100,
+}
+
+# Request latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+slow_query_log = logging.getLogger('employee.slow_query')
+
+_lock = threading.Lock()
+_requests = {}      # (endpoint, method, status) -> count
+_latency = {}       # endpoint -> [count per bucket..., count over the last bucket, sum]
+_sql = {}           # endpoint -> SqlStats
+
+
+class SqlStats:
+    __slots__ = ('queries', 'seconds', 'rows', 'commits', 'slow')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.commits = 0
+        self.slow = 0
+
+    def add(self, other):
+        self.queries += other.queries
+        self.seconds += other.seconds
+        self.rows += other.rows
+        self.commits += other.commits
+        self.slow += other.slow
+
+
+_whitespace = re.compile(r'\s+')
+
+
+# Types of the bound parameters, e.g. '(int, str, NoneType)'
+def parameter_shape(params):
+    if not params:
+        return '()'
+    if isinstance(params, dict):
+        return '{%s}' % ', '.join('%s: %s' % (key, type(value).__name__) for key, value in params.items())
+    return '(%s)' % ', '.join(type(value).__name__ for value in params)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def _timed(self, method, sql, params, shape):
+        stats = self.connection.sql_stats
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            elapsed = time.perf_counter() - started
+            if stats is not None:
+                stats.queries += 1
+                stats.seconds += elapsed
+            if elapsed * 1000 >= self.connection.slow_query_ms:
+                if stats is not None:
+                    stats.slow += 1
+                slow_query_log.warning('%.1f ms %s %s %s', elapsed * 1000,
+                                       self.connection.endpoint or '-',
+                                       _whitespace.sub(' ', sql).strip(), shape())
+
+    def execute(self, sql, params=()):
+        return self._timed(super().execute, sql, params, lambda: parameter_shape(params))
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        return self._timed(super().executemany, sql, seq_of_params, lambda: '%d x %s' % (
+            len(seq_of_params), parameter_shape(seq_of_params[0] if seq_of_params else ())))
+
+    def _fetched(self, rows, count):
+        stats = self.connection.sql_stats
+        if stats is not None:
+            stats.rows += count
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        return self._fetched(row, row is not None)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return self._fetched(rows, len(rows))
+
+    def fetchall(self):
+        rows = super().fetchall()
+        return self._fetched(rows, len(rows))
+
+    def __next__(self):
+        return self._fetched(super().__next__(), 1)
+
+
+class InstrumentedConnection(db.Connection):
+    # Set per request by the hooks below; None outside a request
+    sql_stats = None
+    endpoint = None
+    slow_query_ms = DEFAULT_CONFIG['SLOW_QUERY_MS']
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute does not go through cursor(), so route it there
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        if self.sql_stats is not None:
+            self.sql_stats.commits += 1
+        return super().commit()
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.sql_stats = SqlStats()
+
+
+# Point the request's pooled connection at the request's counters; called by
+# db.get_db through the DB_ON_ACQUIRE hook
+def _attach(conn):
+    stats = g.get('sql_stats')
+    if stats is not None and isinstance(conn, InstrumentedConnection):
+        conn.sql_stats = stats
+        conn.endpoint = request.endpoint if request else None
+
+
+def _detach(conn):
+    if isinstance(conn, InstrumentedConnection):
+        conn.sql_stats = None
+        conn.endpoint = None
+
+
+def _record_response(response):
+    started = g.pop('metrics_started', None)
+    stats = g.pop('sql_stats', None)
+    if started is None:
+        return response
+
+    endpoint = request.endpoint or 'unknown'
+    if response.is_streamed:
+        # A streamed body (the exports) runs its SQL while it is being sent,
+        # so it is recorded once the body has been sent in full
+        method = request.method
+        response.call_on_close(lambda: _record(endpoint, method, response.status_code, started, stats))
+    else:
+        _record(endpoint, request.method, response.status_code, started, stats)
+    return response
+
+
+def _record(endpoint, method, status_code, started, stats):
+    elapsed = time.perf_counter() - started
+    with _lock:
+        key = (endpoint, method, status_code)
+        _requests[key] = _requests.get(key, 0) + 1
+
+        histogram = _latency.get(endpoint)
+        if histogram is None:
+            histogram = _latency[endpoint] = [0] * (len(BUCKETS) + 2)
+        for index, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                histogram[index] += 1
+                break
+        else:
+            histogram[len(BUCKETS)] += 1
+        histogram[-1] += elapsed
+
+        if stats is not None:
+            totals = _sql.get(endpoint)
+            if totals is None:
+                totals = _sql[endpoint] = SqlStats()
+            totals.add(stats)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Everything recorded so far, in the Prometheus text exposition format
+def render():
+    with _lock:
+        requests = sorted(_requests.items())
+        latency = sorted((endpoint, list(histogram)) for endpoint, histogram in _latency.items())
+        sql = sorted(_sql.items())
+
+    lines = ['# HELP http_requests_total Requests served, by endpoint, method and status.',
+             '# TYPE http_requests_total counter']
+    for (endpoint, method, status), count in requests:
+        lines.append('http_requests_total{endpoint="%s",method="%s",status="%d"} %d' % (
+            _label(endpoint), method, status, count))
+
+    lines += ['# HELP http_request_duration_seconds Request latency by endpoint.',
+              '# TYPE http_request_duration_seconds histogram']
+    for endpoint, histogram in latency:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram):
+            cumulative += count
+            lines.append('http_request_duration_seconds_bucket{endpoint="%s",le="%g"} %d' % (
+                _label(endpoint), bound, cumulative))
+        cumulative += histogram[len(BUCKETS)]
+        lines.append('http_request_duration_seconds_bucket{endpoint="%s",le="+Inf"} %d' % (_label(endpoint), cumulative))
+        lines.append('http_request_duration_seconds_sum{endpoint="%s"} %.6f' % (_label(endpoint), histogram[-1]))
+        lines.append('http_request_duration_seconds_count{endpoint="%s"} %d' % (_label(endpoint), cumulative))
+
+    for name, kind, help_text, value in (
+            ('db_queries_total', 'counter', 'SQL statements executed.', lambda s: '%d' % s.queries),
+            ('db_query_duration_seconds_total', 'counter', 'Time spent executing SQL statements.',
+             lambda s: '%.6f' % s.seconds),
+            ('db_rows_returned_total', 'counter', 'Rows fetched from SQL statements.', lambda s: '%d' % s.rows),
+            ('db_commits_total', 'counter', 'Transactions committed.', lambda s: '%d' % s.commits),
+            ('db_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_MS.', lambda s: '%d' % s.slow)):
+        lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind)]
+        for endpoint, stats in sql:
+            lines.append('%s{endpoint="%s"} %s' % (name, _label(endpoint), value(stats)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Forget everything recorded so far
+def reset():
+    with _lock:
+        _requests.clear()
+        _latency.clear()
+        _sql.clear()
+
+
+def init_app(app):
+    for name, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(name, value)
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    InstrumentedConnection.slow_query_ms = app.config['SLOW_QUERY_MS']
+    app.config['DB_CONNECTION_CLASS'] = InstrumentedConnection
+    app.config['DB_ON_ACQUIRE'] = _attach
+    app.config['DB_ON_RELEASE'] = _detach
+
+    app.before_request(_start_request)
+    app.after_request(_record_response)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
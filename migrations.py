@@ -0,0 +1,806 @@
+# Schema migrations
+#
+# The schema version is kept in SQLite's PRAGMA user_version. Each entry in
+# MIGRATIONS is applied exactly once, in order, inside its own transaction,
+# and bumps user_version when it commits. When a database is already
+# current, migrate() costs a single pragma read.
+#
+# To change the schema, append a new migration function to MIGRATIONS --
+# never edit one that has already shipped.
+import threading
+
+from flask import current_app
+
+import db
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute('PRAGMA table_info(%s)' % table)}
+
+
+def _add_column(conn, table, column, definition):
+    if column not in _columns(conn, table):
+        conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, definition))
+
+
+def _seed(conn, table, column, values):
+    # Only seed lookup tables that are still empty
+    if conn.execute('SELECT 1 FROM %s LIMIT 1' % table).fetchone():
+        return
+    conn.executemany('INSERT INTO %s (%s) VALUES (?)' % (table, column),
+                     [(value,) for value in values])
+
+
+# 1: base schema and default lookup data
+def create_base_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS offices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        office_name TEXT UNIQUE NOT NULL
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS designations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        designation_name TEXT UNIQUE NOT NULL
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS classes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        class_name TEXT UNIQUE NOT NULL
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS salary_categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category_name TEXT UNIQUE NOT NULL
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS castes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        caste_name TEXT UNIQUE NOT NULL
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS sub_castes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        caste_id INTEGER,
+        sub_caste_name TEXT NOT NULL,
+        FOREIGN KEY (caste_id) REFERENCES castes(id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS employees (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        full_name TEXT NOT NULL,
+        gender TEXT NOT NULL,
+        birth_date DATE NOT NULL,
+        office_id INTEGER,
+        designation_id INTEGER,
+        class_id INTEGER,
+        salary_category_id INTEGER,
+        joining_date DATE,
+        joining_designation_id INTEGER,
+        caste_id INTEGER,
+        sub_caste_id INTEGER,
+        caste_verified BOOLEAN DEFAULT FALSE,
+        caste_verification_date DATE,
+        bindu_number TEXT,
+        department_exam_passed BOOLEAN DEFAULT FALSE,
+        department_exam_year INTEGER,
+        pranidhi_id TEXT,
+        bank_name TEXT,
+        ifsc_code TEXT,
+        account_number TEXT,
+        aadhar_number TEXT,
+        gpf_number TEXT,
+        retirement_date DATE,
+        /* Transfer history fields */
+        previous_office_release_date DATE,
+        previous_district TEXT,
+        previous_designation TEXT,
+        current_joining_date DATE,
+        FOREIGN KEY (office_id) REFERENCES offices(id),
+        FOREIGN KEY (designation_id) REFERENCES designations(id),
+        FOREIGN KEY (class_id) REFERENCES classes(id),
+        FOREIGN KEY (salary_category_id) REFERENCES salary_categories(id),
+        FOREIGN KEY (joining_designation_id) REFERENCES designations(id),
+        FOREIGN KEY (caste_id) REFERENCES castes(id),
+        FOREIGN KEY (sub_caste_id) REFERENCES sub_castes(id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS office_positions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        office_id INTEGER,
+        designation_id INTEGER,
+        approved_count INTEGER DEFAULT 0,
+        filled_count INTEGER DEFAULT 0,
+        vacant_count INTEGER DEFAULT 0,
+        FOREIGN KEY (office_id) REFERENCES offices(id),
+        FOREIGN KEY (designation_id) REFERENCES designations(id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS office_profile (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        office_name TEXT,
+        office_address TEXT,
+        email TEXT,
+        phone TEXT,
+        officer_name TEXT,
+        designation TEXT,
+        district_name TEXT,
+        senior_clerk_names TEXT,
+        junior_clerk_names TEXT
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS transfer_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id INTEGER,
+        previous_office_release_date DATE,
+        previous_district TEXT,
+        previous_designation TEXT,
+        current_joining_date DATE,
+        FOREIGN KEY (employee_id) REFERENCES employees(id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS promotion_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        employee_id INTEGER,
+        designation TEXT,
+        joining_date DATE,
+        promotion_date DATE,
+        designation_name TEXT,
+        FOREIGN KEY (employee_id) REFERENCES employees(id)
+    )''')
+
+    # Default data
+    _seed(conn, 'offices', 'office_name', ['मुख्यालय', 'उपकार्यालय 1', 'उपकार्यालय 2'])
+    _seed(conn, 'designations', 'designation_name', ['जेसी', 'एनक्लेव', 'लेक्टर'])
+    _seed(conn, 'classes', 'class_name', ['क्लास 1', 'क्लास 2', 'क्लास 3', 'क्लास 4'])
+    _seed(conn, 'salary_categories', 'category_name', ['श्रेणी A', 'श्रेणी B', 'श्रेणी C'])
+    _seed(conn, 'castes', 'caste_name', ['हिंदु', 'मुस्लिम', 'इतर'])
+
+    if not conn.execute('SELECT 1 FROM sub_castes LIMIT 1').fetchone():
+        conn.executemany("INSERT INTO sub_castes (caste_id, sub_caste_name) VALUES (?, ?)",
+                         [(1, 'मागासवर्ग'), (1, 'अन्य मागासवर्ग'), (3, 'इतर')])
+
+    if not conn.execute('SELECT 1 FROM office_profile LIMIT 1').fetchone():
+        conn.execute("""INSERT INTO office_profile
+                        (office_name, office_address, email, phone, officer_name, designation, district_name, senior_clerk_names, junior_clerk_names)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     ("मुख्यालय", "", "", "", "", "", "", "", ""))
+
+
+# 2: columns that databases created by earlier releases are missing
+def add_history_columns(conn):
+    _add_column(conn, 'employees', 'previous_office_release_date', 'DATE')
+    _add_column(conn, 'employees', 'previous_district', 'TEXT')
+    _add_column(conn, 'employees', 'previous_designation', 'TEXT')
+    _add_column(conn, 'employees', 'current_joining_date', 'DATE')
+    _add_column(conn, 'transfer_history', 'previous_office_release_date', 'DATE')
+    _add_column(conn, 'transfer_history', 'previous_district', 'TEXT')
+    _add_column(conn, 'transfer_history', 'previous_designation', 'TEXT')
+    _add_column(conn, 'transfer_history', 'current_joining_date', 'DATE')
+    _add_column(conn, 'promotion_history', 'designation_name', 'TEXT')
+
+
+# 3: indexes for the hot lookups, and one position row per office/designation
+def add_lookup_indexes(conn):
+    # Keep the newest row for any duplicated office/designation pair before
+    # the unique index goes on
+    conn.execute('''DELETE FROM office_positions
+                    WHERE id NOT IN (SELECT MAX(id) FROM office_positions
+                                     GROUP BY office_id, designation_id)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_office_positions_office_designation
+                    ON office_positions (office_id, designation_id)''')
+
+    # Position counts and the office delete check
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_office_designation ON employees (office_id, designation_id)')
+    # Designation delete check (designation_id = ? OR joining_designation_id = ?)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_designation ON employees (designation_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_joining_designation ON employees (joining_designation_id)')
+    # Remaining settings delete checks and list filters
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_class ON employees (class_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_salary_category ON employees (salary_category_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_caste ON employees (caste_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_sub_caste ON employees (sub_caste_id)')
+    # Employee list sort orders and the retirement year filter
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_full_name ON employees (full_name, id)')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_employees_joining_date ON employees (COALESCE(joining_date, ''), id)")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employees_retirement_date ON employees (retirement_date)')
+
+    # History lookups per employee
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transfer_history_employee ON transfer_history (employee_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_promotion_history_employee ON promotion_history (employee_id)')
+
+    # /get_sub_castes: covering index, the query never touches the table
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sub_castes_caste ON sub_castes (caste_id, sub_caste_name)')
+
+
+# 4: keep office_positions filled/vacant counts current with triggers.
+# Each employee insert, delete or office/designation change adjusts the
+# affected position rows by one inside the same statement, so the counts
+# commit (or roll back) together with the employee write.
+def add_position_count_triggers(conn):
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_position_insert
+                    AFTER INSERT ON employees
+                    BEGIN
+                        UPDATE office_positions
+                        SET filled_count = filled_count + 1, vacant_count = vacant_count - 1
+                        WHERE office_id = NEW.office_id AND designation_id = NEW.designation_id;
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_position_update
+                    AFTER UPDATE OF office_id, designation_id ON employees
+                    WHEN OLD.office_id IS NOT NEW.office_id OR OLD.designation_id IS NOT NEW.designation_id
+                    BEGIN
+                        UPDATE office_positions
+                        SET filled_count = filled_count - 1, vacant_count = vacant_count + 1
+                        WHERE office_id = OLD.office_id AND designation_id = OLD.designation_id;
+                        UPDATE office_positions
+                        SET filled_count = filled_count + 1, vacant_count = vacant_count - 1
+                        WHERE office_id = NEW.office_id AND designation_id = NEW.designation_id;
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_position_delete
+                    AFTER DELETE ON employees
+                    BEGIN
+                        UPDATE office_positions
+                        SET filled_count = filled_count - 1, vacant_count = vacant_count + 1
+                        WHERE office_id = OLD.office_id AND designation_id = OLD.designation_id;
+                    END''')
+
+    # Start from exact counts
+    conn.execute('''UPDATE office_positions
+                    SET approved_count = COALESCE(approved_count, 0),
+                        filled_count = (SELECT COUNT(*) FROM employees e
+                                        WHERE e.office_id = office_positions.office_id
+                                        AND e.designation_id = office_positions.designation_id)''')
+    conn.execute('UPDATE office_positions SET vacant_count = approved_count - filled_count')
+
+
+# Fold the two spellings of the Marathi eyelash ra (RA + virama + ZWJ and
+# RRA + virama) together and strip the remaining zero-width joiners and
+# non-joiners, so a name matches however it was typed.
+# employee_search.match_expression does the same to queries.
+def _search_text(expr):
+    return ("replace(replace(replace(%s, char(2352, 2381, 8205), char(2353, 2381)), "
+            "char(8204), ''), char(8205), '')" % expr)
+
+
+# 5: full-text search index over employees (see employee_search.py)
+def add_employee_search(conn):
+    # unicode61 keeps Devanagari vowel signs and viramas inside tokens;
+    # remove_diacritics would only fold Latin accents, so it is off. The
+    # prefix indexes make short 'राम*' style prefix queries cheap.
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS employee_search USING fts5(
+                        full_name, office_name, designation_name,
+                        aadhar_number, gpf_number, pranidhi_id, account_number,
+                        tokenize = 'unicode61 remove_diacritics 0',
+                        prefix = '1 2 3'
+                    )''')
+
+    # rowid is the employee id
+    row_values = '''%s,
+                   (SELECT %s FROM offices WHERE id = NEW.office_id),
+                   (SELECT %s FROM designations WHERE id = NEW.designation_id),
+                   NEW.aadhar_number, NEW.gpf_number, NEW.pranidhi_id, NEW.account_number''' % (
+        _search_text('NEW.full_name'), _search_text('office_name'), _search_text('designation_name'))
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_search_insert
+                    AFTER INSERT ON employees
+                    BEGIN
+                        INSERT INTO employee_search (rowid, full_name, office_name, designation_name,
+                                                     aadhar_number, gpf_number, pranidhi_id, account_number)
+                        VALUES (NEW.id, %s);
+                    END''' % row_values)
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_search_update
+                    AFTER UPDATE OF full_name, office_id, designation_id,
+                                    aadhar_number, gpf_number, pranidhi_id, account_number ON employees
+                    BEGIN
+                        DELETE FROM employee_search WHERE rowid = OLD.id;
+                        INSERT INTO employee_search (rowid, full_name, office_name, designation_name,
+                                                     aadhar_number, gpf_number, pranidhi_id, account_number)
+                        VALUES (NEW.id, %s);
+                    END''' % row_values)
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_search_delete
+                    AFTER DELETE ON employees
+                    BEGIN
+                        DELETE FROM employee_search WHERE rowid = OLD.id;
+                    END''')
+
+    # Renaming an office or designation re-indexes its employees
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_offices_search_rename
+                    AFTER UPDATE OF office_name ON offices
+                    BEGIN
+                        UPDATE employee_search SET office_name = %s
+                        WHERE rowid IN (SELECT id FROM employees WHERE office_id = NEW.id);
+                    END''' % _search_text('NEW.office_name'))
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_designations_search_rename
+                    AFTER UPDATE OF designation_name ON designations
+                    BEGIN
+                        UPDATE employee_search SET designation_name = %s
+                        WHERE rowid IN (SELECT id FROM employees WHERE designation_id = NEW.id);
+                    END''' % _search_text('NEW.designation_name'))
+
+    # Index the existing employees
+    conn.execute('DELETE FROM employee_search')
+    conn.execute('''INSERT INTO employee_search (rowid, full_name, office_name, designation_name,
+                                                 aadhar_number, gpf_number, pranidhi_id, account_number)
+                    SELECT e.id, %s, %s, %s,
+                           e.aadhar_number, e.gpf_number, e.pranidhi_id, e.account_number
+                    FROM employees e
+                    LEFT JOIN offices o ON e.office_id = o.id
+                    LEFT JOIN designations d ON e.designation_id = d.id''' % (
+        _search_text('e.full_name'), _search_text('o.office_name'), _search_text('d.designation_name')))
+
+
+# 6: dashboard statistics tables kept current by triggers
+def add_dashboard_stats(conn):
+    # One row of totals, one row per office, and retirements counted per
+    # (year, office) so "retiring this/next year" stays right as time passes
+    conn.execute('''CREATE TABLE IF NOT EXISTS dashboard_stats (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        total_employees INTEGER NOT NULL DEFAULT 0,
+                        total_offices INTEGER NOT NULL DEFAULT 0,
+                        total_designations INTEGER NOT NULL DEFAULT 0
+                    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS office_stats (
+                        office_id INTEGER PRIMARY KEY,
+                        headcount INTEGER NOT NULL DEFAULT 0,
+                        approved INTEGER NOT NULL DEFAULT 0,
+                        vacancies INTEGER NOT NULL DEFAULT 0
+                    )''')
+    # office_id 0 collects employees without an office
+    conn.execute('''CREATE TABLE IF NOT EXISTS retirement_stats (
+                        year INTEGER NOT NULL,
+                        office_id INTEGER NOT NULL,
+                        retirements INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (year, office_id)
+                    ) WITHOUT ROWID''')
+
+    retirement_add = '''INSERT INTO retirement_stats (year, office_id, retirements)
+                        SELECT CAST(substr(NEW.retirement_date, 1, 4) AS INTEGER), COALESCE(NEW.office_id, 0), 1
+                        WHERE NEW.retirement_date IS NOT NULL
+                        ON CONFLICT (year, office_id) DO UPDATE SET retirements = retirements + 1;'''
+    retirement_remove = '''UPDATE retirement_stats SET retirements = retirements - 1
+                           WHERE year = CAST(substr(OLD.retirement_date, 1, 4) AS INTEGER)
+                           AND office_id = COALESCE(OLD.office_id, 0);'''
+
+    # Employees
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_stats_insert
+                    AFTER INSERT ON employees
+                    BEGIN
+                        UPDATE dashboard_stats SET total_employees = total_employees + 1 WHERE id = 1;
+                        UPDATE office_stats SET headcount = headcount + 1 WHERE office_id = NEW.office_id;
+                        %s
+                    END''' % retirement_add)
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_stats_update
+                    AFTER UPDATE OF office_id, retirement_date ON employees
+                    WHEN OLD.office_id IS NOT NEW.office_id OR OLD.retirement_date IS NOT NEW.retirement_date
+                    BEGIN
+                        UPDATE office_stats SET headcount = headcount - 1 WHERE office_id = OLD.office_id;
+                        UPDATE office_stats SET headcount = headcount + 1 WHERE office_id = NEW.office_id;
+                        %s
+                        %s
+                    END''' % (retirement_remove, retirement_add))
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_stats_delete
+                    AFTER DELETE ON employees
+                    BEGIN
+                        UPDATE dashboard_stats SET total_employees = total_employees - 1 WHERE id = 1;
+                        UPDATE office_stats SET headcount = headcount - 1 WHERE office_id = OLD.office_id;
+                        %s
+                    END''' % retirement_remove)
+
+    # Offices and designations
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_offices_stats_insert
+                    AFTER INSERT ON offices
+                    BEGIN
+                        UPDATE dashboard_stats SET total_offices = total_offices + 1 WHERE id = 1;
+                        INSERT OR IGNORE INTO office_stats (office_id) VALUES (NEW.id);
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_offices_stats_delete
+                    AFTER DELETE ON offices
+                    BEGIN
+                        UPDATE dashboard_stats SET total_offices = total_offices - 1 WHERE id = 1;
+                        DELETE FROM office_stats WHERE office_id = OLD.id;
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_designations_stats_insert
+                    AFTER INSERT ON designations
+                    BEGIN
+                        UPDATE dashboard_stats SET total_designations = total_designations + 1 WHERE id = 1;
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_designations_stats_delete
+                    AFTER DELETE ON designations
+                    BEGIN
+                        UPDATE dashboard_stats SET total_designations = total_designations - 1 WHERE id = 1;
+                    END''')
+
+    # Approved and vacant posts follow office_positions, including the
+    # changes the employees position triggers make to it
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_office_positions_stats_insert
+                    AFTER INSERT ON office_positions
+                    BEGIN
+                        UPDATE office_stats
+                        SET approved = approved + COALESCE(NEW.approved_count, 0),
+                            vacancies = vacancies + COALESCE(NEW.vacant_count, 0)
+                        WHERE office_id = NEW.office_id;
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_office_positions_stats_update
+                    AFTER UPDATE OF office_id, approved_count, vacant_count ON office_positions
+                    BEGIN
+                        UPDATE office_stats
+                        SET approved = approved - COALESCE(OLD.approved_count, 0),
+                            vacancies = vacancies - COALESCE(OLD.vacant_count, 0)
+                        WHERE office_id = OLD.office_id;
+                        UPDATE office_stats
+                        SET approved = approved + COALESCE(NEW.approved_count, 0),
+                            vacancies = vacancies + COALESCE(NEW.vacant_count, 0)
+                        WHERE office_id = NEW.office_id;
+                    END''')
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_office_positions_stats_delete
+                    AFTER DELETE ON office_positions
+                    BEGIN
+                        UPDATE office_stats
+                        SET approved = approved - COALESCE(OLD.approved_count, 0),
+                            vacancies = vacancies - COALESCE(OLD.vacant_count, 0)
+                        WHERE office_id = OLD.office_id;
+                    END''')
+
+    # Start from exact figures
+    conn.execute('''INSERT OR REPLACE INTO dashboard_stats (id, total_employees, total_offices, total_designations)
+                    VALUES (1, (SELECT COUNT(*) FROM employees), (SELECT COUNT(*) FROM offices),
+                            (SELECT COUNT(*) FROM designations))''')
+    conn.execute('DELETE FROM office_stats')
+    conn.execute('''INSERT INTO office_stats (office_id, headcount, approved, vacancies)
+                    SELECT o.id,
+                           (SELECT COUNT(*) FROM employees e WHERE e.office_id = o.id),
+                           (SELECT COALESCE(SUM(approved_count), 0) FROM office_positions op WHERE op.office_id = o.id),
+                           (SELECT COALESCE(SUM(vacant_count), 0) FROM office_positions op WHERE op.office_id = o.id)
+                    FROM offices o''')
+    conn.execute('DELETE FROM retirement_stats')
+    conn.execute('''INSERT INTO retirement_stats (year, office_id, retirements)
+                    SELECT CAST(substr(retirement_date, 1, 4) AS INTEGER), COALESCE(office_id, 0), COUNT(*)
+                    FROM employees
+                    WHERE retirement_date IS NOT NULL
+                    GROUP BY 1, 2''')
+
+
+# Tables whose changes invalidate cached pages (see http_cache.py)
+VERSIONED_TABLES = (
+    'employees', 'transfer_history', 'promotion_history', 'office_positions',
+    'offices', 'designations', 'classes', 'salary_categories', 'castes', 'sub_castes',
+)
+
+
+# 7: per-table modification counters
+def add_table_versions(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS table_versions (
+                        name TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL
+                    ) WITHOUT ROWID''')
+
+    for table in VERSIONED_TABLES:
+        # Start each counter at a random value, so a recreated database never
+        # reproduces the ETags handed out for an older one
+        conn.execute('''INSERT OR IGNORE INTO table_versions (name, version)
+                        VALUES (?, abs(random() % 1000000000))''', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_version_%s
+                            AFTER %s ON %s
+                            BEGIN
+                                UPDATE table_versions SET version = version + 1 WHERE name = '%s';
+                            END''' % (table, event.lower(), event, table, table))
+
+
+# 8: covering index for the retirement forecast
+def add_retirement_forecast_index(conn):
+    # Covers the retirement forecast scan, so it never visits the table rows;
+    # its leading column still serves the retirement year filter
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_employees_retirement_forecast
+                    ON employees (retirement_date, office_id, designation_id, class_id, full_name)''')
+    conn.execute('DROP INDEX IF EXISTS idx_employees_retirement_date')
+
+
+# Tables recorded in the change log (see change_feed.py)
+LOGGED_TABLES = VERSIONED_TABLES
+
+
+# 9: append-only change log
+def add_change_log(conn):
+    # Append-only: seq is AUTOINCREMENT so sequence numbers are never reused,
+    # even after the oldest entries are pruned
+    conn.execute('''CREATE TABLE IF NOT EXISTS change_log (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        table_name TEXT NOT NULL,
+                        row_id INTEGER NOT NULL,
+                        operation TEXT NOT NULL,
+                        changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+                    )''')
+
+    for table in LOGGED_TABLES:
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_change_%s
+                            AFTER %s ON %s
+                            BEGIN
+                                INSERT INTO change_log (table_name, row_id, operation)
+                                VALUES ('%s', %s.id, '%s');
+                            END''' % (table, event.lower(), event, table, table, row, event.lower()))
+
+
+# 10: promotion history index for the seniority lists
+def add_seniority_index(conn):
+    # The seniority lists look up each employee's latest entry into their
+    # current designation; this answers it from the index alone and still
+    # serves the lookups by employee_id
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_promotion_history_entry
+                    ON promotion_history (employee_id, designation, promotion_date)''')
+    conn.execute('DROP INDEX IF EXISTS idx_promotion_history_employee')
+
+
+# 11: background jobs
+def add_jobs(conn):
+    # Background jobs (see jobs.py). params, summary: JSON text
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        params TEXT NOT NULL DEFAULT '{}',
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        submitted_by TEXT,
+                        progress_done INTEGER NOT NULL DEFAULT 0,
+                        progress_total INTEGER,
+                        cancel_requested INTEGER NOT NULL DEFAULT 0,
+                        worker_pid INTEGER,
+                        result_path TEXT,
+                        summary TEXT,
+                        error TEXT,
+                        created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+                        started_at TEXT,
+                        finished_at TEXT
+                    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+
+# Lookup names copied into employee_details: (details column, lookup table,
+# name column, employees column holding the lookup id)
+EMPLOYEE_DETAIL_NAMES = (
+    ('office_name', 'offices', 'office_name', 'office_id'),
+    ('designation_name', 'designations', 'designation_name', 'designation_id'),
+    ('class_name', 'classes', 'class_name', 'class_id'),
+    ('category_name', 'salary_categories', 'category_name', 'salary_category_id'),
+    ('caste_name', 'castes', 'caste_name', 'caste_id'),
+    ('sub_caste_name', 'sub_castes', 'sub_caste_name', 'sub_caste_id'),
+    ('joining_designation_name', 'designations', 'designation_name', 'joining_designation_id'),
+)
+
+
+# 12: employee_details, a read-only copy of employees with the lookup names
+# resolved, so the list, view and edit pages read one table instead of an
+# eight-way join. Triggers on employees copy each row as it is written and
+# triggers on the lookup tables rewrite the names when one is added,
+# renamed or deleted (a deleted lookup leaves NULL, as the LEFT JOINs did).
+# A later migration adding a column to employees must add it here as well.
+def add_employee_details(conn):
+    columns = [(row[1], row[2]) for row in conn.execute('PRAGMA table_info(employees)')]
+    definitions = ['id INTEGER PRIMARY KEY'] + ['%s %s' % (name, kind) for name, kind in columns if name != 'id']
+    definitions += ['%s TEXT' % column for column, _, _, _ in EMPLOYEE_DETAIL_NAMES]
+    conn.execute('CREATE TABLE IF NOT EXISTS employee_details (\n    %s\n)' % ',\n    '.join(definitions))
+
+    names = [column for column, _, _, _ in EMPLOYEE_DETAIL_NAMES]
+    insert = 'INSERT OR REPLACE INTO employee_details (%s) SELECT %s FROM employees e' % (
+        ', '.join([name for name, _ in columns] + names),
+        ', '.join(['e.%s' % name for name, _ in columns] +
+                  ['(SELECT %s FROM %s WHERE id = e.%s)' % (name_column, table, key)
+                   for _, table, name_column, key in EMPLOYEE_DETAIL_NAMES]))
+
+    conn.execute('DELETE FROM employee_details')
+    conn.execute(insert)
+
+    # The list's sort orders and filters, and the lookup keys the rename
+    # triggers update by
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employee_details_full_name ON employee_details (full_name, id)')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_employee_details_joining_date
+                    ON employee_details (COALESCE(joining_date, ''), id)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_employee_details_office_designation
+                    ON employee_details (office_id, designation_id)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_employee_details_retirement_date ON employee_details (retirement_date)')
+    for _, _, _, key in EMPLOYEE_DETAIL_NAMES:
+        if key != 'office_id':
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_employee_details_%s ON employee_details (%s)' % (key, key))
+
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_details_insert
+                    AFTER INSERT ON employees
+                    BEGIN
+                        %s WHERE e.id = NEW.id;
+                    END''' % insert)
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_details_update
+                    AFTER UPDATE ON employees
+                    BEGIN
+                        DELETE FROM employee_details WHERE id = OLD.id AND OLD.id <> NEW.id;
+                        %s WHERE e.id = NEW.id;
+                    END''' % insert)
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_employees_details_delete
+                    AFTER DELETE ON employees
+                    BEGIN
+                        DELETE FROM employee_details WHERE id = OLD.id;
+                    END''')
+
+    tables = {}
+    for column, table, name_column, key in EMPLOYEE_DETAIL_NAMES:
+        tables.setdefault(table, []).append((column, name_column, key))
+    for table, uses in tables.items():
+        renamed = ''.join('UPDATE employee_details SET %s = NEW.%s WHERE %s = NEW.id;\n' % (column, name_column, key)
+                          for column, name_column, key in uses)
+        removed = ''.join('UPDATE employee_details SET %s = NULL WHERE %s = OLD.id;\n' % (column, key)
+                          for column, name_column, key in uses)
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_details_insert
+                        AFTER INSERT ON %s
+                        BEGIN
+                            %s
+                        END''' % (table, table, renamed))
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_details_rename
+                        AFTER UPDATE OF %s ON %s
+                        BEGIN
+                            %s
+                        END''' % (table, uses[0][1], table, renamed))
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_details_delete
+                        AFTER DELETE ON %s
+                        BEGIN
+                            %s
+                        END''' % (table, table, removed))
+
+    # Only the employee list used these; it now reads employee_details
+    conn.execute('DROP INDEX IF EXISTS idx_employees_full_name')
+    conn.execute('DROP INDEX IF EXISTS idx_employees_joining_date')
+
+
+# 13: bindu namavali (see bindu.py). Each sub-caste gets an optional
+# reservation category code, and every office/designation cadre a version
+# counter that triggers bump whenever a write could change its roster, so
+# only those cadres are recomputed.
+def add_bindu_roster(conn):
+    _add_column(conn, 'sub_castes', 'reservation_category', 'TEXT')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS roster_versions (
+                        office_id INTEGER NOT NULL,
+                        designation_id INTEGER NOT NULL,
+                        version INTEGER NOT NULL,
+                        PRIMARY KEY (office_id, designation_id)
+                    ) WITHOUT ROWID''')
+
+    # Random start values, as for table_versions, so a recreated database
+    # never matches results cached for an older one
+    bump = '''INSERT INTO roster_versions (office_id, designation_id, version)
+              SELECT {row}.office_id, {row}.designation_id, abs(random() % 1000000000)
+              WHERE {row}.office_id IS NOT NULL AND {row}.designation_id IS NOT NULL
+              ON CONFLICT (office_id, designation_id) DO UPDATE SET version = version + 1;'''
+    new, old = bump.format(row='NEW'), bump.format(row='OLD')
+
+    conn.execute('''INSERT OR IGNORE INTO roster_versions (office_id, designation_id, version)
+                    SELECT office_id, designation_id, abs(random() % 1000000000) FROM (
+                        SELECT office_id, designation_id FROM office_positions
+                        UNION
+                        SELECT office_id, designation_id FROM employees
+                    )
+                    WHERE office_id IS NOT NULL AND designation_id IS NOT NULL''')
+
+    for table, update_columns in (
+            ('employees', 'office_id, designation_id, bindu_number, sub_caste_id, caste_verified, retirement_date'),
+            ('office_positions', 'office_id, designation_id, approved_count')):
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_roster_insert
+                        AFTER INSERT ON %s
+                        BEGIN
+                            %s
+                        END''' % (table, table, new))
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_roster_update
+                        AFTER UPDATE OF %s ON %s
+                        BEGIN
+                            %s
+                            %s
+                        END''' % (table, update_columns, table, old, new))
+        conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_%s_roster_delete
+                        AFTER DELETE ON %s
+                        BEGIN
+                            %s
+                        END''' % (table, table, old))
+
+
+# 14: job uploads in their own column
+def add_job_upload_path(conn):
+    # The saved upload used to be kept in params, which callers supply;
+    # move it out so only jobs.submit() can set it
+    _add_column(conn, 'jobs', 'upload_path', 'TEXT')
+    conn.execute('''UPDATE jobs SET upload_path = json_extract(params, '$.upload'),
+                                    params = json_remove(params, '$.upload')
+                    WHERE json_valid(params) AND json_type(params, '$.upload') = 'text' ''')
+
+
+# 15: which process instance runs a job
+def add_job_worker_token(conn):
+    # worker_pid alone cannot tell a restarted process that got the same pid
+    # from the one that claimed the job (see jobs._process_token)
+    _add_column(conn, 'jobs', 'worker_token', 'TEXT')
+
+
+# Ordered list of migrations; the schema version is the index + 1
+MIGRATIONS = [
+    create_base_schema,
+    add_history_columns,
+    add_lookup_indexes,
+    add_position_count_triggers,
+    add_employee_search,
+    add_dashboard_stats,
+    add_table_versions,
+    add_retirement_forecast_index,
+    add_change_log,
+    add_seniority_index,
+    add_jobs,
+    add_employee_details,
+    add_bindu_roster,
+    add_job_upload_path,
+    add_job_worker_token,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# Bring the database up to LATEST_VERSION. Returns the number of migrations
+# applied (0 when the schema was already current).
+def migrate(conn):
+    if current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    # Manage transactions by hand so DDL and the version bump commit together
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    applied = 0
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Re-read under the write lock: another worker may have
+                # migrated while we were waiting
+                version = current_version(conn)
+                if version >= LATEST_VERSION:
+                    conn.execute('ROLLBACK')
+                    break
+                MIGRATIONS[version](conn)
+                conn.execute('PRAGMA user_version = %d' % (version + 1))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            applied += 1
+    finally:
+        conn.isolation_level = isolation_level
+
+    return applied
+
+
+_checked = set()
+_checked_lock = threading.Lock()
+
+
+# Migrate the configured database once per process, before its first request
+def ensure_current():
+    path = current_app.config['DATABASE']
+    if path in _checked:
+        return
+
+    with _checked_lock:
+        if path not in _checked:
+            migrate(db.get_db())
+            _checked.add(path)
+
+
+def init_app(app):
+    app.before_request(ensure_current)
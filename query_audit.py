@@ -0,0 +1,198 @@
+# EXPLAIN QUERY PLAN audit
+#
+# Runs every query the app issues through EXPLAIN QUERY PLAN against the
+# current database and flags full table scans, so a missing or unusable
+# index shows up before the data grows. Run it with:
+#
+#     flask --app app audit-queries
+#
+# When a route gains a new query, add it to _audit_queries(). Scans that are
+# intended (listing a small lookup table or the per-office statistics) are
+# named in the query's allowed set; 'sort' in that set accepts a temporary
+# B-tree sort, which is fine once a filter has narrowed the rows.
+import backup
+import bindu
+import change_feed
+import dashboard_stats
+import employee_list
+import employee_search
+import federation
+import retirement_forecast
+import seniority
+import vacancy_projection
+
+LOOKUP_TABLES = {'offices', 'designations', 'classes', 'salary_categories', 'castes', 'sub_castes'}
+
+
+def _list_query(filters, sort='name', order='asc', cursor=None):
+    return employee_list.page_query(filters, sort, order, employee_list.DEFAULT_PAGE_SIZE, cursor)
+
+
+def _audit_queries():
+    queries = [
+        # dashboard
+        ('dashboard: totals', 'SELECT * FROM dashboard_stats WHERE id = 1', (), set()),
+        ('dashboard: office statistics', dashboard_stats.OFFICE_STATS_SQL, (2030, 2031), {'o', 'st'}),
+        ('dashboard: retirements in a year', dashboard_stats.RETIREMENTS_SQL, (2030,), set()),
+
+        # employee view/edit
+        ('employee by id', 'SELECT * FROM employee_details WHERE id = ?', (1,), set()),
+        ('transfer history by employee', 'SELECT * FROM transfer_history WHERE employee_id = ?', (1,), set()),
+        ('promotion history by employee', 'SELECT * FROM promotion_history WHERE employee_id = ?', (1,), set()),
+        ('promotion history joining row',
+         'UPDATE promotion_history SET designation = ? WHERE employee_id = ? AND joining_date = promotion_date',
+         (1, 1), set()),
+
+        # office positions
+        ('position filled count',
+         'SELECT COUNT(*) FROM employees WHERE office_id = ? AND designation_id = ?', (1, 1), set()),
+        ('position approved count update',
+         '''UPDATE office_positions SET approved_count = ?, vacant_count = ? - filled_count
+            WHERE office_id = ? AND designation_id = ?''', (1, 1, 1, 1), set()),
+        ('position count trigger',
+         '''UPDATE office_positions SET filled_count = filled_count + 1, vacant_count = vacant_count - 1
+            WHERE office_id = ? AND designation_id = ?''', (1, 1), set()),
+        ('office positions listing',
+         '''SELECT op.*, o.office_name, d.designation_name FROM office_positions op
+            JOIN offices o ON op.office_id = o.id
+            JOIN designations d ON op.designation_id = d.id''', (), {'op', 'o', 'd'}),
+
+        # settings delete checks
+        ('office in use', 'SELECT COUNT(*) FROM employees WHERE office_id = ?', (1,), set()),
+        ('designation in use',
+         'SELECT COUNT(*) FROM employees WHERE designation_id = ? OR joining_designation_id = ?', (1, 1), set()),
+        ('class in use', 'SELECT COUNT(*) FROM employees WHERE class_id = ?', (1,), set()),
+        ('salary category in use', 'SELECT COUNT(*) FROM employees WHERE salary_category_id = ?', (1,), set()),
+        ('caste in use', 'SELECT COUNT(*) FROM employees WHERE caste_id = ?', (1,), set()),
+        ('sub caste in use', 'SELECT COUNT(*) FROM employees WHERE sub_caste_id = ?', (1,), set()),
+        ('sub castes of caste (delete)', 'DELETE FROM sub_castes WHERE caste_id = ?', (1,), set()),
+
+        # form dropdowns
+        ('sub castes by caste', 'SELECT id, sub_caste_name FROM sub_castes WHERE caste_id = ?', (1,), set()),
+    ]
+
+    for table in sorted(LOOKUP_TABLES):
+        queries.append(('lookup listing: %s' % table, 'SELECT * FROM %s' % table, (), {table}))
+
+    # Employee list variants
+    cursor = employee_list.encode_cursor('', 1)
+    list_variants = [
+        ('employee list: by name', {}, 'name', 'asc', None, set()),
+        ('employee list: by name, next page', {}, 'name', 'asc', cursor, set()),
+        ('employee list: by joining date desc', {}, 'joining_date', 'desc', None, set()),
+        ('employee list: office filter', {'office_id': 1}, 'name', 'asc', None, {'sort'}),
+        ('employee list: office and designation filter', {'office_id': 1, 'designation_id': 1}, 'name', 'asc', None, {'sort'}),
+        ('employee list: retirement year filter', {'retirement_year': 2030}, 'name', 'asc', None, {'sort'}),
+    ]
+    for name, filters, sort, order, page_cursor, allowed in list_variants:
+        sql, params = _list_query(filters, sort, order, page_cursor)
+        queries.append((name, sql, params, allowed))
+
+    # Export: the whole list in order, no LIMIT
+    sql, params = employee_list.export_query({})
+    queries.append(('employee export: by name', sql, params, set()))
+    sql, params = employee_list.export_query({'office_id': 1}, 'joining_date', 'desc')
+    queries.append(('employee export: office filter', sql, params, {'sort'}))
+
+    queries.append(('retirement forecast', retirement_forecast.FORECAST_SQL, ('2025-01-01', '2030-01-01'), set()))
+
+    queries.append(('vacancy projection: positions', vacancy_projection.POSITIONS_SQL, (), {'office_positions'}))
+    queries.append(('vacancy projection: retirements', vacancy_projection.RETIREMENTS_SQL,
+                    ('2025-01-01', '2027-01-01'), set()))
+
+    # Conditional GET: the whole (ten row) counter table
+    queries.append(('table versions', 'SELECT name, version FROM table_versions', (), {'table_versions'}))
+
+    queries.append(('employee search', employee_search.SEARCH_SQL,
+                    (employee_search.match_expression('राम'), employee_search.DEFAULT_LIMIT), {'sort'}))
+
+    # Every serving employee, sorted into the lists in memory
+    queries.append(('seniority lists', seniority.SENIORITY_SQL, ('2025-01-01',), {'e'}))
+
+    # Bindu roster: every cadre in one pass, or only the cadres a write touched
+    queries.append(('bindu: cadre versions', bindu.VERSIONS_SQL, (), {'roster_versions'}))
+    queries.append(('bindu: positions', bindu.POSITIONS_SQL, (), {'office_positions'}))
+    queries.append(('bindu: employees', bindu.EMPLOYEES_SQL, ('2025-01-01',), {'e'}))
+    queries.append(('bindu: positions for cadres', bindu.POSITIONS_FOR_CADRES_SQL, ('[[1, 1]]',), {'json_each'}))
+    queries.append(('bindu: employees for cadres', bindu.EMPLOYEES_FOR_CADRES_SQL,
+                    ('2025-01-01', '[[1, 1]]'), {'json_each'}))
+
+    # District views: each shard's branch, audited against this database
+    for sort, order in [('name', 'asc'), ('joining_date', 'desc')]:
+        sql, params = federation.employees_branch(0, {}, sort, order, ('x', 0, 1), schema='main')
+        queries.append(('district employees by %s' % sort, sql, params + [51], set()))
+    sql, params = federation.employees_branch(0, {'office': 'x', 'designation': 'y'}, 'name', 'asc', None,
+                                              schema='main')
+    queries.append(('district employees by office and designation', sql, params + [51], {'sort'}))
+    for name, template, params, allowed in [
+            ('district dashboard', federation.DASHBOARD_SQL, (2030, 2031), set()),
+            ('district dashboard: offices', federation.OFFICE_STATS_SQL, (2030, 2031), {'st'}),
+            ('district office totals', federation.OFFICE_TOTALS_SQL, (), {'o'}),
+            ('district designation totals', federation.DESIGNATION_TOTALS_SQL, (), {'d'}),
+            ('district lookup names', federation.LOOKUP_NAMES_SQL, (),
+             {'main.%s' % table for table in LOOKUP_TABLES})]:
+        queries.append((name, template.format(shard=0, schema='main'), params, allowed))
+
+    # Background jobs; the jobs table only holds recent jobs (see prune-jobs)
+    queries.append(('jobs: by id', 'SELECT * FROM jobs WHERE id = ?', (1,), set()))
+    queries.append(('jobs: recent', 'SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (50,), {'jobs'}))
+    queries.append(('jobs: backup pending', backup.PENDING_SQL, (), set()))
+    queries.append(('jobs: running', "SELECT id, worker_pid FROM jobs WHERE status = 'running'", (), set()))
+    queries.append(('jobs: finished before',
+                    '''SELECT id, result_path FROM jobs
+                       WHERE status IN ('done', 'failed', 'cancelled') AND created_at < ?''',
+                    ('2025-01-01',), set()))
+
+    # Change feed
+    queries.append(('change feed: page', change_feed.PAGE_SQL, (0, change_feed.DEFAULT_LIMIT + 1), set()))
+    queries.append(('change feed: latest', change_feed.LATEST_SQL, (), {'sqlite_sequence'}))
+    queries.append(('change feed: oldest', change_feed.OLDEST_SQL, (), set()))
+    for table, sql in sorted(change_feed.ROWS_SQL.items()):
+        queries.append(('change feed rows: %s' % table, sql, ('[1, 2]',), {'json_each'}))
+    # Reads back from the newest entry only as far as the cutoff
+    queries.append(('change feed: prune point', change_feed.PRUNE_THROUGH_SQL, ('2025-01-01',), {'change_log'}))
+
+    return queries
+
+
+# Explain each audited query. Returns a list of (name, plan, problems) where
+# plan is the list of EXPLAIN QUERY PLAN detail strings.
+def audit(conn):
+    results = []
+    for name, sql, params, allowed in _audit_queries():
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+        problems = []
+        for detail in plan:
+            words = detail.split()
+            # 'SCAN <table>' with no index at all is a full table scan
+            if detail.startswith('SCAN') and 'VIRTUAL TABLE INDEX' in detail:
+                # Full-text tables: the index string after ':' lists the
+                # constraints used; an empty one means every row is read
+                if not detail.split(':', 1)[-1].strip() and words[1] not in allowed:
+                    problems.append('full table scan: %s' % detail)
+            elif len(words) >= 2 and words[0] == 'SCAN' and 'USING' not in words:
+                table = words[1]
+                if table not in allowed and table != 'CONSTANT':
+                    problems.append('full table scan: %s' % detail)
+            elif detail.startswith('USE TEMP B-TREE') and 'sort' not in allowed:
+                problems.append('sort without index: %s' % detail)
+
+        results.append((name, plan, problems))
+    return results
+
+
+def format_report(results, verbose=False):
+    lines = []
+    for name, plan, problems in results:
+        status = 'SCAN' if problems else 'ok'
+        lines.append('[%s] %s' % (status, name))
+        if problems or verbose:
+            for detail in plan:
+                lines.append('      %s' % detail)
+        for problem in problems:
+            lines.append('    ! %s' % problem)
+
+    flagged = sum(1 for result in results if result[2])
+    lines.append('%d queries audited, %d flagged' % (len(results), flagged))
+    return '\n'.join(lines)
@@ -0,0 +1,224 @@
+# Read connections for heavy reports
+#
+# Reports and exports read many rows in one long read transaction. They take
+# their connection from get_report_db() rather than db.get_db(): a separate
+# per-thread pool of read-only connections (mode=ro, query_only), so a report
+# never holds a pooled connection a form save is waiting for and cannot write
+# by mistake. REPORT_MAX_STALENESS picks what they read:
+#
+#   * 0 (the default): the live database. In WAL mode readers never block
+#     writers, and a report sees everything committed when its read started.
+#   * N seconds: a snapshot copy of the database, taken with the online
+#     backup API (see backup.copy_database) by the first report request that
+#     finds it older than N seconds. Other requests keep reading the previous
+#     copy while it is refreshed. Snapshot connections are opened immutable,
+#     so reports take no locks on any file a writer uses, and a long export
+#     no longer keeps the live WAL from being checkpointed while saves keep
+#     appending to it. Responses served from a snapshot carry an X-Data-As-Of
+#     header with the UTC time the copy was taken.
+#
+# Each refresh writes a new file, <root>.<id>.db for REPORT_SNAPSHOT (by
+# default <database>.report.db next to it), and new report connections open
+# the newest one. A file a report connection has open is never replaced:
+# Windows refuses, and elsewhere the connection goes on reading the old copy.
+# Pooled connections to an older copy are closed when next taken from the
+# pool. Only the two newest copies are kept, as a request may be opening the
+# previous one while a refresh finishes; an older copy still open elsewhere
+# (which Windows will not delete) goes at a later refresh.
+#
+# Snapshot results are cached under the REPORT_SNAPSHOT path (see
+# db.cache_path), apart from the live database's.
+import glob
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, g
+
+import backup
+import db
+
+DEFAULT_CONFIG = {
+    'REPORT_MAX_STALENESS': 0,      # seconds; 0 = read the live database
+    'REPORT_SNAPSHOT': None,        # None = <database>.report.db
+    'REPORT_POOL_SIZE': 2,          # idle report connections kept per thread
+}
+
+_local = threading.local()
+_lock = threading.Lock()            # held by the thread refreshing the snapshot
+
+
+def snapshot_path(config=None):
+    if config is None:
+        config = current_app.config
+    path = config.get('REPORT_SNAPSHOT')
+    if not path:
+        path = os.path.splitext(config.get('DATABASE', db.DEFAULT_DATABASE))[0] + '.report.db'
+    return path
+
+
+# Unix time the snapshot at `path` was taken, or None when there is none
+def _taken(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+# (time taken, file) of every snapshot copy for `path`, oldest first
+def _copies(path):
+    root, ext = os.path.splitext(path)
+    copies = []
+    for name in glob.glob('%s.*%s' % (glob.escape(root), ext)):
+        taken = _taken(name)
+        if taken is not None:
+            copies.append((taken, name))
+    copies.sort()
+    return copies
+
+
+# (file, time taken) of the newest snapshot copy, or (None, None)
+def _newest(path):
+    copies = _copies(path)
+    if not copies:
+        return None, None
+    taken, name = copies[-1]
+    return name, taken
+
+
+# Copy the live database into a new snapshot file and drop all but the two
+# newest. The file's mtime is set to when the copy started, which is how old
+# its data is. Returns (file, that time).
+def refresh(config=None):
+    if config is None:
+        config = current_app.config
+    path = snapshot_path(config)
+    root, ext = os.path.splitext(path)
+    name = '%s.%s%s' % (root, uuid.uuid4().hex, ext)
+    work = name + '.tmp'
+    started = time.time()
+
+    source = db.connect(config['DATABASE'], config)
+    try:
+        backup.copy_database(source, work,
+                             config.get('BACKUP_PAGES', backup.DEFAULT_CONFIG['BACKUP_PAGES']),
+                             config.get('BACKUP_SLEEP', backup.DEFAULT_CONFIG['BACKUP_SLEEP']))
+        os.utime(work, (started, started))
+        os.replace(work, name)
+    finally:
+        source.close()
+        try:
+            os.remove(work)
+        except OSError:
+            pass
+
+    for _, old in _copies(path)[:-2]:
+        if old != name:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return name, started
+
+
+# (file, time taken) of a snapshot no older than REPORT_MAX_STALENESS,
+# refreshing it first when needed
+def _snapshot(config):
+    path = snapshot_path(config)
+    max_age = config['REPORT_MAX_STALENESS']
+    name, taken = _newest(path)
+    if taken is not None and time.time() - taken <= max_age:
+        return name, taken
+
+    # One thread copies; while it does, the others read the old snapshot
+    if _lock.acquire(blocking=taken is None):
+        try:
+            name, taken = _newest(path)
+            if taken is None or time.time() - taken > max_age:
+                name, taken = refresh(config)
+        finally:
+            _lock.release()
+    return name, taken
+
+
+def _pool(path):
+    pools = getattr(_local, 'pools', None)
+    if pools is None:
+        pools = _local.pools = {}
+    return pools.setdefault(path, [])
+
+
+# Read-only connection for the reports of the current app context
+def get_report_db():
+    if 'report_db' not in g:
+        config = current_app.config
+        if config['REPORT_MAX_STALENESS']:
+            path = snapshot_path(config)
+            name, taken = _snapshot(config)
+        else:
+            path = name = config['DATABASE']
+            taken = None
+
+        # Pooled connections to an older snapshot are done with
+        pool = _pool(path)
+        conn = None
+        while pool and conn is None:
+            conn = pool.pop()
+            if conn.report_file != name:
+                conn.close()
+                conn = None
+        if conn is None:
+            conn = db.connect_readonly(name, config, immutable=taken is not None)
+            conn.cache_path = path
+            conn.report_file = name
+            conn.report_taken = taken
+
+        g.report_db = conn
+        g.report_db_path = path
+        on_acquire = config['DB_ON_ACQUIRE']
+        if on_acquire is not None:
+            on_acquire(conn)
+    return g.report_db
+
+
+def close_report_db(exception=None):
+    conn = g.pop('report_db', None)
+    path = g.pop('report_db_path', None)
+    if conn is None:
+        return
+
+    on_release = current_app.config['DB_ON_RELEASE']
+    if on_release is not None:
+        on_release(conn)
+    pool = _pool(path)
+    if not conn.in_transaction and len(pool) < current_app.config['REPORT_POOL_SIZE']:
+        pool.append(conn)
+    else:
+        conn.close()
+
+
+# Close every pooled report connection owned by the calling thread
+def close_pool():
+    pools = getattr(_local, 'pools', None)
+    if not pools:
+        return
+
+    for pool in pools.values():
+        while pool:
+            pool.pop().close()
+    pools.clear()
+
+
+def _as_of(response):
+    conn = g.get('report_db')
+    if conn is not None and conn.report_taken is not None:
+        response.headers['X-Data-As-Of'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(conn.report_taken))
+    return response
+
+
+def init_app(app):
+    for name, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(name, value)
+    app.after_request(_as_of)
+    app.teardown_appcontext(close_report_db)
@@ -0,0 +1,110 @@
+# Retirement forecast
+#
+# Counts and lists the employees retiring in the next N years, by month and
+# year and broken down by office, designation and class. The employees are
+# read with one range scan over the retirement_date index; names come from
+# the lookup cache and all grouping is done in memory in the same pass.
+#
+# A forecast is cached per database, horizon and start month and reused
+# until the employees, offices, designations or classes table changes (see
+# http_cache.cached_by_versions).
+from collections import Counter
+from datetime import date
+
+import lookups
+from http_cache import cached_by_versions
+
+DEFAULT_YEARS = 5
+MAX_YEARS = 40
+
+DEPENDS_ON = ('employees', 'offices', 'designations', 'classes')
+
+# Columns 3-5 are the BREAKDOWNS keys, in order
+FORECAST_SQL = '''SELECT e.id, e.full_name, e.retirement_date, e.office_id, e.designation_id, e.class_id
+                  FROM employees e
+                  WHERE e.retirement_date >= ? AND e.retirement_date < ?
+                  ORDER BY e.retirement_date'''
+
+# Breakdown name -> (employee column, lookup table, name column)
+BREAKDOWNS = {
+    'office': ('office_id', 'offices', 'office_name'),
+    'designation': ('designation_id', 'designations', 'designation_name'),
+    'class': ('class_id', 'classes', 'class_name'),
+}
+
+
+def _months(start, years):
+    months = []
+    year, month = start.year, start.month
+    for _ in range(years * 12):
+        months.append('%04d-%02d' % (year, month))
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+
+# Turn a Counter of (id, year) into rows per id, largest total first
+def _breakdown(counts, names):
+    by_key = {}
+    for (key, year), count in sorted(counts.items(), key=lambda item: item[0][1]):
+        row = by_key.get(key)
+        if row is None:
+            row = by_key[key] = {'id': key, 'name': names.get(key), 'total': 0, 'by_year': {}}
+        row['total'] += count
+        row['by_year'][year] = count
+    return sorted(by_key.values(), key=lambda row: -row['total'])
+
+
+def build(conn, start, years):
+    end = date(start.year + years, start.month, 1)
+    lookup = lookups.get_lookups(conn)
+    names = {name: {row['id']: row[column] for row in lookup[table]}
+             for name, (_, table, column) in BREAKDOWNS.items()}
+
+    months = _months(start, years)
+
+    # Plain tuples are much cheaper than sqlite3.Row over tens of thousands
+    # of rows, and each figure is one Counter pass over them
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(FORECAST_SQL, (start.isoformat(), end.isoformat())).fetchall()
+
+    by_month = Counter(row[2][:7] for row in rows)
+    by_year = Counter(row[2][:4] for row in rows)
+    breakdowns = {}
+    for index, name in enumerate(BREAKDOWNS, start=3):
+        breakdowns[name] = Counter((row[index], row[2][:4]) for row in rows)
+
+    office_names, designation_names, class_names = (names[name] for name in BREAKDOWNS)
+    employees = [{
+        'id': employee_id,
+        'full_name': full_name,
+        'retirement_date': retirement_date,
+        'office': office_names.get(office_id),
+        'designation': designation_names.get(designation_id),
+        'class': class_names.get(class_id),
+    } for employee_id, full_name, retirement_date, office_id, designation_id, class_id in rows]
+
+    forecast = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'years': years,
+        'total': len(employees),
+        'by_year': {str(year): by_year[str(year)] for year in range(start.year, end.year + 1)
+                    if year < end.year or end.month > 1},
+        'by_month': {month: by_month[month] for month in months},
+        'employees': employees,
+    }
+    for name in BREAKDOWNS:
+        forecast['by_' + name] = _breakdown(breakdowns[name], names[name])
+    return forecast
+
+
+# Forecast for the next `years` years from the start of the current month.
+# The result is shared between requests and must not be modified.
+def get_forecast(conn, years=DEFAULT_YEARS, today=None):
+    today = today or date.today()
+    start = date(today.year, today.month, 1)
+    return cached_by_versions(conn, DEPENDS_ON, ('retirements', start, years),
+                              lambda: build(conn, start, years))
@@ -0,0 +1,129 @@
+# Seniority lists (ज्येष्ठता सूची)
+#
+# One list per designation and class, of the employees still in service.
+# Seniority within a list goes by the date the employee entered their
+# current designation (their latest promotion_history entry for it, or the
+# joining date when there is none), then joining date, then birth date;
+# missing dates rank last. Every list is computed at once: one query reads
+# all serving employees, the entry date being an index-only lookup on
+# idx_promotion_history_entry, and a single in-memory sort orders them.
+# (A ROW_NUMBER() window over the same rows measured twice as slow.)
+#
+# The computed lists are cached per database and day and reused until the
+# employees, promotion history or the lookup tables they name change (see
+# http_cache.cached_by_versions).
+import csv
+import io
+from datetime import date
+
+import lookups
+from employee_export import CSV_BOM
+from http_cache import cached_by_versions
+
+DEPENDS_ON = ('employees', 'promotion_history', 'offices', 'designations', 'classes')
+
+# Every serving employee with the date they entered their current
+# designation. promotion_history.designation is a TEXT column, so the id is
+# compared as text to let the lookup use idx_promotion_history_entry.
+SENIORITY_SQL = '''SELECT e.designation_id, e.class_id, e.id, e.full_name, e.office_id,
+                          COALESCE((SELECT MAX(p.promotion_date) FROM promotion_history p
+                                    WHERE p.employee_id = e.id
+                                      AND p.designation = CAST(e.designation_id AS TEXT)),
+                                   e.joining_date) AS entered,
+                          e.joining_date, e.birth_date, e.retirement_date
+                   FROM employees e
+                   WHERE e.designation_id IS NOT NULL
+                     AND COALESCE(e.retirement_date, '9999-12-31') >= ?'''
+
+
+# Sort key over SENIORITY_SQL rows: list, then entry date, joining date and
+# birth date with missing dates last, then id
+def _seniority_key(row):
+    return (row[0], row[1] is None, row[1] or 0,
+            row[5] is None, row[5] or '', row[6] is None, row[6] or '', row[7] is None, row[7] or '',
+            row[2])
+
+
+# CSV columns: (header, employee key)
+CSV_COLUMNS = [
+    ('पद', 'designation'),
+    ('वर्ग', 'class'),
+    ('ज्येष्ठता क्रमांक', 'seniority'),
+    ('नाव', 'full_name'),
+    ('कार्यालय', 'office'),
+    ('सध्याच्या पदावर रुजू दिनांक', 'entered_designation'),
+    ('नियुक्ती दिनांक', 'joining_date'),
+    ('जन्म दिनांक', 'birth_date'),
+    ('सेवानिवृत्ती दिनांक', 'retirement_date'),
+]
+
+
+def build(conn, today):
+    lookup = lookups.get_lookups(conn)
+    office_names = {row['id']: row['office_name'] for row in lookup['offices']}
+    designation_names = {row['id']: row['designation_name'] for row in lookup['designations']}
+    class_names = {row['id']: row['class_name'] for row in lookup['classes']}
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(SENIORITY_SQL, (today.isoformat(),)).fetchall()
+    rows.sort(key=_seniority_key)
+
+    lists = []
+    current = None
+    for (designation_id, class_id, employee_id, full_name, office_id,
+         entered, joining_date, birth_date, retirement_date) in rows:
+        if current is None or (current['designation_id'], current['class_id']) != (designation_id, class_id):
+            seniority = 0
+            current = {
+                'designation_id': designation_id,
+                'designation': designation_names.get(designation_id),
+                'class_id': class_id,
+                'class': class_names.get(class_id),
+                'employees': [],
+            }
+            lists.append(current)
+        seniority += 1
+        current['employees'].append({
+            'seniority': seniority,
+            'id': employee_id,
+            'full_name': full_name,
+            'office': office_names.get(office_id),
+            'entered_designation': entered,
+            'joining_date': joining_date,
+            'birth_date': birth_date,
+            'retirement_date': retirement_date,
+        })
+
+    return {'as_of': today.isoformat(), 'total': len(rows), 'lists': lists}
+
+
+# Seniority lists as of today, optionally only for one designation and/or
+# class. The lists are shared between requests and must not be modified.
+def get_seniority(conn, designation_id=None, class_id=None, today=None):
+    today = today or date.today()
+    result = cached_by_versions(conn, DEPENDS_ON, ('seniority', today),
+                                lambda: build(conn, today))
+    if designation_id is None and class_id is None:
+        return result
+
+    lists = [seniority_list for seniority_list in result['lists']
+             if designation_id in (None, seniority_list['designation_id'])
+             and class_id in (None, seniority_list['class_id'])]
+    return {'as_of': result['as_of'],
+            'total': sum(len(seniority_list['employees']) for seniority_list in lists),
+            'lists': lists}
+
+
+# The lists as one CSV document, one row per employee
+def to_csv(result):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for header, _ in CSV_COLUMNS])
+    for seniority_list in result['lists']:
+        for employee in seniority_list['employees']:
+            row = dict(employee)
+            row['designation'] = seniority_list['designation']
+            row['class'] = seniority_list['class']
+            writer.writerow([row[key] for _, key in CSV_COLUMNS])
+    return CSV_BOM + buffer.getvalue()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+# The app, pointed at a fresh database (and jobs directory) per test
+@pytest.fixture
+def app(tmp_path):
+    flask_app = app_module.app
+    saved = dict(flask_app.config)
+    flask_app.config.update(TESTING=True, DATABASE=str(tmp_path / 'employee.db'),
+                            JOBS_DIR=str(tmp_path / 'jobs'))
+    app_module.init_db()
+    yield flask_app
+    flask_app.config.clear()
+    flask_app.config.update(saved)
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+    return client
@@ -0,0 +1,26 @@
+import bindu
+import db
+
+
+def test_roster_is_capped():
+    assert len(bindu.roster(10 ** 8)) == bindu.MAX_POINTS
+
+
+def test_huge_approved_count_is_rejected(app, client):
+    response = client.post('/add_office_position', data={'office_id': 1, 'designation_id': 1,
+                                                         'approved_count': 10 ** 8})
+    assert response.status_code == 302
+    with app.app_context():
+        assert db.get_db().execute('SELECT COUNT(*) FROM office_positions').fetchone()[0] == 0
+
+
+def test_cadre_beyond_the_roster_limit_is_reported(app, client):
+    with app.app_context():
+        conn = db.get_db()
+        conn.execute('''INSERT INTO office_positions (office_id, designation_id, approved_count, filled_count, vacant_count)
+                        VALUES (1, 1, ?, 0, ?)''', (10 ** 8, 10 ** 8))
+        conn.commit()
+
+    cadre = client.get('/api/reports/bindu?office_id=1&designation_id=1').get_json()
+    assert len(cadre['points']) == bindu.MAX_POINTS
+    assert {'issue': 'approved posts beyond the %d point roster limit' % bindu.MAX_POINTS} in cadre['issues']
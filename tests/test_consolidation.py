@@ -0,0 +1,52 @@
+import sqlite3
+
+import consolidation
+import db
+import migrations
+
+
+# An office database at `path` with the current schema
+def _source(app, path):
+    conn = db.connect(str(path), app.config)
+    migrations.migrate(conn)
+    conn.close()
+    return sqlite3.connect(str(path))
+
+
+def test_sub_caste_of_missing_caste_is_skipped_and_reported(app, tmp_path):
+    source = _source(app, tmp_path / 'office.db')
+    source.execute("INSERT INTO sub_castes (id, caste_id, sub_caste_name, reservation_category) "
+                   "VALUES (101, 1, 'Maratha', 'SEBC'), (102, 99, 'Orphan', 'OBC')")
+    source.execute("INSERT INTO employees (full_name, gender, birth_date, aadhar_number, caste_id, sub_caste_id) "
+                   "VALUES ('Anil Patil', 'M', '1980-01-01', '123412341234', 1, 101), "
+                   "('Sunil Patil', 'M', '1981-01-01', '432143214321', 1, 102)")
+    source.commit()
+    source.close()
+
+    with app.app_context():
+        conn = db.get_db()
+        report = consolidation.merge(conn, [str(tmp_path / 'office.db')], workers=1)
+
+        assert report['lookup_conflicts'] == [{'source': str(tmp_path / 'office.db'), 'sub_caste': 'Orphan',
+                                               'conflict': 'caste 99 is not in the source'}]
+        assert conn.execute("SELECT COUNT(*) FROM sub_castes WHERE sub_caste_name = 'Orphan'").fetchone()[0] == 0
+        assert tuple(conn.execute("SELECT caste_id, reservation_category FROM sub_castes "
+                                  "WHERE sub_caste_name = 'Maratha'").fetchone()) == (1, 'SEBC')
+        employees = conn.execute('SELECT full_name, sub_caste_id FROM employees ORDER BY full_name').fetchall()
+        assert [(row[0], row[1] is None) for row in employees] == [('Anil Patil', False), ('Sunil Patil', True)]
+
+
+def test_reservation_category_fills_in_the_master_sub_caste(app, tmp_path):
+    # Both databases are seeded with the sub-caste, without a category
+    source = _source(app, tmp_path / 'office.db')
+    source.execute("UPDATE sub_castes SET reservation_category = 'SC' WHERE sub_caste_name = 'मागासवर्ग'")
+    source.commit()
+    source.close()
+
+    with app.app_context():
+        conn = db.get_db()
+        report = consolidation.merge(conn, [str(tmp_path / 'office.db')], workers=1)
+
+        assert report['lookup_conflicts'] == []
+        assert conn.execute("SELECT reservation_category FROM sub_castes "
+                            "WHERE sub_caste_name = 'मागासवर्ग'").fetchone()[0] == 'SC'
@@ -0,0 +1,61 @@
+import io
+import os
+import time
+
+import db
+import jobs
+
+
+def _wait(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get('/api/jobs/%d' % job_id).get_json()
+        if job['status'] not in ('queued', 'running') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def test_submit_rejects_caller_upload_path(client, tmp_path):
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('keep me')
+
+    response = client.post('/api/jobs', json={'kind': 'retirement_forecast',
+                                              'params': {'upload': str(victim)}})
+    assert response.status_code == 400
+    assert victim.exists()
+
+
+def test_remove_leaves_files_outside_jobs_dir(app, tmp_path):
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('keep me')
+
+    with app.app_context():
+        jobs._remove(str(victim))
+        jobs._remove(os.path.join(jobs.jobs_dir(), '..', 'victim.txt'))
+    assert victim.exists()
+
+
+def test_import_upload_removed_when_done(app, client):
+    data = {'kind': 'import', 'file': (io.BytesIO('full_name\nराम\n'.encode('utf-8')), 'e.csv')}
+    response = client.post('/api/jobs', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    assert 'upload' not in response.get_json()['params']
+
+    job = _wait(client, response.get_json()['id'])
+    assert job['status'] == 'done'
+    assert not [name for name in os.listdir(app.config['JOBS_DIR']) if name.startswith('upload-')]
+
+
+def test_running_job_of_restarted_process_with_same_pid_is_failed(app, client):
+    with app.app_context():
+        conn = db.get_db()
+        # Left 'running' by an earlier process that had this same pid
+        job_id = conn.execute('''INSERT INTO jobs (kind, status, worker_pid, worker_token)
+                                 VALUES ('retirement_forecast', 'running', ?, 'earlier')''',
+                              (os.getpid(),)).lastrowid
+        conn.commit()
+
+    client.get('/api/jobs')
+    job = client.get('/api/jobs/%d' % job_id).get_json()
+    assert job['status'] == 'failed'
+    assert job['error'] == 'Interrupted by a restart'
@@ -0,0 +1,21 @@
+import io
+import re
+
+
+def _metric(client, name, endpoint):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(r'^%s\{endpoint="%s"\} (\S+)$' % (name, endpoint), text, re.M)
+    return float(match.group(1)) if match else 0
+
+
+def test_streamed_export_statements_are_counted(app, client):
+    rows = ''.join('कर्मचारी %d,M,1980-01-01\n' % i for i in range(30))
+    data = {'file': (io.BytesIO(('full_name,gender,birth_date\n' + rows).encode('utf-8')), 'e.csv')}
+    assert client.post('/api/employees/import', data=data, content_type='multipart/form-data').status_code == 200
+
+    response = client.get('/employees/export?format=jsonl')
+    assert len(response.get_data().splitlines()) == 30
+    response.close()
+
+    assert _metric(client, 'db_queries_total', 'export_employees') >= 1
+    assert _metric(client, 'db_rows_returned_total', 'export_employees') >= 30
@@ -0,0 +1,37 @@
+import os
+
+import db
+import report_db
+
+
+def _count(conn):
+    return conn.execute('SELECT COUNT(*) FROM employees').fetchone()[0]
+
+
+def test_refresh_leaves_an_open_snapshot_alone(app):
+    app.config['REPORT_MAX_STALENESS'] = 3600
+    try:
+        with app.app_context():
+            held = report_db.get_report_db()
+            held.execute('BEGIN')
+            before = _count(held)
+
+            live = db.get_db()
+            live.execute("INSERT INTO employees (full_name, gender, birth_date) VALUES ('Anil Patil', 'M', '1980-01-01')")
+            live.commit()
+
+            # A refresh while the report connection above is mid-read
+            name, _ = report_db.refresh(app.config)
+            assert name != held.report_file
+            assert os.path.exists(held.report_file)
+            assert _count(held) == before
+            held.commit()
+
+        # The held connection went back to the pool; it is not reused
+        with app.app_context():
+            conn = report_db.get_report_db()
+            assert conn is not held
+            assert conn.report_file == name
+            assert _count(conn) == before + 1
+    finally:
+        report_db.close_pool()
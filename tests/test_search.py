@@ -0,0 +1,16 @@
+import unicodedata
+
+import db
+import employee_search
+
+
+def test_decomposed_name_matches_the_same_decomposed_query(app):
+    # न + nukta, which NFC composes into ऩ
+    name = 'अऩील पाटील'
+    assert unicodedata.normalize('NFC', name) != name
+
+    with app.app_context():
+        conn = db.get_db()
+        conn.execute("INSERT INTO employees (full_name, gender, birth_date) VALUES (?, 'M', '1980-01-01')", (name,))
+        conn.commit()
+        assert [row['full_name'] for row in employee_search.search(conn, name.split()[0])] == [name]
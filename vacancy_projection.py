@@ -0,0 +1,99 @@
+# Vacancy projection
+#
+# For every office x designation post in office_positions, projects the
+# number of vacant posts at the end of each month over a horizon, assuming
+# retirements are not replaced: vacant = approved - (filled - retirements so
+# far). Scheduled retirements come from a single pass over the covering
+# retirement_date index, already in date order, so each retirement is
+# counted once into its cell and month; the cumulative sums follow in
+# memory. No query is run per cell or per month.
+#
+# Results are cached until employees, office_positions, offices or
+# designations change (see http_cache.cached_by_versions).
+from datetime import date
+
+import lookups
+from http_cache import cached_by_versions
+
+DEFAULT_MONTHS = 24
+MAX_MONTHS = 120
+
+DEPENDS_ON = ('employees', 'office_positions', 'offices', 'designations')
+
+POSITIONS_SQL = '''SELECT office_id, designation_id,
+                   COALESCE(approved_count, 0) AS approved, COALESCE(filled_count, 0) AS filled
+                   FROM office_positions
+                   ORDER BY office_id, designation_id'''
+
+RETIREMENTS_SQL = '''SELECT e.retirement_date, e.office_id, e.designation_id
+                     FROM employees e
+                     WHERE e.retirement_date >= ? AND e.retirement_date < ?
+                     ORDER BY e.retirement_date'''
+
+
+def _add_months(start, months):
+    year, month = divmod(start.month - 1 + months, 12)
+    return date(start.year + year, month + 1, 1)
+
+
+def build(conn, start, months):
+    end = _add_months(start, months)
+    lookup = lookups.get_lookups(conn)
+    office_names = {row['id']: row['office_name'] for row in lookup['offices']}
+    designation_names = {row['id']: row['designation_name'] for row in lookup['designations']}
+
+    positions = conn.execute(POSITIONS_SQL).fetchall()
+    # (office_id, designation_id) -> retirements per month
+    retirements = {(row['office_id'], row['designation_id']): [0] * months for row in positions}
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(RETIREMENTS_SQL, (start.isoformat(), end.isoformat()))
+    for retirement_date, office_id, designation_id in cursor:
+        counts = retirements.get((office_id, designation_id))
+        if counts is not None:
+            index = (int(retirement_date[:4]) - start.year) * 12 + int(retirement_date[5:7]) - start.month
+            counts[index] += 1
+
+    cells = []
+    total_vacant = [0] * months
+    total_retirements = [0] * months
+    for row in positions:
+        counts = retirements[row['office_id'], row['designation_id']]
+        filled = row['filled']
+        vacant = []
+        for index, count in enumerate(counts):
+            filled -= count
+            vacant.append(row['approved'] - filled)
+            total_vacant[index] += vacant[-1]
+            total_retirements[index] += count
+
+        cells.append({
+            'office_id': row['office_id'],
+            'office_name': office_names.get(row['office_id']),
+            'designation_id': row['designation_id'],
+            'designation_name': designation_names.get(row['designation_id']),
+            'approved': row['approved'],
+            'filled': row['filled'],
+            'vacant': row['approved'] - row['filled'],
+            'retirements': counts,
+            'projected_vacant': vacant,
+        })
+
+    return {
+        'start': start.isoformat(),
+        'months': ['%04d-%02d' % (month.year, month.month)
+                   for month in (_add_months(start, i) for i in range(months))],
+        'cells': cells,
+        'total_retirements': total_retirements,
+        'total_projected_vacant': total_vacant,
+    }
+
+
+# Projection over the next `months` months, starting with the current one.
+# The result is shared between requests and must not be modified.
+def get_projection(conn, months=DEFAULT_MONTHS, today=None):
+    today = today or date.today()
+    start = date(today.year, today.month, 1)
+    return cached_by_versions(conn, DEPENDS_ON, ('vacancies', start, months),
+                              lambda: build(conn, start, months))